@@ -0,0 +1,79 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pvaccess as pva
+
+from aborttl.pvarpc_server import AbortRPC
+
+import dataset
+
+
+'''
+Time of AbortRPC.get_annotations over aborts with hundreds of signals
+each, split into the query and the annotation builder.
+'''
+WINDOW = ('2016-01-01 00:00:00', '2020-01-01 00:00:00')
+
+
+def best(func, repeat):
+    elapsed = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed), result
+
+
+def run(uri, repeat):
+    rpc = AbortRPC(uri, cache_size=0)
+
+    kwargs = {'astart': WINDOW[0], 'aend': WINDOW[1], 'with_ts_ns': True}
+    t_fetch, (data, cursor) = best(
+            lambda: rpc._dh.fetch_abort_signals_columns(**kwargs), repeat)
+    t_build, ann = best(lambda: rpc.data2annotation(data), repeat)
+
+    x = pva.PvObject({'starttime': pva.STRING, 'endtime': pva.STRING})
+    x['starttime'], x['endtime'] = WINDOW
+    t_total, table = best(lambda: rpc.get_annotations(x), repeat)
+
+    print('{} aborts, {} signals'.format(len(ann['time']), len(data['ts'])))
+    print('fetch {:.1f} ms, build {:.1f} ms, get_annotations {:.1f} ms'
+          .format(t_fetch * 1e3, t_build * 1e3, t_total * 1e3))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Time of building the annotations of aborts.')
+    parser.add_argument('-a', dest='n_aborts', type=int, default=3000,
+                        help='number of aborts of the dataset')
+    parser.add_argument('-s', dest='signals_per_abort', type=int,
+                        default=200, help='mean number of signals of an abort')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='number of runs of each step, the best is used')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, 'dataset.db')
+        uri = 'sqlite:///' + path
+        if not os.path.exists(path):
+            n_signals = args.n_aborts * args.signals_per_abort
+            print('Generate {} signals'.format(n_signals), flush=True)
+            dataset.generate(uri, n_signals,
+                             signals_per_abort=args.signals_per_abort)
+
+        run(uri, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
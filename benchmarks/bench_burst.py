@@ -0,0 +1,74 @@
+import argparse
+import os
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from aborttl.dbhandler import DbHandler
+
+
+def make_burst(n_signals, abt_id):
+    signals = []
+    for i in range(n_signals):
+        ts = '2019-01-01 00:00:00.{}'.format(str(i).zfill(9))
+        signals.append({'pvname': 'PV{}'.format(i),
+                        'msg': 'Abort {}'.format(i), 'pv_ts': ts,
+                        'abt_ts': ts, 'reset_cnt': 0, 'trg_cnt': i,
+                        'int_cnt': i, 'abt_id': abt_id})
+    return signals
+
+
+def bench_per_signal(dh, signals):
+    abt_id = dh.insert_abort(signals[0]['abt_ts'])
+    for signal in signals:
+        signal = dict(signal)
+        del signal['abt_id']
+        dh.insert_abort_signals([signal], abt_id)
+
+
+def bench_burst(dh, signals):
+    abt_id = signals[0]['abt_id']
+    aborts = [{'abt_id': abt_id, 'abt_time': signals[0]['abt_ts']}]
+    dh.insert_abort_burst(aborts, signals)
+
+
+def run(bench, n_signals):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        dh = DbHandler(uri)
+        dh.insert_pvs([{'pvname': 'PV{}'.format(i), 'ring': 'HER'}
+                       for i in range(n_signals)])
+
+        commits = []
+        sa.event.listen(dh.engine, 'commit', lambda c: commits.append(c))
+
+        signals = make_burst(n_signals, 1)
+        start = time.perf_counter()
+        bench(dh, signals)
+        elapsed = time.perf_counter() - start
+
+    return len(commits), elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Commits and time to persist one abort burst.')
+    parser.add_argument('-n', dest='n_signals', type=int, default=200,
+                        help='number of abort signals in the burst')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    for name, bench in [('per signal', bench_per_signal),
+                        ('burst', bench_burst)]:
+        commits, elapsed = run(bench, args.n_signals)
+        print('{:>10}: {} signals, {} commits, {:.1f} ms'
+              .format(name, args.n_signals, commits, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+import time
+
+from aborttl.dbhandler import DbHandler
+
+import dataset
+
+
+'''
+Compare the message search of fetch_abort_signals by LIKE with the
+FTS5 token and prefix search on a synthetic dataset. Messages of the
+dataset are '<ring> <system> abort <pv number>'.
+'''
+TERMS = ['1234', '123', 'KICKER', 'HER KICKER']
+
+
+def search(dh, term, mode, repeat):
+    elapsed = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        rows = dh.fetch_abort_signals(msg=term, msg_mode=mode, first=False,
+                                      include_no_abt_id=True)
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed), len(rows)
+
+
+def run(uri, terms, repeat):
+    dh = DbHandler(uri)
+
+    print('{:<15}{:>22}{:>22}{:>22}'.format('term', 'substring (LIKE)',
+                                            'token', 'prefix'))
+    for term in terms:
+        results = [search(dh, term, mode, repeat)
+                   for mode in ('substring', 'token', 'prefix')]
+        like = results[0][0]
+        cells = ['{:>8.3f} s{:>8} rows'.format(*results[0])]
+        cells += ['{:>7.3f} s{:>7}{:>6.0f}x'.format(t, n, like / t)
+                  for t, n in results[1:]]
+        print('{:<15}'.format(term) + ''.join(cells), flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Message search by LIKE and FTS5.')
+    parser.add_argument('-n', dest='n_signals', type=int, default=2 * 10 ** 6,
+                        help='number of abort signals of the dataset')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='number of runs of each search, the best is used')
+    parser.add_argument('terms', nargs='*', default=TERMS,
+                        help='search terms')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, 'dataset.db')
+        uri = 'sqlite:///' + path
+        if not os.path.exists(path):
+            print('Generate {} signals'.format(args.n_signals), flush=True)
+            start = time.perf_counter()
+            dataset.generate(uri, args.n_signals)
+            print('{:.1f} s'.format(time.perf_counter() - start), flush=True)
+
+        run(uri, args.terms, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
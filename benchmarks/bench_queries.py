@@ -0,0 +1,201 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from aborttl.dbhandler import DbHandler
+
+import dataset
+
+
+'''
+Time every flag combination of DbHandler.fetch_abort_signals and
+fetch_current_pvs on a synthetic dataset and compare the timings and
+the numbers of rows with a stored baseline. A query running longer than
+the timeout is interrupted and reported as timeout.
+'''
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+WINDOW = ('2017-01-01 00:00:00', '2017-02-01 00:00:00')
+
+
+def make_cases():
+    cases = [('fetch_current_pvs', 'fetch_current_pvs', {})]
+
+    flags = itertools.product([True, False], [True, False], [True, False],
+                              [None, 'HER'], [None, 'RF'],
+                              [None, 'abort', 'signal'])
+    for first, no_abt_id, delta, ring, msg, window in flags:
+        kwargs = {'first': first, 'include_no_abt_id': no_abt_id,
+                  'with_time_delta': delta, 'ring': ring, 'msg': msg}
+        if window == 'abort':
+            kwargs['astart'], kwargs['aend'] = WINDOW
+        elif window == 'signal':
+            kwargs['sstart'], kwargs['send'] = WINDOW
+
+        name = ('signals first={:d} no_abt_id={:d} delta={:d} ring={} '
+                'msg={} window={}'.format(first, no_abt_id, delta, ring, msg,
+                                          window))
+        cases.append((name, 'fetch_abort_signals', kwargs))
+
+    return cases
+
+
+class Deadline(object):
+    '''
+    SQLite progress handler interrupting a query after timeout [s].
+    '''
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.time = None
+
+    def start(self):
+        self.time = time.perf_counter() + self.timeout
+
+    def __call__(self):
+        return int(self.time is not None and time.perf_counter() > self.time)
+
+    def install(self, engine):
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.set_progress_handler(self, 10000)
+
+        sa.event.listen(engine, 'connect', connect)
+
+
+def run_case(dh, deadline, method, kwargs, repeat):
+    '''
+    Return the best time and the number of rows of repeat runs, or None
+    and None when the query is interrupted by deadline.
+    '''
+    elapsed = []
+    for i in range(repeat):
+        deadline.start()
+        start = time.perf_counter()
+        try:
+            rows = getattr(dh, method)(**kwargs)
+        except sa.exc.OperationalError:
+            return None, None
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed), len(rows)
+
+
+def compare(result, base, tolerance):
+    '''
+    Return the status of result against the baseline result. Slower than
+    tolerance times the baseline, other numbers of rows or a timeout
+    which the baseline did not have are regressions.
+    '''
+    if base is None:
+        return 'new'
+    if result['seconds'] is None:
+        return 'timeout' if base['seconds'] is None else 'TIMEOUT'
+    if base['seconds'] is None:
+        return 'ok'
+    if result['rows'] != base['rows']:
+        return 'ROWS {} != {}'.format(result['rows'], base['rows'])
+    if result['seconds'] > base['seconds'] * tolerance:
+        return 'SLOW'
+
+    return 'ok'
+
+
+def format_result(name, result, base, status):
+    if result['seconds'] is None:
+        return '{:<75}{:>12}{:>15}  {}'.format(name, 'timeout', '', status)
+
+    ratio = ''
+    if base and base['seconds']:
+        ratio = '{:.2f}x'.format(result['seconds'] / base['seconds'])
+
+    return '{:<75}{:>10.4f} s{:>9} rows{:>8}  {}'.format(
+            name, result['seconds'], result['rows'], ratio, status)
+
+
+def run(uri, cases, baseline, args):
+    dh = DbHandler(uri)
+    deadline = Deadline(args.timeout)
+    deadline.install(dh.engine)
+
+    results = {}
+    regressions = []
+    for name, method, kwargs in cases:
+        if args.pattern and args.pattern not in name:
+            continue
+
+        seconds, rows = run_case(dh, deadline, method, kwargs, args.repeat)
+        results[name] = {'seconds': seconds, 'rows': rows}
+
+        base = baseline.get(name)
+        status = compare(results[name], base, args.tolerance)
+        if status not in ('new', 'ok', 'timeout'):
+            regressions.append(name)
+
+        print(format_result(name, results[name], base, status), flush=True)
+
+    return results, regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Query benchmark of DbHandler with baselines.')
+    parser.add_argument('-n', dest='n_signals', type=int, default=10 ** 5,
+                        help='number of abort signals of the dataset')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='number of runs of each case, the best is used')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='run only cases whose name contains this')
+    parser.add_argument('-b', '--baseline', dest='baseline', default=None,
+                        help='baseline file, '
+                             'baselines/queries_<n_signals>.json by default')
+    parser.add_argument('-t', dest='tolerance', type=float, default=1.5,
+                        help='allowed slowdown from the baseline')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=30,
+                        help='time limit of a query [s]')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    baseline_path = args.baseline or os.path.join(
+            BASELINE_DIR, 'queries_{}.json'.format(args.n_signals))
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, 'dataset.db')
+        uri = 'sqlite:///' + path
+        if not os.path.exists(path):
+            print('Generate {} signals'.format(args.n_signals), flush=True)
+            dataset.generate(uri, args.n_signals)
+
+        results, regressions = run(uri, make_cases(), baseline, args)
+
+    if args.save:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Saved {}'.format(baseline_path))
+    elif regressions:
+        print('{} regressions'.format(len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from aborttl.dbhandler import DbHandler
+from aborttl.aborttl import Aborttl
+from aborttl.logger import get_default_logger
+from aborttl.replay import TraceEntry, ReplaySource, load_trace
+
+
+RESET_PV = 'BENCH:RESET'
+
+
+def make_trace(n_channels, n_bursts):
+    '''
+    Every channel aborts in each burst and clears in the middle of the
+    interval to the next burst. Bursts are 10 s apart in abort time.
+    '''
+    trace = []
+    for burst in range(n_bursts):
+        t = burst * 0.1
+        sec = 1546268400 + burst * 10
+        for i in range(n_channels):
+            pvname = 'CH{}'.format(i)
+            trace.append(TraceEntry(t + i * 1e-6, pvname, 1, [burst, 0],
+                                    [sec, i * 1000]))
+            trace.append(TraceEntry(t + 0.05, pvname, 0, None, None))
+
+    return trace
+
+
+def run(trace, uri, speed, logger):
+    pvnames = sorted({entry.pvname for entry in trace} - {RESET_PV})
+    n_events = sum(1 for entry in trace
+                   if entry.pvname != RESET_PV and entry.value is not None)
+
+    dh = DbHandler(uri)
+    pvs = [{'pvname': pvname, 'ring': 'HER' if i % 2 else 'LER'}
+           for i, pvname in enumerate(pvnames)]
+    dh.insert_pvs(pvs)
+    dh.update_current_pvs([{'pvname': pv['pvname'], 'msg': ''} for pv in pvs])
+
+    source = ReplaySource(trace, speed=speed)
+    atl = Aborttl(uri, RESET_PV, source=source, logger=logger)
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    atl.wait_ready()
+
+    start = time.perf_counter()
+    source.start()
+    while atl.stats()['events'] < n_events:
+        time.sleep(0.001)
+    atl.stop()
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    n_aborts = len(dh.fetch_aborts())
+
+    return n_events / elapsed, n_aborts / elapsed, atl.latency.dump()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Throughput of Aborttl replaying an event trace '
+                        'without EPICS.')
+    parser.add_argument('-t', dest='trace', default=None,
+                        help='trace file, a synthetic trace when omitted')
+    parser.add_argument('-n', dest='n_channels', type=int, default=1000,
+                        help='number of channels of the synthetic trace')
+    parser.add_argument('-b', dest='n_bursts', type=int, default=20,
+                        help='number of abort bursts of the synthetic trace')
+    parser.add_argument('-s', dest='speed', type=float, default=0,
+                        help='replay speed, 1 = real time, 0 = no wait')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    logger = get_default_logger()
+    logger.setLevel('WARNING')
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = make_trace(args.n_channels, args.n_bursts)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        events, aborts, latency = run(trace, uri, args.speed, logger)
+
+    print('{:.0f} events/s, {:.1f} aborts/s'.format(events, aborts))
+    print(latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import random
+import time
+
+from aborttl.aborttl import RingStatus
+
+
+def sum_ring_status(statuses, transitions):
+    for ring, pvname, abort in transitions:
+        statuses[ring][pvname] = abort
+        for r in statuses:
+            sum(statuses[r].values())
+
+
+def counter_ring_status(rs, transitions):
+    for ring, pvname, abort in transitions:
+        rs.update(ring, pvname, abort)
+        for r in rs.counts:
+            rs.is_abort(r)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Ring status update per abort transition.')
+    parser.add_argument('-n', dest='n_channels', type=int, default=10000,
+                        help='number of synthetic channels')
+    parser.add_argument('-t', dest='n_transitions', type=int, default=10000,
+                        help='number of chattering transitions')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(0)
+
+    channels = [('HER' if i % 2 else 'LER', 'CH{}'.format(i))
+                for i in range(args.n_channels)]
+    transitions = [rng.choice(channels) + (rng.random() < 0.5,)
+                   for i in range(args.n_transitions)]
+
+    statuses = {'LER': {}, 'HER': {}}
+    rs = RingStatus()
+    for ring, pvname in channels:
+        statuses[ring][pvname] = False
+        rs.update(ring, pvname, False)
+
+    for name, bench, state in [('sum', sum_ring_status, statuses),
+                               ('counter', counter_ring_status, rs)]:
+        start = time.perf_counter()
+        bench(state, transitions)
+        elapsed = time.perf_counter() - start
+        print('{:>8}: {} channels, {:.2f} us/transition'
+              .format(name, args.n_channels,
+                      elapsed / args.n_transitions * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pvaccess as pva
+
+from aborttl.pvarpc_server import AbortRPC
+
+import dataset
+
+
+'''
+Response time of the AbortRPC services without the result cache for a
+window over the whole synthetic dataset, which returns about n_signals
+rows, and for a page of it.
+'''
+WINDOW = ('2016-01-01T00:00:00', '2020-01-01T00:00:00')
+
+
+def make_request(**fields):
+    x = pva.PvObject({key: pva.STRING for key in fields})
+    for key, value in fields.items():
+        x[key] = value
+    return x
+
+
+def run(uri, repeat, limit):
+    rpc = AbortRPC(uri, cache_size=0)
+
+    window = {'starttime': WINDOW[0], 'endtime': WINDOW[1]}
+    cases = [('get_signals', make_request(**window)),
+             ('get_grouped_signals', make_request(**window)),
+             ('get_annotations', make_request(**window)),
+             ('get_signals limit={}'.format(limit),
+              make_request(limit=str(limit), **window))]
+
+    for name, x in cases:
+        service = getattr(rpc, name.split()[0])
+        elapsed = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            table = service(x)
+            elapsed.append(time.perf_counter() - start)
+
+        print('{:<30}{:>10.1f} ms{:>9} rows'.format(
+              name, min(elapsed) * 1e3, len(table['value']['column0'])),
+              flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Response time of the AbortRPC services.')
+    parser.add_argument('-n', dest='n_signals', type=int, default=10 ** 5,
+                        help='number of abort signals of the dataset')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='number of runs of each case, the best is used')
+    parser.add_argument('-l', dest='limit', type=int, default=1000,
+                        help='rows of the paged request')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, 'dataset.db')
+        uri = 'sqlite:///' + path
+        if not os.path.exists(path):
+            print('Generate {} signals'.format(args.n_signals), flush=True)
+            dataset.generate(uri, args.n_signals)
+
+        run(uri, args.repeat, args.limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from aborttl.abortch import AbortEvent
+from aborttl.dbhandler import DbHandler
+from aborttl.aborttl import Aborttl
+from aborttl.logger import get_default_logger
+from aborttl.shard import ShardedAborttl
+
+
+'''
+Parameters of the synthetic channels are passed to the worker processes
+through environment variables since they import this module again.
+'''
+N_EVENTS = int(os.environ.get('BENCH_SHARD_EVENTS', 0))
+CB_COST = float(os.environ.get('BENCH_SHARD_CB_COST', 0))
+START = float(os.environ.get('BENCH_SHARD_START', 0))
+
+
+class SyntheticCh(object):
+    '''
+    Abort channel toggling its abort status N_EVENTS times. CB_COST [s]
+    of CPU time is spent per update to emulate the CA callback.
+    '''
+    channels = []
+
+    def __init__(self, pvname, cb, logger=None, source=None):
+        self.connected = True
+        self.abort = False
+
+        self._pvname = pvname
+        self._cb = cb
+
+        SyntheticCh.channels.append(self)
+        if len(SyntheticCh.channels) == 1:
+            thread = threading.Thread(target=self._emit_all)
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _emit_all():
+        time.sleep(max(START - time.time(), 0))
+
+        for i in range(N_EVENTS):
+            for ch in SyntheticCh.channels:
+                end = time.perf_counter() + CB_COST
+                while time.perf_counter() < end:
+                    pass
+
+                ch.abort = not ch.abort
+                ch._cb(ch.snapshot())
+
+    def snapshot(self, event=None):
+        t = time.time()
+        sec = int(t)
+        dt = datetime.fromtimestamp(sec)
+        ts = dt.isoformat(' ') + '.' + str(int((t - sec) * 1e9)).zfill(9)
+
+        return AbortEvent(self._pvname, self.abort, 0, 0, sec, ts, sec, ts)
+
+
+def run(n_workers, n_channels, uri, logger):
+    dh = DbHandler(uri)
+    pvs = [{'pvname': 'CH{}'.format(i), 'ring': 'HER' if i % 2 else 'LER'}
+           for i in range(n_channels)]
+    dh.insert_pvs(pvs)
+    dh.update_current_pvs([{'pvname': pv['pvname'], 'msg': ''} for pv in pvs])
+
+    os.environ['BENCH_SHARD_START'] = str(time.time() + 3)
+
+    if n_workers:
+        atl = ShardedAborttl(uri, 'BENCH:RESET', n_workers=n_workers,
+                             channel_class=SyntheticCh, logger=logger)
+    else:
+        global START
+        START = float(os.environ['BENCH_SHARD_START'])
+        SyntheticCh.channels = []
+        atl = Aborttl(uri, 'BENCH:RESET', channel_class=SyntheticCh,
+                      logger=logger)
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+
+    total = n_channels * N_EVENTS
+    while atl.stats()['events'] == 0:
+        time.sleep(0.001)
+    start = time.perf_counter()
+    while atl.stats()['events'] < total:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    atl.stop()
+    thread.join()
+
+    return total / elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Events per second of Aborttl by number of workers.')
+    parser.add_argument('-w', dest='workers', type=int, nargs='+',
+                        default=[0, 1, 2, 4],
+                        help='numbers of workers, 0 = single process')
+    parser.add_argument('-n', dest='n_channels', type=int, default=1000,
+                        help='number of synthetic channels')
+    parser.add_argument('-e', dest='n_events', type=int, default=20,
+                        help='number of updates per channel')
+    parser.add_argument('-c', dest='cb_cost', type=float, default=100,
+                        help='CPU time per channel update [us]')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ['BENCH_SHARD_EVENTS'] = str(args.n_events)
+    os.environ['BENCH_SHARD_CB_COST'] = str(args.cb_cost * 1e-6)
+
+    global N_EVENTS, CB_COST
+    N_EVENTS = args.n_events
+    CB_COST = args.cb_cost * 1e-6
+
+    logger = get_default_logger()
+    logger.setLevel('WARNING')
+
+    # the workers only scale with a CPU each besides the coordinator
+    n_cpus = len(os.sched_getaffinity(0))
+    print('{} CPUs'.format(n_cpus))
+    if max(args.workers) + 1 > n_cpus:
+        print('Warning: fewer CPUs than processes, the rate does not scale')
+
+    base = None
+    for n_workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+            rate = run(n_workers, args.n_channels, uri, logger)
+
+        base = base or rate
+        print('{} workers: {:.0f} events/s, x{:.2f}'
+              .format(n_workers, rate, rate / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from aborttl.abortch import AbortCh
+from aborttl.dbhandler import DbHandler
+from aborttl.aborttl import Aborttl
+from aborttl.logger import get_default_logger
+
+
+SERVER_PORT = 12792
+REPEATER_PORT = 12793
+
+
+def write_db(path, n_channels):
+    with open(path, 'w') as f:
+        f.write('record(bo, "BENCH:RESET"){}\n')
+        for i in range(n_channels):
+            f.write('record(bo, "BENCH:CH{}"){{}}\n'.format(i))
+            for field in ('ACNT', 'TCNT', 'TIME_SEC', 'TIME_NANO'):
+                f.write('record(longout, "BENCH:CH{}:{}"){{}}\n'
+                        .format(i, field))
+
+
+def start_ioc(db_path):
+    env = os.environ.copy()
+    env['EPICS_CA_SERVER_PORT'] = str(SERVER_PORT)
+    env['EPICS_CA_REPEATER_PORT'] = str(REPEATER_PORT)
+
+    return subprocess.Popen(['softIoc', '-d', db_path],
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.STDOUT, env=env)
+
+
+def run(n_channels, uri, timeout, logger):
+    dh = DbHandler(uri)
+    pvs = [{'pvname': 'BENCH:CH{}'.format(i),
+            'ring': 'HER' if i % 2 else 'LER'}
+           for i in range(n_channels)]
+    dh.insert_pvs(pvs)
+    dh.update_current_pvs([{'pvname': pv['pvname'], 'msg': ''} for pv in pvs])
+
+    start = time.perf_counter()
+    atl = Aborttl(uri, 'BENCH:RESET', connection_timeout=timeout,
+                  logger=logger)
+    created = time.perf_counter() - start
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    atl.wait_ready()
+    ready = time.perf_counter() - start
+
+    startup = atl.stats()['startup']
+    atl.stop()
+    thread.join()
+
+    return created, ready, startup
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Startup time of Aborttl until all channels are '
+                        'connected and the initial states are read. '
+                        'softIoc must be in PATH.')
+    parser.add_argument('-n', dest='n_channels', type=int, default=5000,
+                        help='number of abort channels')
+    parser.add_argument('-t', dest='timeout', type=float, default=60,
+                        help='connection timeout [s]')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    os.environ['EPICS_CA_AUTO_ADDR_LIST'] = 'NO'
+    os.environ['EPICS_CA_ADDR_LIST'] = 'localhost:{}'.format(SERVER_PORT)
+    AbortCh.fields['ACNT'] = ':ACNT'
+    AbortCh.fields['TCNT'] = ':TCNT'
+
+    logger = get_default_logger()
+    logger.setLevel('WARNING')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        write_db(db_path, args.n_channels)
+
+        ioc = start_ioc(db_path)
+        try:
+            # wait until the IOC serves the records
+            time.sleep(max(1, args.n_channels / 2000))
+            uri = 'sqlite:///' + os.path.join(tmpdir, 'aborttl.db')
+            created, ready, startup = run(args.n_channels, uri,
+                                          args.timeout, logger)
+        finally:
+            ioc.stdin.close()
+            ioc.wait()
+
+    print('{} channels ({} PVs)'.format(args.n_channels,
+                                        args.n_channels * 5))
+    print('create channels: {:.3f} s'.format(created))
+    print('full connectivity: {:.3f} s'.format(startup['elapsed']))
+    print('ready: {:.3f} s'.format(ready))
+    print('unreachable: {}'.format(len(startup['unreachable'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from aborttl.dbhandler import DbHandler, STORAGE_PROFILES
+from aborttl.latency import LatencyHistogram
+
+import dataset
+
+
+'''
+Latency of the abort bursts written by the logger while reader
+processes run heavy queries on the same SQLite file, for each storage
+profile. Each profile runs on a fresh copy of the dataset since WAL
+mode stays in the file.
+'''
+START = 1546300800  # 2019-01-01 00:00:00 UTC, after the dataset
+QUERY = {'first': False, 'include_no_abt_id': True, 'with_time_delta': True,
+         'sstart': '2016-01-01 00:00:00', 'send': '2017-01-01 00:00:00'}
+
+
+def read(uri, storage, stop, counts):
+    dh = DbHandler(uri, storage)
+    while not stop.is_set():
+        try:
+            dh.fetch_abort_signals(**QUERY)
+            counts[0] += 1
+        except sa.exc.OperationalError:
+            counts[1] += 1
+
+
+def write(dh, pvnames, n_bursts, n_signals, interval):
+    histogram = LatencyHistogram()
+    errors = 0
+
+    abt_id = dh.fetch_last_abort_id()
+    for burst in range(n_bursts):
+        abt_id += 1
+        ts = dataset.format_ts(START + burst * 10, 0)
+        aborts = [{'abt_id': abt_id, 'abt_time': ts}]
+        signals = [{'pvname': pvname, 'msg': pvname, 'pv_ts': ts,
+                    'abt_ts': ts, 'reset_cnt': 0, 'trg_cnt': 0,
+                    'int_cnt': i, 'abt_id': abt_id}
+                   for i, pvname in enumerate(
+                       pvnames[burst % 10::10][:n_signals])]
+
+        start = time.perf_counter()
+        try:
+            dh.insert_abort_burst(aborts, signals)
+        except sa.exc.OperationalError:
+            errors += 1
+            abt_id -= 1
+        histogram.add(time.perf_counter() - start)
+        time.sleep(interval)
+
+    return histogram, errors
+
+
+def run(path, storage, args):
+    uri = 'sqlite:///' + path
+    dh = DbHandler(uri, storage)
+    pvnames = [pv['pvname'] for pv in dh.fetch_all_pvs()]
+
+    stop = multiprocessing.Event()
+    readers = []
+    for i in range(args.n_readers):
+        counts = multiprocessing.Array('i', 2)
+        reader = multiprocessing.Process(target=read,
+                                         args=(uri, storage, stop, counts))
+        reader.start()
+        readers.append((reader, counts))
+    time.sleep(1)
+
+    start = time.perf_counter()
+    histogram, errors = write(dh, pvnames, args.n_bursts, args.n_signals,
+                              args.interval)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for reader, counts in readers:
+        reader.join()
+    queries = sum(counts[0] for reader, counts in readers)
+    read_errors = sum(counts[1] for reader, counts in readers)
+
+    s = histogram.summary()
+    print('{:<10}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}{:>12.2f}{:>8}'.format(
+          storage, s['p50'] * 1e3, s['p99'] * 1e3, s['max'] * 1e3, errors,
+          queries / elapsed, read_errors), flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Burst write latency under concurrent reads for '
+                        'each storage profile.')
+    parser.add_argument('-n', dest='n_signals_db', type=int, default=10 ** 5,
+                        help='number of abort signals of the dataset')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist, copied for each profile')
+    parser.add_argument('-r', dest='n_readers', type=int, default=2,
+                        help='number of reader processes')
+    parser.add_argument('-b', dest='n_bursts', type=int, default=200,
+                        help='number of bursts to write')
+    parser.add_argument('-s', dest='n_signals', type=int, default=20,
+                        help='number of signals of a burst')
+    parser.add_argument('-i', dest='interval', type=float, default=0.02,
+                        help='interval between bursts [s]')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = args.db or os.path.join(tmpdir, 'dataset.db')
+        if not os.path.exists(source):
+            print('Generate {} signals'.format(args.n_signals_db), flush=True)
+            dataset.generate('sqlite:///' + source, args.n_signals_db)
+
+        print('{:<10}{:>10}{:>10}{:>10}{:>8}{:>12}{:>8}'.format(
+              'profile', 'p50 [ms]', 'p99 [ms]', 'max [ms]', 'errors',
+              'queries/s', 'r.err'))
+        for storage in sorted(STORAGE_PROFILES):
+            path = os.path.join(tmpdir, storage + '.db')
+            shutil.copyfile(source, path)
+            run(path, storage, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aborttl.dbhandler import DbHandler
+
+import dataset
+
+
+'''
+Peak memory and time of reading the whole history with
+fetch_abort_signals and with iter_abort_signals on a synthetic dataset.
+'''
+KWARGS = {'first': False, 'include_no_abt_id': True}
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return n, elapsed, peak
+
+
+def run(uri, chunk_size):
+    dh = DbHandler(uri)
+
+    def fetch():
+        return len(dh.fetch_abort_signals(**KWARGS))
+
+    def stream():
+        return sum(1 for row in dh.iter_abort_signals(chunk_size=chunk_size,
+                                                      **KWARGS))
+
+    for name, func in (('fetch', fetch), ('iter', stream)):
+        n, elapsed, peak = measure(func)
+        print('{:<8}{:>10} rows{:>9.2f} s{:>10.1f} MiB peak'.format(
+              name, n, elapsed, peak / 2 ** 20), flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Memory of fetching and streaming abort signals.')
+    parser.add_argument('-n', dest='n_signals', type=int, default=10 ** 6,
+                        help='number of abort signals of the dataset')
+    parser.add_argument('-d', '--db', dest='db', default=None,
+                        help='sqlite file of the dataset, generated when it '
+                             'does not exist')
+    parser.add_argument('-c', dest='chunk_size', type=int, default=1000,
+                        help='rows read at a time by iter_abort_signals')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, 'dataset.db')
+        uri = 'sqlite:///' + path
+        if not os.path.exists(path):
+            print('Generate {} signals'.format(args.n_signals), flush=True)
+            dataset.generate(uri, args.n_signals)
+
+        run(uri, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import random
+import time
+
+from aborttl.dbhandler import DbHandler
+
+
+'''
+Generator of a synthetic abort history. Aborts happen a few times a day
+over the years from START. Each abort has a burst of signals from a
+subset of the PVs within a second, and some signals are not linked to
+any abort like the signals during the initial abort. Timestamps are
+formatted in UTC so the dataset does not depend on the local time zone.
+'''
+START = 1451606400  # 2016-01-01 00:00:00 UTC
+SYSTEMS = ['BM', 'RF', 'MR', 'VAC', 'BT', 'LOSS', 'KICKER', 'SCM']
+CHUNK = 50000
+
+
+def format_ts(sec, nsec):
+    return (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(sec)) +
+            '.' + str(nsec).zfill(9))
+
+
+def make_pvs(n_pvs):
+    pvs = []
+    for i in range(n_pvs):
+        system = SYSTEMS[i % len(SYSTEMS)]
+        ring = 'HER' if i % 2 else 'LER'
+        pvs.append({'pvname': 'ET_{}:ABORT{}'.format(system, i),
+                    'ring': ring,
+                    'msg': '{} {} abort {}'.format(ring, system, i)})
+    return pvs
+
+
+def generate(uri, n_signals, n_pvs=2000, signals_per_abort=20,
+             unlinked_ratio=0.05, years=3, seed=0):
+    '''
+    Fill the DB of uri with n_signals abort signals.
+    Return the numbers of rows in each table.
+    '''
+    rand = random.Random(seed)
+    dh = DbHandler(uri)
+
+    pvs = make_pvs(n_pvs)
+    with dh.engine.begin() as conn:
+        conn.execute(dh.tables['pvs'].insert(),
+                     [{'pvname': pv['pvname'], 'ring': pv['ring']}
+                      for pv in pvs])
+        conn.execute(dh.tables['current_pvs'].insert(),
+                     [{'pvname': pv['pvname'], 'msg': pv['msg']}
+                      for pv in pvs])
+
+    n_aborts = max(n_signals // signals_per_abort, 1)
+    interval = years * 365 * 86400 / n_aborts
+
+    aborts = []
+    signals = []
+    links = []
+    counts = {'pvs': n_pvs, 'aborts': 0, 'abort_signals': 0,
+              'abort_list': 0}
+
+    def flush():
+        with dh.engine.begin() as conn:
+            if aborts:
+                conn.execute(dh.tables['aborts'].insert(), aborts)
+            if signals:
+                conn.execute(dh.tables['abort_signals'].insert(), signals)
+            if links:
+                conn.execute(dh.tables['abort_list'].insert(), links)
+
+        counts['aborts'] += len(aborts)
+        counts['abort_signals'] += len(signals)
+        counts['abort_list'] += len(links)
+        del aborts[:], signals[:], links[:]
+
+    signal_id = 0
+    abt_id = 0
+    while signal_id < n_signals:
+        abt_id += 1
+        sec = START + int((abt_id - 1) * interval +
+                          rand.random() * interval / 2)
+        nsec = rand.randrange(10 ** 9)
+        aborts.append({'abt_id': abt_id, 'abt_time': format_ts(sec, nsec)})
+
+        n_burst = max(1, round(rand.expovariate(1 / signals_per_abort)))
+        n_burst = min(n_burst, n_pvs, n_signals - signal_id)
+        for i, pv in enumerate(rand.sample(pvs, n_burst)):
+            signal_id += 1
+            delay = 0 if i == 0 else rand.randrange(10 ** 9)
+            s_sec, s_nsec = divmod(sec * 10 ** 9 + nsec + delay, 10 ** 9)
+            p_sec, p_nsec = divmod(s_sec * 10 ** 9 + s_nsec +
+                                   rand.randrange(10 ** 6), 10 ** 9)
+            signals.append({'abt_signal_id': signal_id,
+                            'pvname': pv['pvname'], 'msg': pv['msg'],
+                            'pv_ts': format_ts(p_sec, p_nsec),
+                            'abt_ts': format_ts(s_sec, s_nsec),
+                            'reset_cnt': rand.randrange(3),
+                            'trg_cnt': rand.randrange(1000),
+                            'int_cnt': rand.randrange(10 ** 6)})
+
+            if i and rand.random() < unlinked_ratio:
+                continue
+            links.append({'abt_id': abt_id, 'abt_signal_id': signal_id})
+
+        if len(signals) >= CHUNK:
+            flush()
+
+    flush()
+    counts['abort_summary'] = dh.rebuild_abort_summary()
+
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Generate a synthetic abort history database.')
+    parser.add_argument('uri', help='database URI')
+    parser.add_argument('-n', dest='n_signals', type=int, default=10 ** 5,
+                        help='number of abort signals')
+    parser.add_argument('-p', dest='n_pvs', type=int, default=2000,
+                        help='number of PVs')
+    parser.add_argument('-s', dest='seed', type=int, default=0,
+                        help='random seed')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.uri, args.n_signals, n_pvs=args.n_pvs,
+                      seed=args.seed)
+    elapsed = time.perf_counter() - start
+
+    print(', '.join('{} {}'.format(n, table) for table, n in counts.items()))
+    print('{:.1f} s'.format(elapsed))
+
+
+if __name__ == '__main__':
+    main()
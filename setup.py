@@ -34,6 +34,7 @@ setup(
     entry_points={
         'console_scripts': ['aborttl=aborttl.main:main',
                             'abtmigrate=aborttl.migration:main',
-                            'abtpvaserv=aborttl.pvarpc_server:main']
+                            'abtpvaserv=aborttl.pvarpc_server:main',
+                            'abtsummary=aborttl.summary:main']
     },
 )
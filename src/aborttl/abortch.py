@@ -1,67 +1,177 @@
+import time
+from collections import namedtuple
 from datetime import datetime
+from functools import partial
 
 from epics import PV
 
 from .logger import get_default_logger
 
 
+INVALID_TIMESTAMP = '1970-01-01 09:00:00.000000000'
+
+'''
+Immutable record of an abort channel update handed to the callback.
+timestamp is the abort time from the TIME_SEC and TIME_NANO PVs or
+INVALID_TIMESTAMP when they are not updated yet, pv_ts is the time of
+the abort record. t_cb and t_dq are the monotonic times of the callback
+and of the dequeue by the loop to measure the processing latency.
+seq is the number of the callback of the channel to tell the abort
+edges of a pvname apart.
+'''
+AbortEvent = namedtuple('AbortEvent', ['pvname', 'abort', 'acnt', 'tcnt',
+                                       'sec', 'timestamp', 'pv_sec', 'pv_ts',
+                                       't_cb', 't_dq', 'seq'],
+                        defaults=(None, None, None))
+
+
+def wait_connection(channels, timeout):
+    '''
+    Wait until all channels are connected or timeout [s] expires.
+    channels is a dict of channel name and channel.
+    Return the list of names of channels that are not connected.
+    '''
+    deadline = time.monotonic() + timeout
+    pending = list(channels.items())
+
+    while True:
+        pending = [(name, ch) for name, ch in pending if not ch.connected]
+        if not pending or time.monotonic() >= deadline:
+            return sorted(name for name, ch in pending)
+        time.sleep(0.01)
+
+
 class AbortCh(object):
+    '''
+    Abort channel of pvname with its counter and timestamp PVs. source is
+    the factory of the PVs with the signature of epics.PV (default).
+    '''
     fields = {'ACNT': '.ACNT', 'TCNT': '.TCNT',
               'SEC': ':TIME_SEC', 'NSEC': ':TIME_NANO'}
 
-    def __init__(self, pvname, cb, logger=None):
+    def __init__(self, pvname, cb, logger=None, source=None):
         self.logger = logger or get_default_logger()
+        self._source = source or PV
 
+        self._pvname = str(pvname)
         self._connection_update = True
         self._cb = cb
 
-        self._abortpv = PV(pvname=str(pvname), auto_monitor=True,
-                           callback=self._abort_update,
-                           connection_callback=self._on_connection)
-
-        self._acntpv = PV(pvname=str(pvname + self.fields['ACNT']),
-                          connection_callback=self._on_connection)
-
-        self._tcntpv = PV(pvname=str(pvname + self.fields['TCNT']),
-                          connection_callback=self._on_connection)
+        # values and timestamps cached by monitor callbacks
+        self._abort = None
+        self._abort_time = 0
+        self._abort_sec = 0
+        self._abort_nsec = 0
+        self._seq = 0
+        self._values = {field: None for field in self.fields}
+        self._times = {field: 0 for field in self.fields}
+
+        self._abortpv = self._source(pvname=self._pvname, auto_monitor=True,
+                                     callback=self._abort_update,
+                                     connection_callback=self._on_connection)
+
+        self._acntpv = self._create_subpv('ACNT')
+        self._tcntpv = self._create_subpv('TCNT')
+        self._secpv = self._create_subpv('SEC')
+        self._nsecpv = self._create_subpv('NSEC')
+
+    def _create_subpv(self, field):
+        return self._source(pvname=self._pvname + self.fields[field],
+                            auto_monitor=True,
+                            callback=partial(self._sub_update, field),
+                            connection_callback=self._on_connection)
+
+    def _sub_update(self, field, pvname=None, value=None, timestamp=0, **kw):
+        self._values[field] = value
+        self._times[field] = timestamp
+
+    def _abort_update(self, pvname=None, value=None, timestamp=0,
+                      posixseconds=0, nanoseconds=0, **kw):
+        t_cb = time.monotonic()
+        self._abort = value
+        self._abort_time = timestamp
+        self._abort_sec = posixseconds
+        self._abort_nsec = nanoseconds
 
-        self._secpv = PV(pvname=str(pvname + self.fields['SEC']),
-                         connection_callback=self._on_connection)
-
-        self._nsecpv = PV(pvname=str(pvname + self.fields['NSEC']),
-                          connection_callback=self._on_connection)
-
-    def _abort_update(self, pvname=None, value=None, **kw):
         if self._connection_update:
             self._connection_update = False
             self.logger.debug('{}: Clear connection update'.format(pvname))
             return
 
-        self._cb(pvname, value)
+        self._seq += 1
+        self._cb(self.snapshot()._replace(t_cb=t_cb, seq=self._seq))
 
     def _on_connection(self, pvname=None, conn=None, **kw):
         if not conn:
             self._connection_update = True
         self.logger.debug('{} connection change: {}'.format(pvname, conn))
 
-    def get_timestamp(self):
-        is_ts_valid = (self._secpv.timestamp > (self._abortpv.timestamp-5) and
-                       self._nsecpv.timestamp > (self._abortpv.timestamp-5)
+    def disconnect(self):
+        for pv in (self._abortpv, self._acntpv, self._tcntpv,
+                   self._secpv, self._nsecpv):
+            pv.clear_callbacks()
+            pv.disconnect()
+
+    def snapshot(self, event=None):
+        '''
+        Return AbortEvent from the cached values. The abort state, the
+        record time, the latency marks and seq are taken from event when it
+        is given.
+        '''
+        if event is None:
+            abort = bool(self._abort)
+            pv_sec = self._abort_sec
+            pv_ts = self._format_ts(self._abort_sec, self._abort_nsec)
+            t_cb = t_dq = seq = None
+        else:
+            abort = event.abort
+            pv_sec = event.pv_sec
+            pv_ts = event.pv_ts
+            t_cb = event.t_cb
+            t_dq = event.t_dq
+            seq = event.seq
+
+        return AbortEvent(self._pvname, abort,
+                          self._values['ACNT'], self._values['TCNT'],
+                          self._values['SEC'],
+                          self._get_timestamp(self._abort_time),
+                          pv_sec, pv_ts, t_cb, t_dq, seq)
+
+    def _get_timestamp(self, abort_time):
+        is_ts_valid = (self._times['SEC'] > (abort_time-5) and
+                       self._times['NSEC'] > (abort_time-5)
                        )
 
-        if not is_ts_valid:
-            return '1970-01-01 09:00:00.000000000'
+        if not is_ts_valid or not self._values['SEC']:
+            return INVALID_TIMESTAMP
+
+        return self._format_ts(self._values['SEC'], self._values['NSEC'])
 
-        dt = datetime.fromtimestamp(self._secpv.value)
+    def _format_ts(self, sec, nsec):
+        dt = datetime.fromtimestamp(sec)
         d = dt.isoformat(' ')
+        return d + '.' + str(int(nsec)).zfill(9)
 
-        return d + '.' + str(int(self._nsecpv.value)).zfill(9)
+    def get_timestamp(self):
+        return self._get_timestamp(self._abort_time)
 
     @property
     def ts(self):
-        dt = datetime.fromtimestamp(self._abortpv.posixseconds)
-        d = dt.isoformat(' ')
-        return d + '.' + str(int(self._abortpv.nanoseconds)).zfill(9)
+        return self._format_ts(self._abort_sec, self._abort_nsec)
+
+    @property
+    def connected(self):
+        '''
+        True when all PVs are connected and their first values arrived.
+        '''
+        if self._abort is None:
+            return False
+        if any(value is None for value in self._values.values()):
+            return False
+
+        return all(pv.connected for pv in (self._abortpv, self._acntpv,
+                                           self._tcntpv, self._secpv,
+                                           self._nsecpv))
 
     @property
     def abort(self):
@@ -69,16 +179,16 @@ class AbortCh(object):
 
     @property
     def acnt(self):
-        return self._acntpv.value
+        return self._values['ACNT']
 
     @property
     def tcnt(self):
-        return self._tcntpv.value
+        return self._values['TCNT']
 
     @property
     def ts_sec(self):
-        return self._secpv.value
+        return self._values['SEC']
 
     @property
     def ts_nsec(self):
-        return self._nsecpv.value
+        return self._values['NSEC']
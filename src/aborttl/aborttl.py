@@ -1,11 +1,43 @@
 import threading
 import time
-from queue import Queue
+from collections import Counter
+from queue import Queue, Empty
 
 from .logger import get_default_logger
 from .dbhandler import DbHandler
-from .abortch import AbortCh
+from .dbwriter import DbWriter
+from .abortch import AbortCh, wait_connection
 from .resetpvcounter import ResetPVCounter
+from .pending import TimestampResolver
+from .latency import LatencyStats
+
+
+def collect_events(q, timeout, batch_delay):
+    '''
+    Wait for the first item on q up to timeout, then collect the following
+    items until batch_delay expires. None wakes up the waiter.
+    '''
+    events = []
+
+    try:
+        event = q.get(timeout=timeout)
+    except Empty:
+        return events
+
+    deadline = time.monotonic() + batch_delay
+    while event is not None:
+        events.append(event)
+
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+
+        try:
+            event = q.get(timeout=timeout)
+        except Empty:
+            break
+
+    return events
 
 
 class AbortInfo(object):
@@ -24,94 +56,326 @@ class AbortInfo(object):
         self.iniail_abort = False
 
 
+class RingStatus(object):
+    '''
+    Abort status of each channel. The number of channels in abort is
+    counted per ring on every transition. edges are the abort edges
+    (pvname, seq) of the current abort of each ring, which are not
+    correlated yet.
+    '''
+
+    def __init__(self, rings=('LER', 'HER')):
+        self.statuses = {ring: {} for ring in rings}
+        self.counts = {ring: 0 for ring in rings}
+        self.edges = {ring: Counter() for ring in rings}
+
+    def update(self, ring, pvname, abort):
+        statuses = self.statuses[ring]
+        if statuses.get(pvname, False) != abort:
+            self.counts[ring] += 1 if abort else -1
+        statuses[pvname] = abort
+
+    def is_abort(self, ring):
+        return self.counts[ring] > 0
+
+    def any_abort(self):
+        return any(self.counts.values())
+
+    def remove(self, ring, pvname):
+        if self.statuses[ring].pop(pvname, False):
+            self.counts[ring] -= 1
+
+        edges = self.edges[ring]
+        for edge in [edge for edge in edges if edge[0] == pvname]:
+            del edges[edge]
+
+    def add_edge(self, ring, pvname, seq):
+        self.edges[ring][(pvname, seq)] += 1
+
+    def pop_edge(self, ring, pvname, seq):
+        '''
+        Return False when the ring is cleared since the abort edge.
+        '''
+        edges = self.edges[ring]
+        edge = (pvname, seq)
+        if not edges[edge]:
+            return False
+
+        edges[edge] -= 1
+        if not edges[edge]:
+            del edges[edge]
+        return True
+
+    def clear_edges(self, ring):
+        self.edges[ring].clear()
+
+
 class Aborttl(object):
     '''
-    _pvs = {'pvname': {'msg': , 'abortch':, 'ring': }}
-    _abt_statuses: dict of pvname. False = ready, True = abort
+    _pvs = {'pvname': {'msg': , 'ring': }}
+    _channels = {'pvname': AbortCh}
+    _ring_status: abort status of each pvname. False = ready, True = abort
+    source: factory of the PVs of the channels in this process, epics.PV
+            when None. See replay.ReplaySource.
+    storage: name of the storage profile of the DB, see DbHandler.
     '''
 
-    def __init__(self, dburi, resetpvname, logger=None):
+    def __init__(self, dburi, resetpvname, logger=None, batch_delay=0.01,
+                 writer_maxsize=1000, ts_retry_interval=0.05, ts_max_wait=10,
+                 ts_fallback='record', channel_class=AbortCh,
+                 pvlist_updater=None, connection_timeout=5,
+                 persist_latency=False, source=None, storage='default'):
         self._logger = logger or get_default_logger()
         self._resetpvname = resetpvname
 
-        self._dh = DbHandler(dburi)
+        self._dh = DbHandler(dburi, storage)
+        self._latency = LatencyStats()
+        self._writer = DbWriter(self._dh, maxsize=writer_maxsize,
+                                latency=self._latency,
+                                persist_latency=persist_latency,
+                                logger=self._logger)
         self._pvs = {}
 
         self._abt_q = Queue()
-        self._aborts = {'LER': {}, 'HER': {}}
+        self._ring_status = RingStatus()
         self._abtinfo = {'LER': AbortInfo(),
                          'HER': AbortInfo()}
+        self._last_abt_id = self._dh.fetch_last_abort_id()
 
         self.__is_stop = threading.Event()
         self.__stop_request = False
+        self._reload_request = False
+        self._pvlist_updater = pvlist_updater
         self._is_running = False
-
-        self._interval = 0.1
+        self._ready = threading.Event()
+        self._connection_timeout = connection_timeout
+        self._startup = {}
+
+        self._batch_delay = batch_delay
+        self._n_events = 0
+        self._loop_time = 0
+        self._max_loop_time = 0
+        self._channel_class = channel_class
+        self._source = source
+        self._channels = {}
+        self._ts_options = {'retry_interval': ts_retry_interval,
+                            'max_wait': ts_max_wait,
+                            'fallback': ts_fallback}
+        self._resolver = TimestampResolver(self._channels, logger=self._logger,
+                                           **self._ts_options)
         self._both_ring_interval = 5
 
         self._init_pv()
 
     def _init_pv(self):
-        self._resetpv = ResetPVCounter(self._resetpvname, logger=self._logger)
+        self._resetpv = ResetPVCounter(self._resetpvname, logger=self._logger,
+                                       source=self._source)
 
         self._update_pvlist()
 
-        for pvname, item in self._pvs.items():
-            item['abortch'] = AbortCh(pvname, self._cb, logger=self._logger)
-
-    def _cb(self, pvname=None, value=None):
-        self._logger.debug('Put {}, {} to queue'.format(pvname, bool(value)))
-        self._abt_q.put((pvname, bool(value)))
-
-    def _initial_abort_check(self):
-        is_abort = {'LER': 0, 'HER': 0}
+        # connections proceed in the background, run() waits for them
+        self._t_created = time.monotonic()
+        for pvname in self._pvs:
+            self._channels[pvname] = self._create_channel(pvname)
 
-        for pvname, pv in self._pvs.items():
-            ring = pv['ring']
-            abort = pv['abortch'].abort
+    def _create_channel(self, pvname):
+        return self._channel_class(pvname, self._cb, logger=self._logger,
+                                   source=self._source)
 
-            self._aborts[ring][pvname] = bool(abort)
-            is_abort[ring] += abort
+    def _cb(self, event):
+        self._logger.debug('Put {}, {} to queue'
+                           .format(event.pvname, event.abort))
+        self._abt_q.put(event)
 
-        self._abtinfo['LER'].iniail_abort = bool(is_abort['LER'])
-        self._abtinfo['HER'].iniail_abort = bool(is_abort['HER'])
+    def _initial_abort_check(self):
+        unreachable = wait_connection(self._channels,
+                                      self._connection_timeout)
+        self._report_startup(len(self._channels), unreachable)
+
+        skip = set(unreachable)
+        self._seed_statuses((pvname, bool(ch.abort))
+                            for pvname, ch in self._channels.items()
+                            if pvname not in skip)
+
+        for ring, abtinfo in self._abtinfo.items():
+            abtinfo.iniail_abort = self._ring_status.is_abort(ring)
+
+    def _seed_statuses(self, statuses):
+        '''
+        Set the abort status of the channels from [(pvname, abort)] read
+        once they are connected, as AbortCh drops their first update.
+        '''
+        for pvname, abort in statuses:
+            if pvname in self._pvs:
+                self._ring_status.update(self._pvs[pvname]['ring'], pvname,
+                                         abort)
+
+    def _report_startup(self, n_channels, unreachable):
+        elapsed = time.monotonic() - self._t_created
+        self._startup = {'channels': n_channels,
+                         'connected': n_channels - len(unreachable),
+                         'elapsed': elapsed,
+                         'unreachable': unreachable}
+
+        self._logger.info('{} of {} channels connected in {:.3f} s'
+                          .format(n_channels - len(unreachable), n_channels,
+                                  elapsed))
+        for pvname in unreachable:
+            self._logger.warning('{} is not connected'.format(pvname))
 
     def _update_pvlist(self):
         pvs = self._dh.fetch_current_pvs()
         self._pvs = {pv['pvname']: {'ring': pv['ring'], 'msg': pv['msg']}
                      for pv in pvs}
 
-    def _run_loop(self):
-        qsize = self._abt_q.qsize()
-        if qsize:
-            self._logger.debug('No. of update ch = {}'.format(qsize))
+    def request_reload(self):
+        '''
+        Reload the PV list in the loop thread. Safe to call from a signal
+        handler or another thread.
+        '''
+        self._reload_request = True
+        self._wake()
+
+    def reload_pvlist(self):
+        '''
+        Apply current_pvs in the database to the running logger. Only the
+        added channels are created and only the removed ones disconnected.
+        '''
+        start = time.monotonic()
+
+        if self._pvlist_updater is not None:
+            try:
+                self._pvlist_updater()
+            except Exception:
+                self._logger.exception('Failed to update PV list')
+                return None
+
+        old_pvs = self._pvs
+        self._update_pvlist()
 
-        for i in range(qsize):
-            pvname, abort = self._abt_q.get_nowait()
+        added = [pvname for pvname in self._pvs if pvname not in old_pvs]
+        removed = [pvname for pvname in old_pvs if pvname not in self._pvs]
+
+        for pvname in removed:
+            self._ring_status.remove(old_pvs[pvname]['ring'], pvname)
+
+        self._apply_pvlist(added, removed)
+        self._update_ring_status()
+
+        result = {'added': len(added), 'removed': len(removed),
+                  'elapsed': time.monotonic() - start}
+        self._logger.info('Reload PV list: {added} added, {removed} removed '
+                          'in {elapsed:.3f} s'.format(**result))
+
+        return result
+
+    def _apply_pvlist(self, added, removed):
+        for pvname in removed:
+            self._channels.pop(pvname).disconnect()
+            self._resolver.discard(pvname)
+
+        channels = {pvname: self._create_channel(pvname) for pvname in added}
+        self._channels.update(channels)
+
+        # a channel added in abort is counted once connected
+        unreachable = wait_connection(channels, self._connection_timeout)
+        for pvname in unreachable:
+            self._logger.warning('{} is not connected'.format(pvname))
+
+        skip = set(unreachable)
+        self._seed_statuses((pvname, bool(ch.abort))
+                            for pvname, ch in channels.items()
+                            if pvname not in skip)
+
+    def _wait_events(self):
+        '''
+        Block until an abort event arrives or a pending signal is due, and
+        collect the following events of the same burst until the batching
+        delay expires.
+        '''
+        deadline = self._resolver.next_deadline()
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = max(deadline - time.monotonic(), 0)
+
+        return collect_events(self._abt_q, timeout, self._batch_delay)
+
+    def _run_loop(self, events):
+        # drop events of channels removed by reload
+        events = [event for event in events if event.pvname in self._pvs]
+
+        while True:
+            # an abort ends when its ring is cleared, so the events after
+            # the clear are correlated as a new abort
+            n = self._update_statuses(events)
+            burst, events = events[:n], events[n:]
+
+            resolved = self._resolver.resolve(burst)
+            self._correlate(resolved)
+
+            # check abort status for each ring
+            if burst or resolved:
+                self._update_ring_status()
+
+            if not events:
+                break
+
+    def _update_statuses(self, events):
+        '''
+        Update the ring status with events up to the first one that
+        clears a ring. Return the number of events applied.
+        '''
+        n = 0
+        for event in events:
+            pvname = event.pvname
             ring = self._pvs[pvname]['ring']
-            abtinfo = self._abtinfo[ring]
+            n += 1
 
             self._logger.debug('Update {} abort = {}, ring = {}'
-                               .format(pvname, abort, ring))
+                               .format(pvname, event.abort, ring))
 
             # update abort status
-            self._aborts[ring][pvname] = abort
-
-            if not abort:
-                continue
-
-            ch = self._pvs[pvname]['abortch']
-            timestamp = ch.get_timestamp()
+            was_abort = self._ring_status.is_abort(ring)
+            self._ring_status.update(ring, pvname, event.abort)
+            if event.abort:
+                self._ring_status.add_edge(ring, pvname, event.seq)
+            if was_abort and not self._ring_status.is_abort(ring):
+                break
+
+        if n:
+            self._logger.debug('No. of update ch = {}'.format(n))
+            self._n_events += n
+
+        return n
+
+    def _correlate(self, resolved):
+        '''
+        Assign abort ids to resolved abort events and pass the rows
+        of this burst to the DB writer.
+        '''
+        new_aborts = {}
+        updated_aborts = {}
+        signals = []
+        marks = []
+        t_res = time.monotonic()
+
+        for event in resolved:
+            pvname = event.pvname
+            ring = self._pvs[pvname]['ring']
+            abtinfo = self._abtinfo[ring]
+            timestamp = event.timestamp
+            sec = event.sec
 
-            # timestamp is not updated yet
-            if timestamp == "1970-01-01 09:00:00.000000000":
-                self._abt_q.put((pvname, abort))
-                self._logger.debug('{} timestamp is not updated'
-                                   .format(pvname))
-                continue
+            # the timestamp is resolved after the ring is cleared, so the
+            # abort of the edge is over
+            late = not self._ring_status.pop_edge(ring, pvname, event.seq)
 
+            if late:
+                self._logger.warning('{} is resolved after {} abort is '
+                                     'cleared'.format(pvname, ring))
             # new abort is comming
-            if abtinfo.iniail_abort:
+            elif abtinfo.iniail_abort:
                 self._logger.debug('Still initial abort')
             elif abtinfo.id is None:
 
@@ -120,7 +384,7 @@ class Aborttl(object):
                 rabtinfo = self._abtinfo[rring]
                 if (
                       rabtinfo.id is not None and
-                      abs(ch.ts_sec - rabtinfo.sec) < 5
+                      abs(sec - rabtinfo.sec) < 5
                    ):
                     # Both ring abort
                     self._logger.debug('Both ring abort')
@@ -133,68 +397,145 @@ class Aborttl(object):
                     # Single ring abort
                     self._logger.debug('Single ring abort')
 
-                    abtinfo.id = self._dh.insert_abort(timestamp)
-                    abtinfo.sec = ch.ts_sec
+                    # a key of the abort, the writer maps it to the id
+                    # allocated by the database
+                    self._last_abt_id += 1
+                    abtinfo.id = self._last_abt_id
+                    new_aborts[abtinfo.id] = timestamp
+                    abtinfo.sec = sec
                     abtinfo.ts = timestamp
                     abtinfo.reset_offset = self._resetpv.count
 
             # new faster abort is comming
             elif timestamp < abtinfo.ts:
                 self._logger.debug('New faster abort is comming')
-                self._dh.update_abort(abtinfo.id, timestamp)
-                abtinfo.sec = ch.ts_sec
+                if abtinfo.id in new_aborts:
+                    new_aborts[abtinfo.id] = timestamp
+                else:
+                    updated_aborts[abtinfo.id] = timestamp
+                abtinfo.sec = sec
                 abtinfo.ts = timestamp
 
             # insert abort signal
             msg = self._pvs[pvname]['msg']
-            ts = ch.ts
-            abtid = abtinfo.id
+            abtid = None if late else abtinfo.id
+            reset_offset = 0 if late else abtinfo.reset_offset
 
-            signal = {'pvname': pvname, 'msg': msg, 'pv_ts': ts,
+            signal = {'pvname': pvname, 'msg': msg, 'pv_ts': event.pv_ts,
                       'abt_ts': timestamp,
-                      'reset_cnt': self._resetpv.count - abtinfo.reset_offset,
-                      'trg_cnt': ch.tcnt, 'int_cnt': ch.acnt}
+                      'reset_cnt': self._resetpv.count - reset_offset,
+                      'trg_cnt': event.tcnt, 'int_cnt': event.acnt,
+                      'abt_id': abtid}
 
             self._logger.debug('Insert abot signal: {}'.format(pvname))
-            self._dh.insert_abort_signals([signal], abtid)
+            signals.append(signal)
 
-        # check abort status for each ring
-        if qsize:
-            self._update_ring_status()
-
-    def _update_ring_status(self):
-        all_aborts = 0
-        rings = ['LER', 'HER']
+            if event.t_cb is not None:
+                marks.append((abtid, event.t_cb, event.t_dq, t_res))
 
-        for ring in rings:
-            aborts = self._aborts[ring]
-            is_abort = sum(aborts.values())
-            all_aborts += is_abort
+        if new_aborts or updated_aborts or signals:
+            aborts = [{'abt_id': abt_id, 'abt_time': abt_time}
+                      for abt_id, abt_time in new_aborts.items()]
+            updates = [{'abt_id': abt_id, 'abt_time': abt_time}
+                       for abt_id, abt_time in updated_aborts.items()]
+            self._writer.put(aborts, signals, updates, marks)
 
-            if not is_abort:
-                self._abtinfo[ring].clear()
+    def _update_ring_status(self):
+        for ring, abtinfo in self._abtinfo.items():
+            if not self._ring_status.is_abort(ring):
+                abtinfo.clear()
+                self._ring_status.clear_edges(ring)
                 self._logger.debug('Clear {} Abort Info'.format(ring))
 
-        if not all_aborts:
+        if not self._ring_status.any_abort():
             self._resetpv.clear()
             self._logger.debug('Clear Reset PV Counter')
 
+    @property
+    def is_ready(self):
+        '''
+        True once the initial abort states are read and events are monitored.
+        '''
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @property
+    def latency(self):
+        '''
+        LatencyStats of the abort signals from CA callback to DB commit.
+        '''
+        return self._latency
+
+    def stats(self):
+        return {'events': self._n_events,
+                'writer': self._writer.stats(),
+                'pending': self._resolver.stats(),
+                'startup': dict(self._startup)}
+
+    def metrics(self):
+        '''
+        Flat dict of runtime metrics. It only reads counters, so it can be
+        polled from another thread without blocking the loop.
+        '''
+        stats = self.stats()
+        return {'events': stats['events'],
+                'queue_depth': self._queue_depth(),
+                'loop_time': self._loop_time,
+                'max_loop_time': self._max_loop_time,
+                'writer_depth': stats['writer']['depth'],
+                'db_latency': stats['writer']['last_latency'],
+                'max_db_latency': stats['writer']['max_latency'],
+                'pending': stats['pending']['pending'],
+                'ts_retries': stats['pending']['retries'],
+                'ts_timeouts': stats['pending']['timeouts'],
+                'channels': len(self._pvs),
+                'connected': self._n_connected(),
+                'reset_count': self._resetpv.count}
+
+    def _queue_depth(self):
+        return self._abt_q.qsize()
+
+    def _n_connected(self):
+        # copy the channels since a reload may change them
+        return sum(ch.connected for ch in list(self._channels.values()))
+
     def run(self):
         self._is_running = True
         self.__is_stop.clear()
+        self._writer.start()
 
         try:
             self._initial_abort_check()
+            self._ready.set()
+            self._logger.info('Aborttl ready.')
             while not self.__stop_request:
-                self._run_loop()
-                time.sleep(self._interval)
+                events = self._wait_events()
+
+                start = time.perf_counter()
+                self._run_loop(events)
+                self._loop_time = time.perf_counter() - start
+                if self._loop_time > self._max_loop_time:
+                    self._max_loop_time = self._loop_time
+
+                if self._reload_request:
+                    self._reload_request = False
+                    self.reload_pvlist()
         finally:
+            self._ready.clear()
+            self._writer.stop()
             self._logger.info('Aborttl stopped.')
             self.__stop_request = False
             self.__is_stop.set()
 
         self._is_running = False
 
+    def _wake(self):
+        # wake up the loop blocking on the queue
+        self._abt_q.put(None)
+
     def stop(self):
         self.__stop_request = True
+        self._wake()
         self.__is_stop.wait()
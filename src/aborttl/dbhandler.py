@@ -1,6 +1,88 @@
+import re
+from contextlib import contextmanager
+from datetime import datetime
+
 import sqlalchemy as sa
 
 
+# below the limit of host parameters of old SQLite in a statement
+SUMMARY_CHUNK = 500
+TS_TEMPLATE = '1970-01-01 00:00:00.000000000'
+# 'YYYY-MM-DD HH:MM:SS.fffffffff' or its beginning, 'T' may separate the
+# date and the time and a trailing 'Z' is ignored
+TS_PATTERN = re.compile(r'(\d{4})(?:-(\d{1,2})(?:-(\d{1,2})'
+                        r'(?:[ T](\d{1,2})(?::(\d{1,2})(?::(\d{1,2})'
+                        r'(?:\.(\d{1,9}))?)?)?)?)?)?Z?')
+
+# storage profiles of SQLite files, None for the SQLAlchemy defaults
+STORAGE_PROFILES = {
+    'default': None,
+    # WAL lets the RPC server read while the logger writes. A commit is
+    # durable at the next checkpoint with synchronous=NORMAL, and is
+    # never corrupted by a crash.
+    'wal': {'pragmas': [('journal_mode', 'WAL'),
+                        ('synchronous', 'NORMAL'),
+                        ('cache_size', -64 * 1024),
+                        ('mmap_size', 256 * 2 ** 20),
+                        ('busy_timeout', 10000)],
+            'pool_size': 4,
+            'max_overflow': 4},
+}
+
+
+def ts_to_ns(ts):
+    '''
+    Convert a local time text 'YYYY-MM-DD HH:MM:SS.fffffffff' written by
+    AbortCh to integer nanoseconds since the epoch. A partial text like
+    'YYYY-MM-DD' is the beginning of the period. ValueError is raised
+    for a text of another format.
+    '''
+    if ts is None:
+        return None
+
+    m = TS_PATTERN.fullmatch(ts)
+    if m is None:
+        raise ValueError('Invalid timestamp: {!r}'.format(ts))
+
+    year, month, day, hour, minute, sec, frac = m.groups()
+    dt = datetime(int(year), int(month or 1), int(day or 1),
+                  int(hour or 0), int(minute or 0), int(sec or 0))
+
+    return int(dt.timestamp()) * 1000000000 + int((frac or '').ljust(9, '0'))
+
+
+def _ns_default(column):
+    def default(context):
+        return ts_to_ns(context.get_current_parameters()[column])
+    return default
+
+
+def _ns_expression(column):
+    # SQL equivalent of ts_to_ns to backfill existing rows
+    return ("CAST(strftime('%s', substr({0}, 1, 19), 'utc') AS INTEGER) "
+            "* 1000000000 + CAST(substr(substr({0}, 21) || '000000000', "
+            "1, 9) AS INTEGER)".format(column))
+
+
+def fts_query(text, prefix=False):
+    '''
+    Return an FTS5 query matching every word of text as a token, or as
+    a token prefix when prefix is True.
+    '''
+    words = ['"{}"'.format(word.replace('"', '""')) for word in text.split()]
+    if prefix:
+        words = [word + '*' for word in words]
+    return ' '.join(words)
+
+
+def _start_bound(column, ts):
+    # a partial text like '2018-01-01' includes the timestamps starting
+    # with it as the comparison of the text did
+    if len(ts) < len(TS_TEMPLATE):
+        return column >= ts_to_ns(ts)
+    return column > ts_to_ns(ts)
+
+
 '''
 Below is a code to enable foreign key in sqlite3.
 See https://docs.sqlalchemy.org/en/13/dialects/sqlite.html#foreign-key-support.
@@ -13,13 +95,57 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 
 
 class DbHandler(object):
-
-    def __init__(self, uri):
-        self.engine = sa.create_engine(uri)
+    '''
+    Access to the abort history of uri. storage is a name of
+    STORAGE_PROFILES to set up a SQLite file. WAL mode stays in the file
+    once enabled, also for handlers with the default profile.
+    '''
+
+    def __init__(self, uri, storage='default'):
+        if storage not in STORAGE_PROFILES:
+            raise ValueError('Unknown storage profile: {}'.format(storage))
+        profile = STORAGE_PROFILES[storage]
+
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            # share one in-memory database between threads
+            self.engine = sa.create_engine(
+                    uri, poolclass=sa.pool.StaticPool,
+                    connect_args={'check_same_thread': False})
+        elif profile and uri.startswith('sqlite'):
+            self.engine = self._create_sqlite_engine(uri, profile)
+        else:
+            self.engine = sa.create_engine(uri)
         self.meta = sa.MetaData()
         self.tables = {}
 
+        new_summary = not self.engine.has_table('abort_summary')
         self._declare_tables()
+        self._backfill_ns()
+        self._create_indexes()
+        self.fts = self._declare_fts()
+        if new_summary:
+            self.rebuild_abort_summary()
+
+    def _create_sqlite_engine(self, uri, profile):
+        '''
+        Return an engine of a SQLite file keeping its connections in a
+        pool with the pragmas of profile set once per connection.
+        '''
+        engine = sa.create_engine(
+                uri, poolclass=sa.pool.QueuePool,
+                pool_size=profile['pool_size'],
+                max_overflow=profile['max_overflow'],
+                connect_args={'check_same_thread': False})
+
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in profile['pragmas']:
+                cursor.execute('PRAGMA {}={}'.format(name, value))
+            cursor.close()
+
+        sa.event.listen(engine, 'connect', set_pragmas)
+
+        return engine
 
     def _declare_tables(self):
         pvs = sa.Table('pvs', self.meta,
@@ -37,18 +163,25 @@ class DbHandler(object):
                         sa.Column('abt_signal_id', sa.Integer,
                                   primary_key=True, autoincrement=True),
                         sa.Column('pvname', sa.TEXT,
-                                  sa.ForeignKey('pvs.pvname')),
+                                  sa.ForeignKey('pvs.pvname'), index=True),
                         sa.Column('msg', sa.TEXT, index=True, unique=False),
                         sa.Column('pv_ts', sa.TEXT),
                         sa.Column('abt_ts', sa.TEXT, index=True, unique=False),
                         sa.Column('reset_cnt', sa.Integer),
                         sa.Column('trg_cnt', sa.Integer),
-                        sa.Column('int_cnt', sa.Integer)
+                        sa.Column('int_cnt', sa.Integer),
+                        sa.Column('pv_ts_ns', sa.BigInteger,
+                                  default=_ns_default('pv_ts')),
+                        sa.Column('abt_ts_ns', sa.BigInteger, index=True,
+                                  default=_ns_default('abt_ts'))
                         )
         abts = sa.Table('aborts', self.meta,
                         sa.Column('abt_id', sa.Integer,
                                   primary_key=True, autoincrement=True),
-                        sa.Column('abt_time', sa.TEXT, index=True, unique=True)
+                        sa.Column('abt_time', sa.TEXT, index=True,
+                                  unique=True),
+                        sa.Column('abt_time_ns', sa.BigInteger, index=True,
+                                  default=_ns_default('abt_time'))
                         )
         al = sa.Table('abort_list', self.meta,
                       sa.Column('abt_id', sa.Integer,
@@ -56,17 +189,120 @@ class DbHandler(object):
                                 primary_key=True),
                       sa.Column('abt_signal_id', sa.Integer,
                                 sa.ForeignKey('abort_signals.abt_signal_id'),
-                                primary_key=True)
+                                primary_key=True),
+                      # covers the join from a signal to its abort
+                      sa.Index('ix_abort_list_abt_signal_id',
+                               'abt_signal_id', 'abt_id')
                       )
+        alat = sa.Table('abort_latency', self.meta,
+                        sa.Column('abt_latency_id', sa.Integer,
+                                  primary_key=True, autoincrement=True),
+                        sa.Column('abt_id', sa.Integer,
+                                  sa.ForeignKey('aborts.abt_id'), index=True),
+                        sa.Column('n_signals', sa.Integer),
+                        sa.Column('queue', sa.Float),
+                        sa.Column('timestamp', sa.Float),
+                        sa.Column('write', sa.Float),
+                        sa.Column('total', sa.Float)
+                        )
+        asum = sa.Table('abort_summary', self.meta,
+                        sa.Column('abt_id', sa.Integer,
+                                  sa.ForeignKey('aborts.abt_id'),
+                                  primary_key=True),
+                        sa.Column('first_ts', sa.TEXT),
+                        sa.Column('first_ts_ns', sa.BigInteger),
+                        sa.Column('first_pvname', sa.TEXT),
+                        sa.Column('first_msg', sa.TEXT),
+                        sa.Column('n_signals', sa.Integer),
+                        sa.Column('rings', sa.TEXT),
+                        sa.Column('last_ts', sa.TEXT),
+                        sa.Column('last_ts_ns', sa.BigInteger)
+                        )
 
         self.tables['pvs'] = pvs
         self.tables['current_pvs'] = cpvs
         self.tables['abort_signals'] = asig
         self.tables['aborts'] = abts
         self.tables['abort_list'] = al
+        self.tables['abort_latency'] = alat
+        self.tables['abort_summary'] = asum
 
         self.meta.create_all(self.engine)
 
+    def _backfill_ns(self):
+        '''
+        Add the integer nanosecond columns to a database created before
+        them and fill them from the text timestamps.
+        '''
+        columns = [('aborts', 'abt_time_ns', 'abt_time'),
+                   ('abort_signals', 'pv_ts_ns', 'pv_ts'),
+                   ('abort_signals', 'abt_ts_ns', 'abt_ts')]
+
+        with self.engine.begin() as conn:
+            inspector = sa.inspect(conn)
+            for table, column, text in columns:
+                names = {c['name'] for c in inspector.get_columns(table)}
+                if column in names:
+                    continue
+
+                conn.execute('ALTER TABLE {} ADD COLUMN {} BIGINT'
+                             .format(table, column))
+                conn.execute('UPDATE {} SET {} = {}'
+                             .format(table, column, _ns_expression(text)))
+
+    def _declare_fts(self):
+        '''
+        Create the FTS5 index of the messages of abort signals and its
+        triggers to keep it in sync. Return False when the database is
+        not SQLite or lacks FTS5.
+        '''
+        if self.engine.dialect.name != 'sqlite':
+            return False
+
+        new = not self.engine.has_table('abort_signals_fts')
+        try:
+            with self.engine.begin() as conn:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS "
+                             "abort_signals_fts USING fts5(msg, "
+                             "content='abort_signals', "
+                             "content_rowid='abt_signal_id')")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS abort_signals_ai "
+                             "AFTER INSERT ON abort_signals BEGIN "
+                             "INSERT INTO abort_signals_fts(rowid, msg) "
+                             "VALUES (new.abt_signal_id, new.msg); END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS abort_signals_ad "
+                             "AFTER DELETE ON abort_signals BEGIN "
+                             "INSERT INTO abort_signals_fts"
+                             "(abort_signals_fts, rowid, msg) VALUES "
+                             "('delete', old.abt_signal_id, old.msg); END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS abort_signals_au "
+                             "AFTER UPDATE OF msg ON abort_signals BEGIN "
+                             "INSERT INTO abort_signals_fts"
+                             "(abort_signals_fts, rowid, msg) VALUES "
+                             "('delete', old.abt_signal_id, old.msg); "
+                             "INSERT INTO abort_signals_fts(rowid, msg) "
+                             "VALUES (new.abt_signal_id, new.msg); END")
+                if new:
+                    conn.execute("INSERT INTO abort_signals_fts"
+                                 "(abort_signals_fts) VALUES ('rebuild')")
+        except sa.exc.OperationalError:
+            return False
+
+        return True
+
+    def _create_indexes(self):
+        '''
+        Create the indexes added to the tables after a database was
+        created. create_all only creates the indexes of new tables.
+        '''
+        with self.engine.begin() as conn:
+            inspector = sa.inspect(conn)
+            for name, table in self.tables.items():
+                existing = {i['name'] for i in inspector.get_indexes(name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(conn)
+
     def fetch_all_pvs(self):
         conn = self.engine.connect(close_with_result=True)
 
@@ -106,14 +342,98 @@ class DbHandler(object):
 
         return r
 
+    def iter_aborts(self, chunk_size=1000):
+        '''
+        Generator version of fetch_aborts, see iter_abort_signals.
+        '''
+        s = sa.select([self.tables['aborts']]).order_by(
+                self.tables['aborts'].c.abt_id)
+        return self._iter_rows(s, chunk_size)
+
+    def _iter_rows(self, s, chunk_size):
+        conn = self.engine.connect()
+        try:
+            result = conn.execution_options(stream_results=True).execute(s)
+            try:
+                rows = result.fetchmany(chunk_size)
+                while rows:
+                    for row in rows:
+                        yield row
+                    rows = result.fetchmany(chunk_size)
+            finally:
+                result.close()
+        finally:
+            conn.close()
+
+    def fetch_last_abort_id(self):
+        conn = self.engine.connect(close_with_result=True)
+
+        t_abts = self.tables['aborts']
+        s = sa.select([sa.func.max(t_abts.c.abt_id)])
+        result = conn.execute(s)
+
+        r = result.scalar()
+
+        return r or 0
+
+    def fetch_data_version(self):
+        '''
+        Return the last abt_id and abt_signal_id. They change whenever
+        the logger commits a burst, an abort time update included.
+        '''
+        conn = self.engine.connect(close_with_result=True)
+
+        t_abts = self.tables['aborts']
+        t_as = self.tables['abort_signals']
+        s = sa.select([
+                sa.select([sa.func.max(t_abts.c.abt_id)]).as_scalar(),
+                sa.select([sa.func.max(t_as.c.abt_signal_id)]).as_scalar()])
+        result = conn.execute(s)
+
+        r = result.fetchone()
+        result.close()
+
+        return (r[0] or 0, r[1] or 0)
+
     def fetch_abort_signals(self, ring=None, msg=None, first=True,
                             include_no_abt_id=False, astart=None, aend=None,
-                            with_time_delta=False, sstart=None, send=None):
+                            with_time_delta=False, sstart=None, send=None,
+                            msg_mode='substring'):
+        '''
+        msg_mode is how signals are matched with msg, 'substring' of the
+        message, its words as 'token' or as token 'prefix'. The token
+        modes fall back to substring without the FTS5 index.
+        '''
         conn = self.engine.connect(close_with_result=True)
+
+        s = self.abort_signals_query(ring, msg, first, include_no_abt_id,
+                                     astart, aend, with_time_delta, sstart,
+                                     send, msg_mode)
+        result = conn.execute(s)
+
+        r = result.fetchall()
+        result.close()
+
+        return r
+
+    def abort_signals_query(self, ring=None, msg=None, first=True,
+                            include_no_abt_id=False, astart=None, aend=None,
+                            with_time_delta=False, sstart=None, send=None,
+                            msg_mode='substring', limit=None, cursor=None,
+                            with_ts_ns=False):
+        '''
+        Return the select statement of fetch_abort_signals. The rows are
+        ordered by the key (abt_id, reset_cnt, trg_cnt, int_cnt,
+        abt_signal_id) with 0 for abt_id of the signals without abort.
+        cursor is a key to return only the rows after it. A paged query
+        with limit or cursor has the column abt_signal_id too.
+        with_ts_ns adds ts_ns, the integer nanoseconds of ts.
+        '''
         t_abts = self.tables['aborts']
         t_as = self.tables['abort_signals']
         t_al = self.tables['abort_list']
         t_pvs = self.tables['pvs']
+        t_sum = self.tables['abort_summary']
 
         select_columns = [
                             t_abts.c.abt_id,
@@ -131,31 +451,25 @@ class DbHandler(object):
             select_columns.insert(1, t_as.c.abt_ts.label('ts'))
 
         if with_time_delta:
-            sq = (sa.select([
-                              t_al.c.abt_id,
-                              sa.func.min(t_as.c.abt_ts).label('ts')
-                              ])
-                  .select_from(t_as.join(t_al))
-                  .group_by(t_al.c.abt_id)
-                  .alias()
-                  )
-
             if first:
-                abt_ts_column = sa.func.min(t_as.c.abt_ts)
+                abt_ts_column = sa.func.min(t_as.c.abt_ts_ns)
             else:
-                abt_ts_column = t_as.c.abt_ts
-
-            c = ((
-                    sa.func.strftime('%s', abt_ts_column) -
-                    sa.func.strftime('%s', sq.c.ts)
-                  ) +
-                 (
-                    sa.func.substr(abt_ts_column, -9, 9) -
-                    sa.func.substr(sq.c.ts, -9, 9)
-                  )*1e-9
-                 )
+                abt_ts_column = t_as.c.abt_ts_ns
+
+            c = (abt_ts_column - t_sum.c.first_ts_ns) / 1e9
             select_columns.append(c.label('delta'))
 
+        if with_ts_ns:
+            if first:
+                select_columns.append(
+                        sa.func.min(t_as.c.abt_ts_ns).label('ts_ns'))
+            else:
+                select_columns.append(t_as.c.abt_ts_ns.label('ts_ns'))
+
+        # the key of the last row of a page is the next cursor
+        if limit is not None or cursor is not None:
+            select_columns.append(t_as.c.abt_signal_id)
+
         s = sa.select(select_columns)
 
         if first:
@@ -164,42 +478,149 @@ class DbHandler(object):
                            t_as.c.pvname
                           )
 
-        if include_no_abt_id:
+        # the signals without abort never match the abort time or the
+        # summary, the inner join keeps the planner from starting with
+        # the signals of every PV
+        if include_no_abt_id and not (astart or aend or with_time_delta):
             tables = t_as.outerjoin(t_al).outerjoin(t_abts).join(t_pvs)
+            abt_id = sa.func.coalesce(t_abts.c.abt_id, 0)
         else:
             tables = t_as.join(t_al).join(t_abts).join(t_pvs)
+            abt_id = t_abts.c.abt_id
 
         if with_time_delta:
-            s = s.select_from(tables.join(sq, t_abts.c.abt_id == sq.c.abt_id))
+            s = s.select_from(tables.join(t_sum))
         else:
             s = s.select_from(tables)
 
         if ring:
             s = s.where(t_pvs.c.ring == ring)
         if msg:
-            s = s.where(t_as.c.msg.like('%{}%'.format(msg)))
+            s = s.where(self._msg_filter(msg, msg_mode))
         if astart:
-            s = s.where(t_abts.c.abt_time > astart)
+            s = s.where(_start_bound(t_abts.c.abt_time_ns, astart))
         if aend:
-            s = s.where(t_abts.c.abt_time < aend)
+            s = s.where(t_abts.c.abt_time_ns < ts_to_ns(aend))
         if sstart:
-            s = s.where(t_as.c.abt_ts > sstart)
+            s = s.where(_start_bound(t_as.c.abt_ts_ns, sstart))
         if send:
-            s = s.where(t_as.c.abt_ts < send)
-
-        s = s.order_by(
-                         t_abts.c.abt_id,
-                         t_as.c.reset_cnt,
-                         t_as.c.trg_cnt,
-                         t_as.c.int_cnt
-                       )
+            s = s.where(t_as.c.abt_ts_ns < ts_to_ns(send))
+
+        if first and cursor is not None:
+            # the key of a group is known after grouping, the groups of
+            # the earlier aborts are skipped before it
+            sq = s.where(abt_id >= cursor[0]).alias()
+            key = [sq.c.abt_id, sq.c.reset_cnt, sq.c.trg_cnt, sq.c.int_cnt,
+                   sq.c.abt_signal_id]
+            s = (sa.select([sq]).
+                 where(sa.tuple_(sa.func.coalesce(sq.c.abt_id, 0), *key[1:]) >
+                       sa.tuple_(*cursor)))
+        else:
+            # an expression of the signal id keeps the planner from
+            # scanning an index of abort_signals to sort by it
+            key = [t_abts.c.abt_id, t_as.c.reset_cnt, t_as.c.trg_cnt,
+                   t_as.c.int_cnt, t_as.c.abt_signal_id + 0]
+            if cursor is not None:
+                # the bound of the leading column alone lets the planner
+                # seek the abort
+                s = s.where(sa.and_(abt_id >= cursor[0],
+                                    sa.tuple_(abt_id, *key[1:]) >
+                                    sa.tuple_(*cursor)))
+
+        # NULL of the signals without abort sorts first as 0
+        s = s.order_by(*key)
+        if limit is not None:
+            s = s.limit(limit)
+
+        return s
+
+    def iter_abort_signals(self, chunk_size=1000, **kwargs):
+        '''
+        Generator version of fetch_abort_signals with kwargs. Rows are
+        read from the database cursor chunk_size at a time, so memory
+        does not grow with the result. The connection is released when
+        the generator is exhausted, closed or garbage collected. The
+        read transaction is open until then and blocks writers of a
+        database not in WAL mode.
+        '''
+        return self._iter_rows(self.abort_signals_query(**kwargs),
+                               chunk_size)
+
+    def fetch_abort_signals_page(self, limit, cursor=None, **kwargs):
+        '''
+        Return a page of at most limit rows of fetch_abort_signals with
+        kwargs after cursor, and the cursor of the next page or None at
+        the end. The cost of a page does not grow with its depth.
+        '''
+        conn = self.engine.connect(close_with_result=True)
 
+        s = self.abort_signals_query(limit=limit + 1, cursor=cursor, **kwargs)
         result = conn.execute(s)
 
         r = result.fetchall()
         result.close()
 
-        return r
+        if len(r) <= limit:
+            return r, None
+
+        r = r[:limit]
+        last = r[-1]
+        next_cursor = (last['abt_id'] or 0, last['reset_cnt'],
+                       last['trg_cnt'], last['int_cnt'],
+                       last['abt_signal_id'])
+
+        return r, next_cursor
+
+    def fetch_abort_signals_columns(self, limit=None, cursor=None,
+                                    **kwargs):
+        '''
+        Columnar version of fetch_abort_signals with kwargs, or of
+        fetch_abort_signals_page with limit. Return a dict of the column
+        names to lists of values and the cursor of the next page or None.
+        The rows of the DB cursor are transposed at once instead of
+        being wrapped in row objects.
+        '''
+        conn = self.engine.connect(close_with_result=True)
+
+        s = self.abort_signals_query(
+                limit=None if limit is None else limit + 1, cursor=cursor,
+                **kwargs)
+        result = conn.execute(s)
+
+        keys = result.keys()
+        rows = result.cursor.fetchall()
+        result.close()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            del rows[limit:]
+            last = dict(zip(keys, rows[-1]))
+            next_cursor = (last['abt_id'] or 0, last['reset_cnt'],
+                           last['trg_cnt'], last['int_cnt'],
+                           last['abt_signal_id'])
+
+        columns = {key: [] for key in keys}
+        if rows:
+            columns.update(zip(keys, map(list, zip(*rows))))
+
+        return columns, next_cursor
+
+    def _msg_filter(self, msg, msg_mode):
+        t_as = self.tables['abort_signals']
+
+        if msg_mode not in ('substring', 'token', 'prefix'):
+            raise ValueError('Unknown msg_mode: {}'.format(msg_mode))
+
+        if msg_mode == 'substring' or not self.fts or not msg.split():
+            return t_as.c.msg.contains(msg, autoescape=True)
+
+        match = (
+                  sa.select([sa.literal_column('rowid')]).
+                  select_from(sa.table('abort_signals_fts')).
+                  where(sa.literal_column('abort_signals_fts').op('MATCH')(
+                        fts_query(msg, prefix=(msg_mode == 'prefix'))))
+                 )
+        return t_as.c.abt_signal_id.in_(match)
 
     def update_current_pvs(self, pvs):
         table = self.tables['current_pvs']
@@ -236,10 +657,255 @@ class DbHandler(object):
                 abt_ids = [{'abt_id': abt_id, 'abt_signal_id': i[0]}
                            for i in ids]
                 conn.execute(self.tables['abort_list'].insert(), abt_ids)
+                self._merge_summary(conn, [dict(signal, abt_id=abt_id)
+                                           for signal in signals])
             result.close()
 
         return ids
 
+    @contextmanager
+    def _write_transaction(self):
+        '''
+        Transaction holding the write lock of SQLite from its start, so
+        the ids read in it are not taken by another writer before the
+        commit. pysqlite begins a transaction only at the first write.
+        '''
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name != 'sqlite':
+                with conn.begin():
+                    yield conn
+                return
+
+            dbapi_conn = conn.connection.connection
+            isolation_level = dbapi_conn.isolation_level
+            dbapi_conn.isolation_level = None
+            try:
+                with conn.begin():
+                    conn.execute('BEGIN IMMEDIATE')
+                    yield conn
+            finally:
+                dbapi_conn.isolation_level = isolation_level
+
+    def insert_abort_burst(self, aborts=None, signals=None, updates=None,
+                           id_map=None):
+        '''
+        Persist one abort burst in a single transaction, which holds the
+        write lock from its start to allocate the signal ids.
+        aborts and updates are lists of {'abt_id':, 'abt_time':}.
+        Each signal is linked to the abort given by its 'abt_id' key,
+        or left unlinked when it is None.
+
+        When id_map is given, the 'abt_id' keys are ids of the caller.
+        The aborts get new ids from the database in the transaction and
+        id_map is updated with {key: abt_id} after the commit. Signals
+        of a key missing in id_map are left unlinked and its updates are
+        skipped.
+        '''
+        t_abts = self.tables['aborts']
+        t_as = self.tables['abort_signals']
+        t_al = self.tables['abort_list']
+
+        ids = []
+        new_ids = {}
+
+        def to_abt_id(key):
+            if id_map is None or key is None:
+                return key
+            if key in new_ids:
+                return new_ids[key]
+            return id_map.get(key)
+
+        with self._write_transaction() as conn:
+            if aborts and id_map is None:
+                conn.execute(t_abts.insert(), aborts)
+            elif aborts:
+                for abort in aborts:
+                    row = dict(abort)
+                    key = row.pop('abt_id')
+                    result = conn.execute(t_abts.insert(), row)
+                    new_ids[key] = result.inserted_primary_key[0]
+
+            params = []
+            for u in updates or []:
+                abt_id = to_abt_id(u['abt_id'])
+                if abt_id is None:
+                    continue
+                params.append({'_abt_id': abt_id, '_abt_time': u['abt_time'],
+                               '_abt_time_ns': ts_to_ns(u['abt_time'])})
+
+            if params:
+                stmt = (
+                          t_abts.update().
+                          where(t_abts.c.abt_id == sa.bindparam('_abt_id')).
+                          values(abt_time=sa.bindparam('_abt_time'),
+                                 abt_time_ns=sa.bindparam('_abt_time_ns'))
+                        )
+                conn.execute(stmt, params)
+
+            if signals:
+                s = sa.select([sa.func.max(t_as.c.abt_signal_id)])
+                last_id = conn.execute(s).scalar() or 0
+
+                rows = []
+                abt_ids = []
+                linked = []
+                for signal_id, signal in enumerate(signals, last_id + 1):
+                    row = dict(signal)
+                    abt_id = to_abt_id(row.pop('abt_id', None))
+                    row['abt_signal_id'] = signal_id
+                    rows.append(row)
+                    ids.append(signal_id)
+
+                    if abt_id:
+                        abt_ids.append({'abt_id': abt_id,
+                                        'abt_signal_id': signal_id})
+                        linked.append(dict(signal, abt_id=abt_id))
+
+                conn.execute(t_as.insert(), rows)
+                if abt_ids:
+                    conn.execute(t_al.insert(), abt_ids)
+                    self._merge_summary(conn, linked)
+
+        if id_map is not None:
+            id_map.update(new_ids)
+
+        return ids
+
+    def _merge_summary(self, conn, signals):
+        '''
+        Merge signals linked to aborts by their 'abt_id' key into
+        abort_summary. The signals must be newer in the table than the
+        ones already summarized, the earlier signal is the first cause
+        of a tie.
+        '''
+        t_sum = self.tables['abort_summary']
+        t_pvs = self.tables['pvs']
+
+        abt_ids = sorted({signal['abt_id'] for signal in signals})
+        pvnames = sorted({signal['pvname'] for signal in signals})
+
+        s = sa.select([t_sum]).where(t_sum.c.abt_id.in_(abt_ids))
+        summary = {row['abt_id']: dict(row) for row in conn.execute(s)}
+
+        rings = {}
+        for i in range(0, len(pvnames), SUMMARY_CHUNK):
+            s = (sa.select([t_pvs.c.pvname, t_pvs.c.ring])
+                 .where(t_pvs.c.pvname.in_(pvnames[i:i + SUMMARY_CHUNK])))
+            rings.update(conn.execute(s).fetchall())
+
+        for signal in signals:
+            ns = ts_to_ns(signal['abt_ts'])
+            row = summary.get(signal['abt_id'])
+            if row is None:
+                row = {'abt_id': signal['abt_id'], 'first_ts': None,
+                       'first_ts_ns': None, 'first_pvname': None,
+                       'first_msg': None, 'n_signals': 0, 'rings': '',
+                       'last_ts': None, 'last_ts_ns': None}
+                summary[signal['abt_id']] = row
+
+            if row['first_ts_ns'] is None or ns < row['first_ts_ns']:
+                row['first_ts'] = signal['abt_ts']
+                row['first_ts_ns'] = ns
+                row['first_pvname'] = signal['pvname']
+                row['first_msg'] = signal['msg']
+            if row['last_ts_ns'] is None or ns > row['last_ts_ns']:
+                row['last_ts'] = signal['abt_ts']
+                row['last_ts_ns'] = ns
+
+            row['n_signals'] += 1
+            ring = rings.get(signal['pvname'])
+            if ring:
+                row_rings = set(filter(None, row['rings'].split(',')))
+                row['rings'] = ','.join(sorted(row_rings | {ring}))
+
+        conn.execute(t_sum.delete().where(t_sum.c.abt_id.in_(abt_ids)))
+        conn.execute(t_sum.insert(), list(summary.values()))
+
+    def rebuild_abort_summary(self):
+        '''
+        Recompute abort_summary from all linked abort signals.
+        Return the number of aborts summarized.
+        '''
+        t_as = self.tables['abort_signals']
+        t_al = self.tables['abort_list']
+
+        s = (
+              sa.select([t_al.c.abt_id, t_as.c.pvname, t_as.c.msg,
+                         t_as.c.abt_ts]).
+              select_from(t_as.join(t_al)).
+              order_by(t_al.c.abt_id, t_as.c.abt_signal_id)
+             )
+
+        with self.engine.begin() as conn:
+            conn.execute(self.tables['abort_summary'].delete())
+
+            result = conn.execute(s)
+            rows = result.fetchmany(SUMMARY_CHUNK)
+            while rows:
+                self._merge_summary(conn, [dict(row) for row in rows])
+                rows = result.fetchmany(SUMMARY_CHUNK)
+
+            n = conn.execute(
+                    sa.select([sa.func.count()]).
+                    select_from(self.tables['abort_summary'])).scalar()
+
+        return n
+
+    def fetch_abort_summary(self, ring=None, astart=None, aend=None):
+        '''
+        Return one row per abort with its first cause, the number of
+        signals, the rings involved and the first and last signal time.
+        '''
+        t_abts = self.tables['aborts']
+        t_sum = self.tables['abort_summary']
+
+        conn = self.engine.connect(close_with_result=True)
+
+        s = (
+              sa.select([t_abts.c.abt_id, t_abts.c.abt_time,
+                         t_sum.c.first_ts, t_sum.c.first_pvname,
+                         t_sum.c.first_msg, t_sum.c.n_signals,
+                         t_sum.c.rings, t_sum.c.last_ts]).
+              select_from(t_abts.join(t_sum)).
+              order_by(t_abts.c.abt_id)
+             )
+
+        if ring:
+            s = s.where(t_sum.c.rings.like('%{}%'.format(ring)))
+        if astart:
+            s = s.where(_start_bound(t_abts.c.abt_time_ns, astart))
+        if aend:
+            s = s.where(t_abts.c.abt_time_ns < ts_to_ns(aend))
+
+        result = conn.execute(s)
+
+        r = result.fetchall()
+        result.close()
+
+        return r
+
+    def insert_abort_latency(self, rows):
+        '''
+        rows are the maximum stage latencies [s] of the signals of an
+        abort written in one burst.
+        '''
+        with self.engine.begin() as conn:
+            conn.execute(self.tables['abort_latency'].insert(), rows)
+
+    def fetch_abort_latency(self, abt_id=None):
+        conn = self.engine.connect(close_with_result=True)
+
+        t_alat = self.tables['abort_latency']
+        s = sa.select([t_alat]).order_by(t_alat.c.abt_latency_id)
+        if abt_id:
+            s = s.where(t_alat.c.abt_id == abt_id)
+        result = conn.execute(s)
+
+        r = result.fetchall()
+        result.close()
+
+        return r
+
     def insert_abort(self, timestamp):
         with self.engine.begin() as conn:
             result = conn.execute(self.tables['aborts'].insert(),
@@ -254,6 +920,7 @@ class DbHandler(object):
             stmt = (
                       table.update().
                       where(table.c.abt_id == abt_id).
-                      values(abt_time=timestamp)
+                      values(abt_time=timestamp,
+                             abt_time_ns=ts_to_ns(timestamp))
                     )
             result = conn.execute(stmt)
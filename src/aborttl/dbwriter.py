@@ -0,0 +1,212 @@
+import threading
+import time
+from queue import Queue, Empty
+
+import sqlalchemy as sa
+
+from .logger import get_default_logger
+
+
+def is_transient(error):
+    '''
+    Return True when error of a DB write may pass on a retry, like a
+    lock held by another connection.
+    '''
+    if not isinstance(error, sa.exc.OperationalError):
+        return False
+    if error.connection_invalidated:
+        return True
+
+    message = str(error.orig).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class DbWriter(object):
+    '''
+    Write-behind stage which persists abort bursts in a dedicated thread.
+    put() blocks only when the bounded queue is full.
+    The stage latencies of the signals are added to latency (LatencyStats)
+    after the commit, and stored per abort when persist_latency is True.
+    A transient error is retried max_retries times. When the coalesced
+    bursts still fail, they are written one transaction each and a
+    burst failing on its own is logged in full and dropped.
+    The 'abt_id' keys of the bursts are ids of the producer, which are
+    mapped to the ids allocated by the database when the aborts are
+    written, so other writers of the database do not collide.
+    '''
+
+    def __init__(self, dh, maxsize=1000, retry_interval=1, latency=None,
+                 persist_latency=False, max_retries=10, logger=None):
+        self._logger = logger or get_default_logger()
+        self._dh = dh
+        self._latency = latency
+        self._persist_latency = persist_latency
+
+        self._q = Queue(maxsize=maxsize)
+        self._thread = None
+        self._retry_interval = retry_interval
+        self._max_retries = max_retries
+        self._id_map = {}
+
+        self._lock = threading.Lock()
+        self._high_water = 0
+        self._writes = 0
+        self._last_latency = 0
+        self._max_latency = 0
+        self._total_latency = 0
+        self._dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='DbWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Flush every queued burst and stop the writer thread.
+        '''
+        if self._thread is None:
+            return
+
+        self._q.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def put(self, aborts=None, signals=None, updates=None, marks=None):
+        '''
+        marks are (abt_id, t_cb, t_dq, t_res) monotonic times of signals
+        to measure their latency.
+        '''
+        self._q.put((aborts or [], signals or [], updates or [],
+                     marks or []))
+
+        depth = self._q.qsize()
+        if depth > self._high_water:
+            self._high_water = depth
+
+    def stats(self):
+        with self._lock:
+            writes = self._writes
+            avg = self._total_latency / writes if writes else 0
+
+            return {'depth': self._q.qsize(),
+                    'high_water': self._high_water,
+                    'writes': writes,
+                    'last_latency': self._last_latency,
+                    'max_latency': self._max_latency,
+                    'avg_latency': avg,
+                    'dropped': self._dropped}
+
+    def _run(self):
+        stop = False
+        while not stop:
+            bursts = [self._q.get()]
+
+            # coalesce bursts queued while the last write was running
+            while True:
+                try:
+                    bursts.append(self._q.get_nowait())
+                except Empty:
+                    break
+
+            if None in bursts:
+                stop = True
+                bursts = [b for b in bursts if b is not None]
+
+            if bursts:
+                self._write(bursts)
+
+    def _write(self, bursts):
+        if self._insert(bursts) or len(bursts) == 1:
+            return
+
+        # only the bad burst is lost when they are written one by one
+        self._logger.warning('Write {} coalesced bursts one by one'
+                             .format(len(bursts)))
+        for burst in bursts:
+            self._insert([burst])
+
+    def _insert(self, bursts):
+        '''
+        Write bursts in one transaction and return True on success.
+        '''
+        aborts = []
+        signals = []
+        updates = []
+        marks = []
+        for burst in bursts:
+            aborts.extend(burst[0])
+            signals.extend(burst[1])
+            updates.extend(burst[2])
+            marks.extend(burst[3])
+
+        retries = 0
+        while True:
+            start = time.monotonic()
+            try:
+                self._dh.insert_abort_burst(aborts, signals, updates,
+                                            id_map=self._id_map)
+            except Exception as e:
+                if is_transient(e) and retries < self._max_retries:
+                    retries += 1
+                    self._logger.warning('Failed to write abort burst: {}. '
+                                         'Retry {}/{}.'.format(
+                                             e, retries, self._max_retries))
+                    time.sleep(self._retry_interval)
+                    continue
+
+                if len(bursts) == 1:
+                    with self._lock:
+                        self._dropped += 1
+                    self._logger.exception('Dropped abort burst: aborts={} '
+                                           'signals={} updates={}'
+                                           .format(aborts, signals, updates))
+                else:
+                    self._logger.exception('Failed to write abort bursts')
+                return False
+            break
+
+        t_commit = time.monotonic()
+        latency = t_commit - start
+        with self._lock:
+            self._writes += 1
+            self._last_latency = latency
+            self._max_latency = max(self._max_latency, latency)
+            self._total_latency += latency
+
+        if marks and self._latency is not None:
+            self._record_latency(marks, t_commit)
+
+        return True
+
+    def _record_latency(self, marks, t_commit):
+        for abt_id, t_cb, t_dq, t_res in marks:
+            self._latency.add(t_cb, t_dq, t_res, t_commit)
+
+        if not self._persist_latency:
+            return
+
+        # maximum latency of each stage among the signals of an abort
+        aborts = {}
+        for key, t_cb, t_dq, t_res in marks:
+            abt_id = self._id_map.get(key)
+            if abt_id is None:
+                continue
+
+            row = aborts.setdefault(abt_id, {'abt_id': abt_id,
+                                             'n_signals': 0, 'queue': 0,
+                                             'timestamp': 0, 'write': 0,
+                                             'total': 0})
+            row['n_signals'] += 1
+            row['queue'] = max(row['queue'], t_dq - t_cb)
+            row['timestamp'] = max(row['timestamp'], t_res - t_dq)
+            row['write'] = max(row['write'], t_commit - t_res)
+            row['total'] = max(row['total'], t_commit - t_cb)
+
+        if not aborts:
+            return
+
+        try:
+            self._dh.insert_abort_latency(list(aborts.values()))
+        except Exception:
+            self._logger.exception('Failed to write abort latency')
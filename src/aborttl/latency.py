@@ -0,0 +1,103 @@
+import math
+import threading
+
+
+class LatencyHistogram(object):
+    '''
+    Histogram of latencies [s] in log scale buckets. Each bucket is
+    2 ** (1 / resolution) wider than the previous one starting from
+    min_latency, so a percentile is accurate within one bucket.
+    '''
+
+    def __init__(self, min_latency=1e-6, resolution=8):
+        self.min_latency = min_latency
+        self.resolution = resolution
+
+        self.buckets = {}
+        self.count = 0
+        self.max = 0
+
+    def add(self, latency):
+        if latency > self.min_latency:
+            index = int(math.log2(latency / self.min_latency) *
+                        self.resolution) + 1
+        else:
+            index = 0
+
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, p):
+        '''
+        Return the upper bound of the bucket of the p-th percentile.
+        '''
+        if not self.count:
+            return 0
+
+        rank = p / 100 * self.count
+        n = 0
+        for index in sorted(self.buckets):
+            n += self.buckets[index]
+            if n >= rank:
+                upper = self.min_latency * 2 ** (index / self.resolution)
+                return min(upper, self.max)
+
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class LatencyStats(object):
+    '''
+    Per-stage latency histograms of abort signals.
+    queue: CA callback to dequeue by the loop
+    timestamp: dequeue to resolution of the abort timestamp
+    write: resolution to DB commit
+    total: CA callback to DB commit
+    '''
+    stages = ('queue', 'timestamp', 'write', 'total')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {stage: LatencyHistogram()
+                            for stage in self.stages}
+
+    def add(self, t_cb, t_dq, t_res, t_commit):
+        '''
+        Add the stage latencies of a signal from its monotonic times.
+        '''
+        with self._lock:
+            self._histograms['queue'].add(t_dq - t_cb)
+            self._histograms['timestamp'].add(t_res - t_dq)
+            self._histograms['write'].add(t_commit - t_res)
+            self._histograms['total'].add(t_commit - t_cb)
+
+    def summary(self):
+        with self._lock:
+            return {stage: self._histograms[stage].summary()
+                    for stage in self.stages}
+
+    def clear(self):
+        with self._lock:
+            for stage in self.stages:
+                self._histograms[stage] = LatencyHistogram()
+
+    def dump(self):
+        '''
+        Return the summary as a table in text.
+        '''
+        lines = ['{:<10}{:>8}{:>12}{:>12}{:>12}'
+                 .format('stage', 'count', 'p50 [ms]', 'p99 [ms]',
+                         'max [ms]')]
+        for stage, s in self.summary().items():
+            lines.append('{:<10}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}'
+                         .format(stage, s['count'], s['p50'] * 1e3,
+                                 s['p99'] * 1e3, s['max'] * 1e3))
+
+        return '\n'.join(lines)
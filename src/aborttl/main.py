@@ -1,9 +1,16 @@
 import csv
 import logging.config
 import argparse
+import os
+import signal
+import threading
+import time
+from functools import partial
 
-from .dbhandler import DbHandler
+from .dbhandler import DbHandler, STORAGE_PROFILES
 from .aborttl import Aborttl
+from .shard import ShardedAborttl
+from .metrics import MetricsServer
 from .logger import get_default_logger
 
 
@@ -22,13 +29,50 @@ def parse_args():
                         help='path to HER pv list', default=None)
     parser.add_argument('-L', dest='lerlist',
                         help='path to LER pv list', default=None)
+    parser.add_argument('-b', '--batch-delay', dest='batch_delay',
+                        help='maximum delay to batch a burst of aborts [s]',
+                        type=float, default=0.01)
+    parser.add_argument('-q', '--queue-size', dest='queue_size',
+                        help='maximum number of bursts waiting for DB write',
+                        type=int, default=1000)
+    parser.add_argument('--ts-retry', dest='ts_retry',
+                        help='first retry interval of timestamp update [s]',
+                        type=float, default=0.05)
+    parser.add_argument('--ts-max-wait', dest='ts_max_wait',
+                        help='maximum wait for timestamp update [s]',
+                        type=float, default=10)
+    parser.add_argument('--ts-fallback', dest='ts_fallback',
+                        help='policy when timestamp is not updated in time',
+                        choices=['record', 'unresolved'], default='record')
+    parser.add_argument('-w', '--workers', dest='workers',
+                        help='number of worker processes for abort channels',
+                        type=int, default=0)
+    parser.add_argument('--watch', dest='watch',
+                        help='interval to check PV list files for reload [s]',
+                        type=float, default=0)
+    parser.add_argument('--connection-timeout', dest='connection_timeout',
+                        help='maximum wait for channel connection at startup'
+                             ' [s]',
+                        type=float, default=5)
+    parser.add_argument('-m', '--metrics-prefix', dest='metrics_prefix',
+                        help='publish runtime metrics as pvAccess PVs with'
+                             ' this prefix',
+                        default=None)
+    parser.add_argument('--metrics-interval', dest='metrics_interval',
+                        help='update interval of the metrics PVs [s]',
+                        type=float, default=1)
+    parser.add_argument('--persist-latency', dest='persist_latency',
+                        help='store processing latency of each abort in DB',
+                        action='store_true')
+    parser.add_argument('-s', '--storage', dest='storage',
+                        help='storage profile of the SQLite DB',
+                        choices=sorted(STORAGE_PROFILES), default='default')
 
     return parser.parse_args()
 
 
-def update_pvs_list(uri, herlist, lerlist, logger=None):
+def update_pvs_list(dh, herlist, lerlist, logger=None):
     logger = logger or get_default_logger()
-    dh = DbHandler(uri)
     pvs_db = dh.fetch_all_pvs()
 
     pvs = {pv['pvname']: pv['ring'] for pv in pvs_db}
@@ -60,6 +104,38 @@ def update_pvs_list(uri, herlist, lerlist, logger=None):
         dh.update_current_pvs(current_pvs)
 
 
+class PvListWatcher(threading.Thread):
+    '''
+    Call cb when the modification time of any of paths changes.
+    '''
+
+    def __init__(self, paths, interval, cb):
+        super().__init__(name='PvListWatcher')
+        self.daemon = True
+        self._paths = paths
+        self._interval = interval
+        self._cb = cb
+
+    def _mtimes(self):
+        mtimes = []
+        for path in self._paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def run(self):
+        mtimes = self._mtimes()
+        while True:
+            time.sleep(self._interval)
+
+            new_mtimes = self._mtimes()
+            if new_mtimes != mtimes:
+                mtimes = new_mtimes
+                self._cb()
+
+
 def main():
     args = parse_args()
 
@@ -70,14 +146,62 @@ def main():
     else:
         logger = get_default_logger()
 
+    pvlist_updater = None
     if args.herlist and args.lerlist:
-        update_pvs_list(args.uri, args.herlist, args.lerlist, logger)
+        # the handler is kept for the reloads
+        dh = DbHandler(args.uri, args.storage)
+        update_pvs_list(dh, args.herlist, args.lerlist, logger)
+        pvlist_updater = partial(update_pvs_list, dh, args.herlist,
+                                 args.lerlist, logger)
     elif args.herlist or args.lerlist:
         logger.critical('PV list must be privided for both ring')
         return -1
 
-    atl = Aborttl(args.uri, args.resetpv, logger=logger)
-    atl.run()
+    options = {'logger': logger,
+               'batch_delay': args.batch_delay,
+               'writer_maxsize': args.queue_size,
+               'ts_retry_interval': args.ts_retry,
+               'ts_max_wait': args.ts_max_wait,
+               'ts_fallback': args.ts_fallback,
+               'pvlist_updater': pvlist_updater,
+               'connection_timeout': args.connection_timeout,
+               'persist_latency': args.persist_latency,
+               'storage': args.storage}
+
+    if args.workers > 1:
+        atl = ShardedAborttl(args.uri, args.resetpv, n_workers=args.workers,
+                             **options)
+    else:
+        atl = Aborttl(args.uri, args.resetpv, **options)
+
+    # SIGHUP reloads the PV list. The request is made from a thread since
+    # the handler may interrupt the loop while it holds the queue lock.
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                  target=atl.request_reload).start())
+
+    # SIGUSR1 logs the latency histograms of abort signals
+    def log_latency():
+        logger.info('Abort signal latency\n' + atl.latency.dump())
+
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+                  target=log_latency).start())
+
+    if args.watch and pvlist_updater:
+        watcher = PvListWatcher([args.herlist, args.lerlist], args.watch,
+                                atl.request_reload)
+        watcher.start()
+
+    metrics = None
+    if args.metrics_prefix:
+        metrics = MetricsServer(atl, args.metrics_prefix,
+                                args.metrics_interval, logger)
+        metrics.start()
+
+    try:
+        atl.run()
+    finally:
+        if metrics:
+            metrics.stop()
 
 
 if __name__ == "__main__":
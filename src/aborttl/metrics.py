@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pvaccess as pva
+
+from .logger import get_default_logger
+
+
+class MetricsServer(object):
+    '''
+    Publish Aborttl.metrics() as NTScalar PVs named prefix:NAME from a
+    pvAccess server in this process. The PVs are updated every interval
+    [s] from a separate thread.
+    '''
+    records = {'events': ('EVENTS', pva.ULONG),
+               'queue_depth': ('QUEUE_DEPTH', pva.ULONG),
+               'loop_time': ('LOOP_TIME', pva.DOUBLE),
+               'max_loop_time': ('LOOP_TIME_MAX', pva.DOUBLE),
+               'writer_depth': ('WRITER_DEPTH', pva.ULONG),
+               'db_latency': ('DB_LATENCY', pva.DOUBLE),
+               'max_db_latency': ('DB_LATENCY_MAX', pva.DOUBLE),
+               'pending': ('TS_PENDING', pva.ULONG),
+               'ts_retries': ('TS_RETRIES', pva.ULONG),
+               'ts_timeouts': ('TS_TIMEOUTS', pva.ULONG),
+               'channels': ('CHANNELS', pva.ULONG),
+               'connected': ('CONNECTED', pva.ULONG),
+               'reset_count': ('RESET_COUNT', pva.ULONG)}
+
+    def __init__(self, atl, prefix, interval=1, logger=None):
+        self._logger = logger or get_default_logger()
+        self._atl = atl
+        self._prefix = prefix
+        self._interval = interval
+
+        self._server = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._pvs = {}
+
+    @property
+    def pvnames(self):
+        return sorted(self._prefix + ':' + name
+                      for name, ptype in self.records.values())
+
+    def start(self):
+        self._server = pva.PvaServer()
+        for key, (name, ptype) in self.records.items():
+            pvname = self._prefix + ':' + name
+            self._pvs[key] = (pvname, pva.NtScalar(ptype, 0))
+            self._server.addRecord(pvname, self._pvs[key][1])
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._logger.info('Metrics are published under {}:'
+                          .format(self._prefix))
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._server.stop()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.publish()
+            except Exception:
+                self._logger.exception('Failed to publish metrics')
+
+    def publish(self):
+        metrics = self._atl.metrics()
+
+        now = time.time()
+        ts = pva.PvTimeStamp(int(now), int((now % 1) * 1e9))
+
+        for key, (pvname, pv) in self._pvs.items():
+            pv.setValue(metrics[key])
+            pv.setTimeStamp(ts)
+            self._server.update(pvname, pv)
@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import time
+from collections import Counter
+
+from .abortch import INVALID_TIMESTAMP
+from .logger import get_default_logger
+
+
+class PendingScheduler(object):
+    '''
+    Deadline ordered heap of abort signals waiting for their timestamp PVs.
+    A signal is scheduled again with a backoff until max_wait elapses
+    since its abort edge, then it is reported as timed out. Each abort
+    edge is kept, so several edges of a pvname can be pending.
+    '''
+
+    def __init__(self, retry_interval=0.05, backoff=2, max_interval=1,
+                 max_wait=10):
+        self.retry_interval = retry_interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.max_wait = max_wait
+
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+
+        self.retries = Counter()
+        self.timeouts = Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, pvname, item=None, now=None):
+        '''
+        Schedule a new abort edge of pvname. It is due immediately.
+        '''
+        now = time.monotonic() if now is None else now
+        self._schedule(pvname, item, now, now, 0)
+
+    def retry(self, pvname, item, first_seen, n_retry, now=None):
+        '''
+        Schedule pvname again. Return False when max_wait is exceeded.
+        '''
+        now = time.monotonic() if now is None else now
+
+        if now - first_seen >= self.max_wait:
+            self.timeouts[pvname] += 1
+            return False
+
+        interval = min(self.retry_interval * self.backoff ** n_retry,
+                       self.max_interval)
+        self.retries[pvname] += 1
+        self._schedule(pvname, item, now + interval, first_seen, n_retry + 1)
+
+        return True
+
+    def discard(self, pvname):
+        for seq in [seq for seq, entry in self._entries.items()
+                    if entry[0] == pvname]:
+            del self._entries[seq]
+
+    def next_deadline(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        '''
+        Return (pvname, item, first_seen, n_retry) of due signals in
+        deadline order.
+        '''
+        now = time.monotonic() if now is None else now
+
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, seq = heapq.heappop(self._heap)
+            entry = self._entries.pop(seq, None)
+            if entry is not None:
+                due.append(entry)
+
+        return due
+
+    def stats(self):
+        return {'pending': len(self._entries),
+                'retries': sum(self.retries.values()),
+                'timeouts': sum(self.timeouts.values())}
+
+    def _schedule(self, pvname, item, deadline, first_seen, n_retry):
+        seq = next(self._seq)
+        self._entries[seq] = (pvname, item, first_seen, n_retry)
+        heapq.heappush(self._heap, (deadline, seq))
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0][1] not in self._entries:
+            heapq.heappop(self._heap)
+
+
+class TimestampResolver(object):
+    '''
+    Resolve the abort timestamp of abort events through PendingScheduler.
+    channels = {'pvname': AbortCh} used to take a new snapshot on retry.
+    fallback is 'record' to use the record timestamp after max_wait,
+    or 'unresolved' to drop the signal.
+    '''
+
+    def __init__(self, channels, retry_interval=0.05, max_wait=10,
+                 fallback='record', logger=None):
+        self._logger = logger or get_default_logger()
+        self._channels = channels
+        self._fallback = fallback
+
+        self.scheduler = PendingScheduler(retry_interval=retry_interval,
+                                          max_wait=max_wait)
+
+    def next_deadline(self):
+        return self.scheduler.next_deadline()
+
+    def discard(self, pvname):
+        self.scheduler.discard(pvname)
+
+    def stats(self):
+        return self.scheduler.stats()
+
+    def resolve(self, events):
+        '''
+        Schedule abort edges of events and return the due events whose
+        timestamp is resolved. t_dq of the returned events with t_cb is
+        the time the edge was scheduled.
+        '''
+        scheduler = self.scheduler
+
+        for event in events:
+            if event.abort:
+                scheduler.push(event.pvname, event)
+
+        resolved = []
+        for pvname, event, first_seen, n_retry in scheduler.pop_due():
+            # counters and timestamp are taken again from the cache of
+            # the channel when the timestamp was not ready at the edge
+            if n_retry:
+                event = self._channels[pvname].snapshot(event)
+
+            # timestamp is not updated yet
+            if event.timestamp == INVALID_TIMESTAMP:
+                if scheduler.retry(pvname, event, first_seen, n_retry):
+                    self._logger.debug('{} timestamp is not updated'
+                                       .format(pvname))
+                    continue
+
+                if self._fallback == 'record':
+                    self._logger.warning(
+                        '{} timestamp is not updated in {} s. '
+                        'Use the record timestamp.'
+                        .format(pvname, scheduler.max_wait))
+                    event = event._replace(timestamp=event.pv_ts,
+                                           sec=event.pv_sec)
+                else:
+                    self._logger.warning(
+                        '{} timestamp is not updated in {} s. '
+                        'Abort signal is unresolved.'
+                        .format(pvname, scheduler.max_wait))
+                    continue
+
+            if event.t_cb is not None:
+                event = event._replace(t_dq=first_seen)
+
+            resolved.append(event)
+
+        return resolved
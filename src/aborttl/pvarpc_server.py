@@ -1,47 +1,65 @@
 import time
 import argparse
-from datetime import datetime
+from itertools import chain, groupby
+from operator import itemgetter
 
 import pvaccess as pva
+import sqlalchemy as sa
 
-from .dbhandler import DbHandler
+from .dbhandler import DbHandler, STORAGE_PROFILES, ts_to_ns
+from .rpccache import ResultCache, estimate_size
+from .rpcpool import RpcPool
+from .replica import Replica
 
 
 class AbortRPC(object):
-
-    def __init__(self, uri):
-        self._dh = DbHandler(uri)
+    '''
+    RPC services of the abort history. Results are cached up to
+    cache_size [bytes], 0 disables the cache, or in cache shared with
+    other instances. A window ending settle [s] before now is cached
+    until evicted, since no signal is added to it any more. Others are
+    rebuilt once the logger commits new signals. storage is the storage
+    profile of the DB, see DbHandler. With replica, the Replica of the
+    DB is read instead of uri, and the windows settle before the time
+    of its data.
+    '''
+
+    def __init__(self, uri, cache_size=64 * 2 ** 20, settle=600, cache=None,
+                 storage='default', replica=None):
+        self._replica = replica
+        if replica is not None:
+            uri = replica.uri
+        self._dh = DbHandler(uri, storage)
+        self._cache = cache if cache is not None else ResultCache(cache_size)
+        self._settle = settle
+
+        if replica is not None:
+            # reopen the connections on the new copy
+            replica.on_refresh(self._dh.engine.dispose)
 
     def data2annotation(self, data):
+        '''
+        Return the annotations of the aborts in data, the columns of
+        fetch_abort_signals_columns with ts_ns. Each abort is annotated
+        at its first signal in epoch milliseconds with the lines of its
+        signals joined as the text. Signals without message are skipped.
+        '''
         time = []
         title = []
         tags = []
         text = []
-        abt_id = None
-        temp_text = ''
-
-        for ts in data:
-            if ts.msg == '':
-                continue
-
-            if abt_id != ts.abt_id:
-                if temp_text:
-                    text.append(str(temp_text))
 
-                temp_text = ''
-                abt_id = ts.abt_id
-                date, nano = ts.ts.split('.')
-                dt = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-                time.append(int(dt.strftime('%s') + nano[0:3]))
-                title.append(str(ts.msg))
-                tags.append(str(ts.ring))
-
-            if temp_text:
-                temp_text += "</br>"
-            temp_text += ts.ts + " " + ts.msg
-
-        if temp_text:
-            text.append(str(temp_text))
+        lines = map(' '.join, zip(data['ts'], data['msg']))
+        rows = zip(data['abt_id'], data['ts_ns'], data['msg'], data['ring'],
+                   lines)
+        for abt_id, group in groupby(filter(itemgetter(2), rows),
+                                     itemgetter(0)):
+            first = next(group)
+            time.append(first[1] // 1000000)
+            title.append(first[2])
+            tags.append(first[3])
+            text.append('</br>'.join(chain((first[4],),
+                                           map(itemgetter(4), group))))
 
         return {"time": time, "title": title, "tags": tags, "text": text}
 
@@ -72,12 +90,19 @@ class AbortRPC(object):
         # ex) 2019-01-01T00:00:00 => 2019-01-01 00:00:00
         starttime = starttime.replace("T"," ")
         endtime = endtime.replace("T"," ")
+        if not self._is_valid_time(starttime, endtime):
+            return pva.PvBoolean(False)
 
-        timestamp_data = self._dh.fetch_abort_signals(ring=ring,
-                                                      astart=starttime,
-                                                      aend=endtime)
+        key = ('ann', starttime, endtime, ring)
 
-        ann = self.data2annotation(timestamp_data)
+        return self._cached(key, endtime, lambda: self._make_annotations(
+                                                starttime, endtime, ring))
+
+    def _make_annotations(self, starttime, endtime, ring):
+        data, next_cursor = self._dh.fetch_abort_signals_columns(
+                ring=ring, astart=starttime, aend=endtime, with_ts_ns=True)
+
+        ann = self.data2annotation(data)
 
         vals = {"column0": [pva.ULONG],
                 "column1": [pva.STRING],
@@ -91,7 +116,7 @@ class AbortRPC(object):
                                      "column2": ann["tags"],
                                      "column3": ann["text"]})
 
-        return table
+        return table, ann.values()
 
     def get_search(self, x):
         try:
@@ -115,40 +140,51 @@ class AbortRPC(object):
 
         ring = x.getString('ring') if x.hasField('ring') else None
         msg = x.getString('message') if x.hasField('message') else ''
+        # substring, token or prefix
+        match = x.getString('match') if x.hasField('match') else 'substring'
+        if match not in ('substring', 'token', 'prefix'):
+            return pva.PvBoolean(False)
+
+        # a page of limit rows after cursor, all rows without limit
+        try:
+            limit = int(x['limit']) if x.hasField('limit') else 0
+            cursor = self._parse_cursor(x['cursor']
+                                        if x.hasField('cursor') else '')
+        except ValueError:
+            return pva.PvBoolean(False)
+        if limit < 0:
+            return pva.PvBoolean(False)
 
         # ex) 2019-01-01T00:00:00 => 2019-01-01 00:00:00
         starttime = starttime.replace("T"," ")
         endtime = endtime.replace("T"," ")
+        if not self._is_valid_time(starttime, endtime):
+            return pva.PvBoolean(False)
 
+        key = (mode, starttime, endtime, ring, msg, match, limit, cursor)
+
+        return self._cached(key, endtime, lambda: self._make_signals_table(
+                mode, starttime, endtime, ring, msg, match, limit, cursor))
+
+    def _make_signals_table(self, mode, starttime, endtime, ring, msg, match,
+                            limit, cursor):
+        kwargs = {'ring': ring, 'msg': msg, 'first': False,
+                  'include_no_abt_id': True, 'with_time_delta': True,
+                  'msg_mode': match}
         if mode == 'grouped':
-            timestamp_data = self._dh.fetch_abort_signals(
-                    ring=ring,
-                    msg=msg,
-                    first=False,
-                    include_no_abt_id=True,
-                    with_time_delta=True,
-                    astart=starttime,
-                    aend=endtime)
+            kwargs.update(astart=starttime, aend=endtime)
+        else:
+            kwargs.update(sstart=starttime, send=endtime)
+
+        if limit:
+            data, next_cursor = self._dh.fetch_abort_signals_columns(
+                    limit, cursor, **kwargs)
         else:
-            timestamp_data = self._dh.fetch_abort_signals(
-                    ring=ring,
-                    msg=msg,
-                    first=False,
-                    include_no_abt_id=True,
-                    with_time_delta=True,
-                    sstart=starttime,
-                    send=endtime)
-
-        data = {'abt_id':[], 'time': [], 'msg': [],
-                'pvname': [], 'ring': [], 'delta': []}
-        for d in timestamp_data:
-            abtid = -1 if d['abt_id'] is None else d['abt_id']
-            data['abt_id'].append(abtid)
-            data['time'].append(d['ts'])
-            data['msg'].append(d['msg'])
-            data['pvname'].append(d['pvname'])
-            data['ring'].append(d['ring'])
-            data['delta'].append(d['delta'])
+            data, next_cursor = self._dh.fetch_abort_signals_columns(**kwargs)
+
+        if None in data['abt_id']:
+            data['abt_id'] = [-1 if abtid is None else abtid
+                              for abtid in data['abt_id']]
 
         vals = {"column0": [pva.INT],
                 "column1": [pva.STRING],
@@ -156,18 +192,110 @@ class AbortRPC(object):
                 "column3": [pva.STRING],
                 "column4": [pva.STRING],
                 "column5": [pva.FLOAT]}
-        table = pva.PvObject({"labels": [pva.STRING], "value": vals},
-                              'epics:nt/NTTable:1.0')
+        fields = {"labels": [pva.STRING], "value": vals}
+        if limit:
+            # cursor of the next page, empty at the last page
+            fields["cursor"] = pva.STRING
+        table = pva.PvObject(fields, 'epics:nt/NTTable:1.0')
         table.setScalarArray("labels", ['abt_id', "time", "msg", "pvname", "ring", "delta"])
+        if limit:
+            table.setString("cursor", self._format_cursor(next_cursor))
         table.setStructure("value", {"column0": data["abt_id"],
-                                     "column1": data["time"],
+                                     "column1": data["ts"],
                                      "column2": data["msg"],
                                      "column3": data["pvname"],
                                      "column4": data["ring"],
                                      "column5": data["delta"]})
 
+        columns = [data[key] for key in
+                   ('abt_id', 'ts', 'msg', 'pvname', 'ring', 'delta')]
+
+        return table, columns
+
+    def _cached(self, key, endtime, build):
+        '''
+        Return the table of key from the cache or from build, which
+        returns the table and its columns to estimate its size.
+        '''
+        if not self._cache.max_bytes:
+            return build()[0]
+
+        version = None
+        if not self._is_settled(endtime):
+            version = self._dh.fetch_data_version()
+
+        table = self._cache.get(key, version)
+        if table is None:
+            table, columns = build()
+            self._cache.put(key, table, estimate_size(columns), version)
+
         return table
 
+    def _is_valid_time(self, *texts):
+        try:
+            for text in texts:
+                ts_to_ns(text)
+        except ValueError:
+            return False
+
+        return True
+
+    def _is_settled(self, endtime):
+        try:
+            end = ts_to_ns(endtime)
+        except ValueError:
+            return False
+
+        if self._replica is not None:
+            now = self._replica.snapshot_time()
+        else:
+            now = time.time()
+
+        return end < (now - self._settle) * 1e9
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    def get_cache_stats(self, x):
+        stats = self.cache_stats()
+
+        pv = pva.PvObject({key: pva.ULONG for key in stats})
+        for key, value in stats.items():
+            pv[key] = value
+
+        return pv
+
+    def get_replica_stats(self, x):
+        '''
+        Return the staleness [s] of the replica, -1 before its first
+        copy, and the duration [s] and the numbers of its refreshes.
+        '''
+        if self._replica is None:
+            return pva.PvBoolean(False)
+
+        stats = self._replica.stats()
+        if stats['staleness'] is None:
+            stats['staleness'] = -1
+
+        return pva.PvObject({'staleness': pva.DOUBLE, 'duration': pva.DOUBLE,
+                             'refreshes': pva.ULONG, 'failures': pva.ULONG},
+                            stats)
+
+    def _parse_cursor(self, text):
+        if not text:
+            return None
+
+        cursor = tuple(int(v) for v in text.split(','))
+        if len(cursor) != 5:
+            raise ValueError('Invalid cursor: {}'.format(text))
+
+        return cursor
+
+    def _format_cursor(self, cursor):
+        if cursor is None:
+            return ''
+        return ','.join(str(v) for v in cursor)
+
 
 def parsearg():
     desc = "Abort timestamp API pvAccess RPC."
@@ -177,20 +305,72 @@ def parsearg():
     parser.add_argument("-u", "--uri", dest="uri",
                         default="sqlite:///:memory:", required=True,
                         help="URI to the database")
-
-    return parser.parse_args()
+    parser.add_argument("--cache-size", dest="cache_size", type=float,
+                        default=64,
+                        help="Size of the result cache [MiB], 0 to disable")
+    parser.add_argument("--settle", dest="settle", type=float, default=600,
+                        help="Age [s] of the end of a window after which "
+                             "its result is cached without invalidation")
+    parser.add_argument("--workers", dest="workers", type=int, default=2,
+                        help="Number of query workers with their own DB "
+                             "connections")
+    parser.add_argument("--queue", dest="queue", type=int, default=None,
+                        help="Number of queries waiting for a worker, more "
+                             "are rejected. Default is the number of query "
+                             "channels")
+    parser.add_argument("-s", "--storage", dest="storage",
+                        choices=sorted(STORAGE_PROFILES), default="default",
+                        help="Storage profile of the SQLite DB")
+    parser.add_argument("-R", "--replica", dest="replica", default=None,
+                        help="Path to a read-only copy of the SQLite DB to "
+                             "read instead of the DB itself")
+    parser.add_argument("--replica-interval", dest="replica_interval",
+                        type=float, default=10,
+                        help="Refresh interval of the replica [s]")
+
+    args = parser.parse_args()
+
+    url = sa.engine.url.make_url(args.uri)
+    if args.replica and (url.get_backend_name() != 'sqlite' or
+                         not url.database or url.database == ':memory:'):
+        parser.error('--replica needs a SQLite file as the DB')
+
+    return args
 
 
 def main():
     arg = parsearg()
-    abort_rpc = AbortRPC(arg.uri)
 
-    srv = pva.RpcServer()
-    srv.registerService(arg.ch, abort_rpc.get_signals)
-    srv.registerService(arg.ch + ":grouped", abort_rpc.get_grouped_signals)
-    srv.registerService(arg.ch + ":ann", abort_rpc.get_annotations)
-    srv.registerService(arg.ch + ":search", abort_rpc.get_search)
-    srv.startListener()
+    # the logger owns the DB, which is only read by the backup
+    replica = None
+    storage = arg.storage
+    if arg.replica:
+        replica = Replica(sa.engine.url.make_url(arg.uri).database,
+                          arg.replica, arg.replica_interval)
+        replica.start()
+        storage = 'default'
+
+    # the queries run on the workers of the pool, each with its own DB
+    # connections, sharing the result cache
+    cache = ResultCache(int(arg.cache_size * 2 ** 20))
+
+    def worker():
+        return AbortRPC(arg.uri, settle=arg.settle, cache=cache,
+                        storage=storage, replica=replica)
+
+    abort_rpc = worker()
+    pool = RpcPool(worker, arg.workers, arg.queue)
+    pool.register(arg.ch, AbortRPC.get_signals)
+    pool.register(arg.ch + ":grouped", AbortRPC.get_grouped_signals)
+    pool.register(arg.ch + ":ann", AbortRPC.get_annotations)
+    pool.register(arg.ch + ":search", abort_rpc.get_search, limited=False)
+    pool.register(arg.ch + ":stats", abort_rpc.get_cache_stats,
+                  limited=False)
+    pool.register(arg.ch + ":metrics", pool.get_metrics, limited=False)
+    if replica:
+        pool.register(arg.ch + ":replica", abort_rpc.get_replica_stats,
+                      limited=False)
+    pool.start()
 
     try:
         while True:
@@ -198,7 +378,9 @@ def main():
     except KeyboardInterrupt:
         print("exit")
     finally:
-        alarm_rpc.close()
+        pool.stop()
+        if replica:
+            replica.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import namedtuple
+
+from .abortch import AbortCh
+
+
+'''
+Entry of an event trace. time [s] is relative to the start of the trace.
+value is the new value of pvname or None to update only its counters
+(ACNT, TCNT) and abort timestamp PVs (TIME_SEC, TIME_NANO), which are
+None when they are not updated.
+'''
+TraceEntry = namedtuple('TraceEntry', ['time', 'pvname', 'value',
+                                       'counters', 'timestamps'])
+
+
+def load_trace(path):
+    '''
+    Load a trace from a JSON file of
+    [[time, pvname, value, [acnt, tcnt], [sec, nsec]], ...].
+    '''
+    with open(path) as f:
+        return [TraceEntry(*entry) for entry in json.load(f)]
+
+
+def dump_trace(trace, path):
+    with open(path, 'w') as f:
+        json.dump([list(entry) for entry in trace], f)
+
+
+class ReplayPV(object):
+    '''
+    In-process PV with the part of the epics.PV interface used by AbortCh
+    and ResetPVCounter. It connects at once with the value 0.
+    '''
+
+    def __init__(self, source, pvname, callback=None,
+                 connection_callback=None, **kw):
+        self.pvname = pvname
+        self.value = 0
+        self.connected = True
+
+        self._source = source
+        self._callback = callback
+        self._connection_callback = connection_callback
+
+        if connection_callback:
+            connection_callback(pvname=pvname, conn=True)
+        self.put(0)
+
+    def put(self, value, now=None):
+        now = time.time() if now is None else now
+        self.value = value
+
+        if self._callback:
+            sec = int(now)
+            self._callback(pvname=self.pvname, value=value, timestamp=now,
+                           posixseconds=sec,
+                           nanoseconds=int((now - sec) * 1e9))
+
+    def clear_callbacks(self):
+        self._callback = None
+        self._connection_callback = None
+
+    def disconnect(self):
+        self.connected = False
+        self._source.remove(self)
+
+
+class ReplaySource(object):
+    '''
+    Channel source replaying an event trace in process instead of CA.
+    Pass it as source of Aborttl, AbortCh or ResetPVCounter in place of
+    epics.PV. speed is the clock rate of the replay, 1 for real time and
+    0 to replay as fast as possible.
+    '''
+
+    def __init__(self, trace, speed=1, fields=None):
+        self.trace = sorted(trace, key=lambda entry: entry.time)
+        self.speed = speed
+        self.fields = fields or AbortCh.fields
+
+        self._pvs = {}
+        self._thread = None
+
+    def __call__(self, pvname, **kw):
+        pv = ReplayPV(self, pvname, **kw)
+        self._pvs[pvname] = pv
+        return pv
+
+    def remove(self, pv):
+        if self._pvs.get(pv.pvname) is pv:
+            del self._pvs[pv.pvname]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.play)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def play(self):
+        if not self.trace:
+            return
+
+        start = time.monotonic()
+        t0 = self.trace[0].time
+        for entry in self.trace:
+            if self.speed:
+                delay = start + (entry.time - t0) / self.speed
+                delay -= time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.apply(entry)
+
+    def apply(self, entry):
+        now = time.time()
+        pvname = entry.pvname
+
+        if entry.counters is not None:
+            self._put(pvname + self.fields['ACNT'], entry.counters[0], now)
+            self._put(pvname + self.fields['TCNT'], entry.counters[1], now)
+
+        if entry.timestamps is not None:
+            self._put(pvname + self.fields['SEC'], entry.timestamps[0], now)
+            self._put(pvname + self.fields['NSEC'], entry.timestamps[1], now)
+
+        if entry.value is not None:
+            self._put(pvname, entry.value, now)
+
+    def _put(self, pvname, value, now):
+        pv = self._pvs.get(pvname)
+        if pv is not None:
+            pv.put(value, now)
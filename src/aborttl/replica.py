@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .logger import get_default_logger
+
+
+class Replica(object):
+    '''
+    Read-only copy of the SQLite file primary at path, refreshed every
+    interval [s] by the online backup API. The copy is made in a
+    temporary file and renamed over path, so readers never see a
+    partial copy. Open connections keep reading the previous copy until
+    they are closed, which the callbacks added by on_refresh do.
+
+    pages is the number of pages copied in a step of the backup, -1 for
+    all at once. A step holds a read lock of the primary, which blocks
+    the logger unless the primary is in WAL mode, and the backup starts
+    over when the primary is written between steps.
+    '''
+
+    def __init__(self, primary, path, interval=10, pages=-1, logger=None):
+        self._logger = logger or get_default_logger()
+        self.primary = primary
+        self.path = path
+        self.interval = interval
+        self.pages = pages
+
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._snapshot_time = None
+        self._duration = 0
+        self._refreshes = 0
+        self._failures = 0
+
+    @property
+    def uri(self):
+        return 'sqlite:///' + self.path
+
+    def on_refresh(self, callback):
+        self._callbacks.append(callback)
+
+    def refresh(self):
+        tmp_path = self.path + '.tmp'
+        start = time.time()
+
+        src = sqlite3.connect('file:{}?mode=ro'.format(self.primary),
+                              uri=True)
+        try:
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst, pages=self.pages)
+                # the copy of a WAL primary would be in WAL mode too
+                dst.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                dst.close()
+        finally:
+            src.close()
+
+        os.replace(tmp_path, self.path)
+
+        with self._lock:
+            self._snapshot_time = start
+            self._duration = time.time() - start
+            self._refreshes += 1
+
+        for callback in self._callbacks:
+            callback()
+
+        self._logger.debug('Refreshed the replica {} in {:.3f} s'
+                           .format(self.path, self._duration))
+
+    def start(self):
+        '''
+        Make the first copy and refresh it from a separate thread.
+        '''
+        self.refresh()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                with self._lock:
+                    self._failures += 1
+                self._logger.exception('Failed to refresh the replica {}'
+                                       .format(self.path))
+
+    def snapshot_time(self):
+        '''
+        Return the time the data of the replica was read from the
+        primary, 0 before the first copy.
+        '''
+        with self._lock:
+            return self._snapshot_time or 0
+
+    def stats(self):
+        with self._lock:
+            staleness = None
+            if self._snapshot_time is not None:
+                staleness = time.time() - self._snapshot_time
+
+            return {'staleness': staleness, 'duration': self._duration,
+                    'refreshes': self._refreshes,
+                    'failures': self._failures}
@@ -7,16 +7,17 @@ from .logger import get_default_logger
 
 class ResetPVCounter(object):
 
-    def __init__(self, pvname, logger=None):
+    def __init__(self, pvname, logger=None, source=None):
         self.logger = logger or get_default_logger()
-
-        self._pv = PV(pvname=str(pvname), auto_monitor=True,
-                      callback=self._on_value_change,
-                      connection_callback=self._on_connection)
+        source = source or PV
 
         self._lock = Lock()
         self._count = 0
 
+        self._pv = source(pvname=str(pvname), auto_monitor=True,
+                          callback=self._on_value_change,
+                          connection_callback=self._on_connection)
+
     def _on_value_change(self, pvname=None, value=None, **kw):
         if value < 0 or value > 1:
             self.logger.debug('Reset Pv Value Error')
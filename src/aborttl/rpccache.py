@@ -0,0 +1,80 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+def estimate_size(columns):
+    '''
+    Rough memory size [bytes] of a result given as lists of values.
+    '''
+    return sum(sys.getsizeof(column) + sum(map(sys.getsizeof, column))
+               for column in columns)
+
+
+class ResultCache(object):
+    '''
+    LRU cache of RPC results bounded by max_bytes of estimated size.
+    Each entry is stored with the data version of the database when it
+    was built, and a lookup with another version drops it. Entries of
+    windows in the past are stored with the version None and never
+    invalidated.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != version:
+                self._remove(key)
+                self._invalidations += 1
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return entry[0]
+
+    def put(self, key, value, size, version):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, version, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        value, version, size = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'invalidations': self._invalidations,
+                    'evictions': self._evictions,
+                    'entries': len(self._entries), 'bytes': self._size}
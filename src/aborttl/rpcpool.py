@@ -0,0 +1,192 @@
+import threading
+import time
+from queue import Queue
+
+import pvaccess as pva
+
+from .latency import LatencyHistogram
+from .logger import get_default_logger
+
+
+class RpcRequest(object):
+    '''
+    Request of a limited service passed to a worker thread.
+    '''
+
+    def __init__(self, func, x, t_arrive):
+        self.func = func
+        self.x = x
+        self.t_arrive = t_arrive
+        self.t_run = None
+        self.t_end = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RpcPool(object):
+    '''
+    Host each RPC service on its own pvAccess RPC server and run the
+    requests of the limited services on n_workers threads. Each thread
+    has its own worker made by worker_factory, e.g. an AbortRPC with its
+    own DB connections. Up to max_queue requests wait while all threads
+    are busy and the others are rejected. max_queue is the number of the
+    limited services when it is None. The wait from the arrival of a
+    request at the pool and the time running are recorded per service.
+
+    A server passes the requests of its channel one at a time, so the
+    requests of the same channel still run in turn, and their wait
+    behind each other in the server is not included.
+    '''
+
+    def __init__(self, worker_factory, n_workers=2, max_queue=None,
+                 logger=None):
+        self._logger = logger or get_default_logger()
+        self.n_workers = n_workers
+        self.max_queue = max_queue
+
+        self._worker_factory = worker_factory
+        self._queue = Queue()
+        self._threads = []
+        self._n_requests = 0
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._services = {}
+        self._metrics = {}
+
+    def register(self, name, func, limited=True):
+        '''
+        Register func as the service of the channel name. func of a
+        limited service is called with the worker of a thread and the
+        request, func of the others with the request in the server.
+        '''
+        def service(x):
+            return self.call(name, x)
+
+        server = pva.RpcServer()
+        server.registerService(name, service)
+
+        self._servers[name] = server
+        self._services[name] = (func, limited)
+        self._metrics[name] = {'requests': 0, 'rejected': 0,
+                               'wait': LatencyHistogram(),
+                               'run': LatencyHistogram()}
+
+    def call(self, name, x):
+        t_arrive = time.monotonic()
+        func, limited = self._services[name]
+        metrics = self._metrics[name]
+
+        if not limited:
+            try:
+                return func(x)
+            finally:
+                self._record(metrics, t_arrive, t_arrive, time.monotonic())
+
+        with self._lock:
+            n_waiting = self._n_requests - self.n_workers
+            accepted = n_waiting < self.max_queue
+            if accepted:
+                self._n_requests += 1
+            else:
+                metrics['rejected'] += 1
+
+        if not accepted:
+            self._logger.warning('Reject a request of {}, {} requests are '
+                                 'waiting'.format(name, n_waiting))
+            return pva.PvBoolean(False)
+
+        request = RpcRequest(func, x, t_arrive)
+        self._queue.put(request)
+        request.done.wait()
+
+        with self._lock:
+            self._n_requests -= 1
+        self._record(metrics, request.t_arrive, request.t_run, request.t_end)
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def _record(self, metrics, t_arrive, t_run, t_end):
+        with self._lock:
+            metrics['requests'] += 1
+            metrics['wait'].add(t_run - t_arrive)
+            metrics['run'].add(t_end - t_run)
+
+    def _work(self):
+        # the worker is made in its thread with its own connections
+        worker = self._worker_factory()
+
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+
+            request.t_run = time.monotonic()
+            try:
+                request.result = request.func(worker, request.x)
+            except Exception as e:
+                request.error = e
+            finally:
+                request.t_end = time.monotonic()
+                request.done.set()
+
+    def start(self):
+        if self.max_queue is None:
+            self.max_queue = sum(limited for func, limited
+                                 in self._services.values())
+
+        for i in range(self.n_workers):
+            thread = threading.Thread(target=self._work,
+                                      name='RpcWorker{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        for server in self._servers.values():
+            server.startListener()
+
+    def stop(self):
+        for server in self._servers.values():
+            server.stopListener()
+
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {name: {'requests': m['requests'],
+                           'rejected': m['rejected'],
+                           'wait': m['wait'].summary(),
+                           'run': m['run'].summary()}
+                    for name, m in self._metrics.items()}
+
+    def get_metrics(self, x):
+        '''
+        RPC service returning the stats of the services, the channel
+        names of which have ':' replaced by '_' as field names. wait is
+        the wait of a request from its arrival at the pool until a worker
+        runs it.
+        '''
+        fields = {}
+        values = {}
+        for name, s in self.stats().items():
+            key = name.replace(':', '_')
+            fields[key] = {'requests': pva.ULONG, 'rejected': pva.ULONG,
+                           'wait_p50': pva.DOUBLE, 'wait_p99': pva.DOUBLE,
+                           'wait_max': pva.DOUBLE, 'run_p50': pva.DOUBLE,
+                           'run_p99': pva.DOUBLE, 'run_max': pva.DOUBLE}
+            values[key] = {'requests': s['requests'],
+                           'rejected': s['rejected'],
+                           'wait_p50': s['wait']['p50'],
+                           'wait_p99': s['wait']['p99'],
+                           'wait_max': s['wait']['max'],
+                           'run_p50': s['run']['p50'],
+                           'run_p99': s['run']['p99'],
+                           'run_max': s['run']['max']}
+
+        return pva.PvObject(fields, values)
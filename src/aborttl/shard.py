@@ -0,0 +1,413 @@
+import multiprocessing
+import threading
+import time
+from collections import Counter
+from queue import Queue, Empty
+
+from .logger import get_default_logger
+from .aborttl import Aborttl, collect_events
+from .abortch import AbortCh, wait_connection
+from .resetpvcounter import ResetPVCounter
+from .pending import TimestampResolver
+
+
+class ShardReload(object):
+    '''
+    Command to a worker to create and remove abort channels.
+    '''
+
+    def __init__(self, added, removed):
+        self.added = added
+        self.removed = removed
+
+
+class ShardWorker(object):
+    '''
+    Owner of one partition of the abort channels in a worker process.
+    It resolves the abort timestamps of its channels and sends
+    ('init', shard_id, [(pvname, abort)], unreachable) once connected, and
+    again for the channels added by a reload, then
+    ('events', shard_id, events, resolved, stats) for each pass and at
+    least every report_interval [s] to update the stats. resolved is a
+    list of (n, event) where n is the number of the events of the pass
+    applied before the event is resolved.
+    ctrl_q delivers ShardReload commands and None to stop.
+    '''
+
+    def __init__(self, shard_id, pvnames, out_q, ctrl_q,
+                 batch_delay=0.01, connection_timeout=5,
+                 channel_class=AbortCh, ts_options=None, report_interval=1,
+                 logger=None):
+        self._logger = logger or get_default_logger()
+        self._shard_id = shard_id
+        self._out_q = out_q
+        self._ctrl_q = ctrl_q
+        self._batch_delay = batch_delay
+        self._connection_timeout = connection_timeout
+        self._channel_class = channel_class
+        self._report_interval = report_interval
+        self._stop = False
+
+        self._q = Queue()
+        self._channels = {}
+        self._resolver = TimestampResolver(self._channels, logger=self._logger,
+                                           **(ts_options or {}))
+
+        for pvname in pvnames:
+            self._create_channel(pvname)
+
+    def _create_channel(self, pvname):
+        self._channels[pvname] = self._channel_class(pvname, self._q.put,
+                                                     logger=self._logger)
+
+    def _wait_command(self):
+        while True:
+            command = self._ctrl_q.get()
+            if command is None:
+                self._stop = True
+                self._q.put(None)
+                return
+
+            self._q.put(command)
+
+    def _reload(self, command):
+        for pvname in command.removed:
+            self._channels.pop(pvname).disconnect()
+            self._resolver.discard(pvname)
+
+        for pvname in command.added:
+            self._create_channel(pvname)
+
+        # the abort status of the added channels is sent once connected
+        if command.added:
+            self._send_init({pvname: self._channels[pvname]
+                             for pvname in command.added})
+
+        self._logger.debug('Shard {}: {} added, {} removed'
+                           .format(self._shard_id, len(command.added),
+                                   len(command.removed)))
+
+    def _send_init(self, channels):
+        unreachable = wait_connection(channels, self._connection_timeout)
+
+        skip = set(unreachable)
+        statuses = [(pvname, bool(ch.abort))
+                    for pvname, ch in channels.items()
+                    if pvname not in skip]
+        self._out_q.put(('init', self._shard_id, statuses, unreachable))
+
+        return unreachable
+
+    def run(self):
+        unreachable = self._send_init(self._channels)
+
+        thread = threading.Thread(target=self._wait_command)
+        thread.daemon = True
+        thread.start()
+
+        n_connected = len(self._channels) - len(unreachable)
+        next_report = time.monotonic() + self._report_interval
+        while not self._stop:
+            deadline = self._resolver.next_deadline()
+            if deadline is None or deadline > next_report:
+                deadline = next_report
+            timeout = max(deadline - time.monotonic(), 0)
+
+            events = []
+            for item in collect_events(self._q, timeout, self._batch_delay):
+                if isinstance(item, ShardReload):
+                    self._reload(item)
+                else:
+                    events.append(item)
+
+            events = [e for e in events if e.pvname in self._channels]
+
+            # each edge is resolved after the events before it, so the
+            # coordinator can split the pass where a ring is cleared
+            resolved = [(0, e) for e in self._resolver.resolve([])]
+            for n, event in enumerate(events, 1):
+                resolved.extend((n, e)
+                                for e in self._resolver.resolve([event]))
+
+            report = time.monotonic() >= next_report
+            if report:
+                next_report = time.monotonic() + self._report_interval
+                n_connected = sum(ch.connected
+                                  for ch in self._channels.values())
+
+            if events or resolved or report:
+                stats = dict(self._resolver.stats(), connected=n_connected)
+                self._out_q.put(('events', self._shard_id, events, resolved,
+                                 stats))
+
+
+def run_shard(shard_id, pvnames, out_q, ctrl_q, options):
+    '''
+    Entry point of a worker process.
+    '''
+    options = dict(options)
+
+    logger = get_default_logger()
+    logger.setLevel(options.pop('log_level'))
+    AbortCh.fields.update(options.pop('fields'))
+
+    worker = ShardWorker(shard_id, pvnames, out_q, ctrl_q,
+                         logger=logger, **options)
+    worker.run()
+
+
+class ShardedAborttl(Aborttl):
+    '''
+    Aborttl whose abort channels are split across n_workers processes.
+    Each worker has its own CA context and resolves the abort timestamps
+    of its channels. This process coordinates the abort correlation and
+    the reset PV counter, so abort ids stay globally consistent.
+    '''
+
+    def __init__(self, dburi, resetpvname, n_workers=2, logger=None,
+                 **kwargs):
+        self._n_workers = n_workers
+        self._workers = []
+        self._ctrl_qs = []
+        self._shard_of = {}
+        self._backlog = []
+        self._shard_stats = {}
+        self._check_interval = 1
+        self._stopping = False
+
+        super().__init__(dburi, resetpvname, logger=logger, **kwargs)
+
+    def _init_pv(self):
+        self._resetpv = ResetPVCounter(self._resetpvname, logger=self._logger,
+                                       source=self._source)
+
+        self._update_pvlist()
+
+        ctx = multiprocessing.get_context('spawn')
+        self._shard_q = ctx.Queue()
+
+        options = {'log_level': self._logger.getEffectiveLevel(),
+                   'fields': dict(AbortCh.fields),
+                   'batch_delay': self._batch_delay,
+                   'connection_timeout': self._connection_timeout,
+                   'channel_class': self._channel_class,
+                   'ts_options': self._ts_options}
+
+        self._t_created = time.monotonic()
+        pvnames = sorted(self._pvs)
+        for shard_id in range(self._n_workers):
+            shard_pvnames = pvnames[shard_id::self._n_workers]
+            self._shard_of.update((pvname, shard_id)
+                                  for pvname in shard_pvnames)
+
+            ctrl_q = ctx.Queue()
+            self._ctrl_qs.append(ctrl_q)
+
+            args = (shard_id, shard_pvnames, self._shard_q, ctrl_q, options)
+            worker = ctx.Process(target=run_shard, args=args,
+                                 name='AborttlShard{}'.format(shard_id))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _initial_abort_check(self):
+        unreachable = []
+        n_init = 0
+        while n_init < self._n_workers:
+            try:
+                msg = self._shard_q.get(timeout=1)
+            except Empty:
+                self._check_workers()
+                continue
+
+            if msg[0] != 'init':
+                self._backlog.append(msg)
+                continue
+
+            self._seed_statuses(msg[2])
+            unreachable.extend(msg[3])
+            n_init += 1
+            self._logger.debug('Shard {} is ready'.format(msg[1]))
+
+        self._report_startup(len(self._shard_of), sorted(unreachable))
+
+        for ring, abtinfo in self._abtinfo.items():
+            abtinfo.iniail_abort = self._ring_status.is_abort(ring)
+
+    def _apply_pvlist(self, added, removed):
+        commands = [ShardReload([], []) for i in range(self._n_workers)]
+
+        for pvname in removed:
+            commands[self._shard_of.pop(pvname)].removed.append(pvname)
+
+        # added channels go to the workers with the fewest channels
+        sizes = Counter(self._shard_of.values())
+        for pvname in added:
+            shard_id = min(range(self._n_workers), key=lambda i: sizes[i])
+            sizes[shard_id] += 1
+            self._shard_of[pvname] = shard_id
+            commands[shard_id].added.append(pvname)
+
+        for ctrl_q, command in zip(self._ctrl_qs, commands):
+            if command.added or command.removed:
+                ctrl_q.put(command)
+
+    def _check_workers(self):
+        '''
+        Raise RuntimeError when a worker exited before stop.
+        '''
+        if self._stopping:
+            return
+
+        for worker in self._workers:
+            if not worker.is_alive():
+                self._logger.critical('{} exited with {}'
+                                      .format(worker.name, worker.exitcode))
+                raise RuntimeError('{} exited'.format(worker.name))
+
+    def _wait_events(self):
+        if self._backlog:
+            messages, self._backlog = self._backlog, []
+            return messages
+
+        # the queue is polled to notice a worker which exited, since its
+        # channels go silent
+        messages = collect_events(self._shard_q, self._check_interval,
+                                  self._batch_delay)
+        self._check_workers()
+
+        return messages
+
+    def _run_loop(self, messages):
+        events = []
+        shards = []
+        # resolved events with the shard and the number of the events of
+        # the shard applied before them
+        resolved = []
+        n_shard = Counter()
+        for message in messages:
+            # abort status of the channels added by a reload
+            if message[0] == 'init':
+                self._seed_statuses(message[2])
+                for pvname in message[3]:
+                    self._logger.warning('{} is not connected'
+                                         .format(pvname))
+                continue
+
+            kind, shard_id, shard_events, shard_resolved, stats = message
+            self._shard_stats[shard_id] = stats
+
+            # drop events of channels removed by reload
+            applied = [n_shard[shard_id]]
+            for event in shard_events:
+                if event.pvname in self._pvs:
+                    events.append(event)
+                    shards.append(shard_id)
+                    n_shard[shard_id] += 1
+                applied.append(n_shard[shard_id])
+
+            resolved.extend((shard_id, applied[n], event)
+                            for n, event in shard_resolved
+                            if event.pvname in self._pvs)
+
+        events, resolved = self._merge(events, shards, resolved)
+
+        n_applied = 0
+        while True:
+            # an abort ends when its ring is cleared, so the events after
+            # the clear are correlated as a new abort
+            n = self._update_statuses(events[n_applied:])
+            n_applied += n
+
+            i = 0
+            while i < len(resolved) and resolved[i][0] <= n_applied:
+                i += 1
+            burst, resolved = resolved[:i], resolved[i:]
+            self._correlate([event for n, event in burst])
+
+            # check abort status for each ring
+            if n or burst:
+                self._update_ring_status()
+
+            if n_applied >= len(events):
+                break
+
+    def _merge(self, events, shards, resolved):
+        '''
+        Merge the events of the shards by the callback time, which is
+        comparable between the processes, and return them with the
+        resolved events as (n, event) where n is the number of the merged
+        events applied before the event is resolved. Events without t_cb
+        keep the order of arrival.
+        '''
+        order = list(range(len(events)))
+        if all(event.t_cb is not None for event in events):
+            order.sort(key=lambda i: (events[i].t_cb, shards[i]))
+
+        # bounds[shard_id][k] is the number of the merged events applied
+        # once the first k events of the shard are applied
+        bounds = {shard_id: [0] for shard_id in set(shards)}
+        positions = [0] * len(events)
+        for position, i in enumerate(order, 1):
+            positions[i] = position
+        for i, shard_id in enumerate(shards):
+            bound = bounds[shard_id]
+            bound.append(max(bound[-1], positions[i]))
+
+        resolved = sorted(((bounds[shard_id][k] if k else 0, event)
+                           for shard_id, k, event in resolved),
+                          key=lambda item: item[0])
+
+        return [events[i] for i in order], resolved
+
+    def _wake(self):
+        self._shard_q.put(None)
+
+    def stats(self):
+        pending = {'pending': 0, 'retries': 0, 'timeouts': 0}
+        for stats in self._shard_stats.values():
+            for key in pending:
+                pending[key] += stats[key]
+
+        return {'events': self._n_events,
+                'writer': self._writer.stats(),
+                'pending': pending,
+                'startup': dict(self._startup),
+                'workers': sum(w.is_alive() for w in self._workers)}
+
+    def _queue_depth(self):
+        return self._shard_q.qsize()
+
+    def _n_connected(self):
+        return sum(stats['connected'] for stats in
+                   list(self._shard_stats.values()))
+
+    def stop(self, timeout=5):
+        '''
+        Stop the workers and terminate the ones which have not exited
+        in timeout [s].
+        '''
+        self._stopping = True
+        for ctrl_q in self._ctrl_qs:
+            ctrl_q.put(None)
+        super().stop()
+
+        # a worker exits after its messages are flushed to the queue, so
+        # the queue is drained while joining
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            while worker.is_alive() and time.monotonic() < deadline:
+                self._drain_shard_q()
+                worker.join(0.1)
+
+            if worker.is_alive():
+                self._logger.warning('Terminate {}'.format(worker.name))
+                worker.terminate()
+                worker.join()
+
+    def _drain_shard_q(self):
+        try:
+            while True:
+                self._shard_q.get_nowait()
+        except Empty:
+            pass
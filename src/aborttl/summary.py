@@ -0,0 +1,33 @@
+'''
+Recompute the abort summary table from the abort signals, e.g. after
+signals were imported without DbHandler.
+'''
+import argparse
+import time
+
+from .dbhandler import DbHandler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('-u', '--uri', dest='uri',
+                        help='Database URI',
+                        required=True)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    start = time.perf_counter()
+    dh = DbHandler(args.uri)
+    n = dh.rebuild_abort_summary()
+
+    print('Summarized {} aborts in {:.1f} s'.format(
+          n, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
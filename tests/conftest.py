@@ -245,18 +245,18 @@ def mock_data():
 
                              {'abt_id': 2,
                               'ts': '2018-01-01 00:10:00.123456790',
-                              'pvname': 'B',
-                              'msg': 'Abort B',
-                              'ring': 'HER',
+                              'pvname': 'D',
+                              'msg': 'Abort D',
+                              'ring': 'LER',
                               'reset_cnt': 0,
                               'trg_cnt': 10,
                               'int_cnt': 1000},
 
                              {'abt_id': 2,
                               'ts': '2018-01-01 00:10:00.123456790',
-                              'pvname': 'D',
-                              'msg': 'Abort D',
-                              'ring': 'LER',
+                              'pvname': 'B',
+                              'msg': 'Abort B',
+                              'ring': 'HER',
                               'reset_cnt': 0,
                               'trg_cnt': 10,
                               'int_cnt': 1000},
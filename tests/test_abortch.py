@@ -28,8 +28,11 @@ def abt_ch(fieldset, caclient):
     return ch
 
 
-def cb(pvname=None, value=None):
-    pass
+events = []
+
+
+def cb(event):
+    events.append(event)
 
 
 def test_abortch_abort_property(softioc, caclient, fieldset, abt_ch):
@@ -166,3 +169,54 @@ def test_abortch_timestamp_after_6sec(softioc, caclient, fieldset, abt_ch):
 
     pv.put(0, timeout=1)
     time.sleep(0.1)
+
+
+def test_abortch_snapshot_at_abort_edge(softioc, caclient, fieldset, abt_ch):
+    pv = PV(PVNAME)
+    pv_acnt = PV(PVNAME + ':ACNT')
+    pv_tcnt = PV(PVNAME + ':TCNT')
+    pv_sec = PV(PVNAME + ':TIME_SEC')
+    pv_nsec = PV(PVNAME + ':TIME_NANO')
+
+    pv.put(0, wait=True)
+    time.sleep(0.1)
+
+    t = time.time()
+    t_sec, t_nano = ('%.9f' % t).split('.')
+    pv_acnt.put(5, wait=True)
+    pv_tcnt.put(6, wait=True)
+    pv_sec.put(int(t_sec), wait=True)
+    pv_nsec.put(int(t_nano), wait=True)
+    time.sleep(0.1)
+
+    del events[:]
+    pv.put(1, wait=True)
+    time.sleep(0.1)
+
+    # counters updated after the abort edge
+    pv_acnt.put(7, wait=True)
+    pv_tcnt.put(8, wait=True)
+    time.sleep(0.1)
+
+    assert len(events) == 1
+    event = events[0]
+
+    dt = datetime.fromtimestamp(int(t_sec))
+    tstr = dt.isoformat(' ') + '.' + str(int(t_nano)).zfill(9)
+
+    assert event.pvname == PVNAME
+    assert event.abort is True
+    assert event.acnt == 5
+    assert event.tcnt == 6
+    assert event.sec == int(t_sec)
+    assert event.timestamp == tstr
+    assert event.pv_ts == abt_ch.ts
+
+    # snapshot taken later reads the latest counters of the same edge
+    event = abt_ch.snapshot(event)
+    assert event.acnt == 7
+    assert event.tcnt == 8
+    assert event.pv_ts == events[0].pv_ts
+
+    pv.put(0, wait=True)
+    time.sleep(0.1)
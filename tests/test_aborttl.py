@@ -8,8 +8,8 @@ from epics import PV
 from epics.ca import CAThread
 
 from aborttl.dbhandler import DbHandler
-from aborttl.abortch import AbortCh
-from aborttl.aborttl import Aborttl
+from aborttl.abortch import AbortCh, AbortEvent, INVALID_TIMESTAMP
+from aborttl.aborttl import Aborttl, RingStatus
 
 
 Signal = namedtuple('Signal', ['abt_id', 'ts', 'pvname', 'msg',
@@ -130,6 +130,9 @@ def atl(softioc, caclient, tmpdir_factory):
 
 
 def test_initial_abort(softioc, caclient, atl):
+    assert atl.is_ready
+    assert atl.stats()['startup']['unreachable'] == []
+
     t1 = put_abort_ch(1, 0, 0)
     t2 = put_abort_ch(2, 1, 0)
 
@@ -303,3 +306,219 @@ def test_timestamp_update_later(softioc, caclient, atl):
     for i in range(5):
         clear_ch(i+1)
     time.sleep(1)
+
+
+def test_callback_to_commit_latency(softioc, caclient, atl):
+    name = 'ET_dummyHost:ABORTCH1'
+    pv_abort = PV(name)
+    pv_sec = PV(name + ':TIME_SEC')
+    pv_nsec = PV(name + ':TIME_NANO')
+
+    atl.latency.clear()
+    latencies = []
+    for i in range(5):
+        n_signals = len(atl._dh.fetch_abort_signals(first=False))
+
+        t_sec, t_nano = ('%.9f' % time.time()).split('.')
+        pv_sec.put(int(t_sec), wait=True)
+        pv_nsec.put(int(t_nano), wait=True)
+
+        start = time.monotonic()
+        pv_abort.put(1, wait=True)
+        while len(atl._dh.fetch_abort_signals(first=False)) == n_signals:
+            assert time.monotonic() - start < 1, 'Abort is not committed'
+            time.sleep(0.001)
+        latencies.append(time.monotonic() - start)
+
+        clear_ch(1)
+        time.sleep(0.5)
+
+    latencies.sort()
+    assert latencies[len(latencies) // 2] < 0.05, latencies
+
+    summary = atl.latency.summary()
+    assert summary['total']['count'] == 5
+    assert summary['total']['p50'] < 0.05, summary
+    assert summary['total']['max'] >= summary['write']['max']
+
+
+def test_ring_status():
+    rs = RingStatus()
+    assert not rs.any_abort()
+
+    rs.update('HER', 'A', True)
+    rs.update('HER', 'A', True)
+    rs.update('HER', 'B', True)
+    rs.update('LER', 'C', False)
+    assert rs.counts == {'LER': 0, 'HER': 2}
+    assert rs.is_abort('HER')
+    assert not rs.is_abort('LER')
+
+    rs.update('HER', 'A', False)
+    rs.update('HER', 'A', False)
+    assert rs.counts['HER'] == 1
+
+    rs.update('HER', 'B', False)
+    assert not rs.any_abort()
+
+
+def test_ring_status_edges():
+    rs = RingStatus()
+    rs.add_edge('HER', 'A', 1)
+    rs.add_edge('HER', 'A', 1)
+    rs.add_edge('HER', 'B', 1)
+
+    assert rs.pop_edge('HER', 'A', 1)
+    assert rs.pop_edge('HER', 'A', 1)
+    assert not rs.pop_edge('HER', 'A', 1)
+    assert not rs.pop_edge('LER', 'B', 1)
+
+    rs.add_edge('HER', 'A', 2)
+    rs.remove('HER', 'A')
+    assert not rs.pop_edge('HER', 'A', 2)
+
+    rs.clear_edges('HER')
+    assert not rs.pop_edge('HER', 'B', 1)
+
+
+class FakeCh(object):
+    def __init__(self, pvname, cb, logger=None, source=None):
+        self.pvname = pvname
+        self.abort = pvname == 'A'
+        self.is_connected = True
+
+    @property
+    def connected(self):
+        return self.is_connected and not self.pvname.startswith('X')
+
+    def disconnect(self):
+        self.is_connected = False
+
+
+def test_reload_pvlist(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('reload.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'C', 'ring': 'LER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'}])
+
+    def updater():
+        dh.update_current_pvs([{'pvname': 'B', 'msg': 'New abort B'},
+                               {'pvname': 'C', 'msg': 'Abort C'}])
+
+    atl = Aborttl(uri, 'ET_dummyHost:RESETw', channel_class=FakeCh,
+                  pvlist_updater=updater)
+    ch_a = atl._channels['A']
+    ch_b = atl._channels['B']
+    atl._ring_status.update('HER', 'A', True)
+
+    result = atl.reload_pvlist()
+
+    assert result['added'] == 1
+    assert result['removed'] == 1
+    assert sorted(atl._channels) == ['B', 'C']
+    assert atl._channels['B'] is ch_b
+    assert not ch_a.is_connected
+    assert ch_b.is_connected
+    assert atl._pvs['B']['msg'] == 'New abort B'
+    assert not atl._ring_status.any_abort()
+
+
+def test_reload_pvlist_in_abort(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('reload.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': 'B', 'msg': 'Abort B'}])
+
+    atl = Aborttl(uri, 'ET_dummyHost:RESETw', channel_class=FakeCh)
+    atl._initial_abort_check()
+    assert not atl._ring_status.any_abort()
+
+    # A is in abort when it is added
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'}])
+    atl.reload_pvlist()
+
+    assert atl._ring_status.is_abort('HER')
+    assert atl._ring_status.statuses['HER'] == {'A': True, 'B': False}
+
+
+class LateCh(FakeCh):
+    def __init__(self, pvname, cb, logger=None, source=None):
+        super().__init__(pvname, cb, logger, source)
+        self.abort = False
+        self.event = None
+
+    def snapshot(self, event=None):
+        return self.event
+
+
+def test_late_edge_is_unlinked(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('late.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'}])
+
+    atl = Aborttl(uri, 'ET_dummyHost:RESETw', channel_class=LateCh,
+                  ts_retry_interval=0)
+    atl._initial_abort_check()
+    atl._writer.start()
+
+    ts_a = '2019-01-01 00:00:00.000000000'
+    ts_b = '2019-01-01 01:00:00.000000000'
+    edge_a = AbortEvent('A', True, 1, 2, 1546268400, INVALID_TIMESTAMP,
+                        1546268400, ts_a, seq=1)
+    edge_b = AbortEvent('B', True, 1, 2, 1546272000, ts_b,
+                        1546272000, ts_b, seq=1)
+    ch_a = atl._channels['A']
+
+    # A aborts and clears before its timestamp is updated
+    ch_a.event = edge_a
+    atl._run_loop([edge_a])
+    atl._run_loop([edge_a._replace(abort=False, seq=2)])
+    ch_a.event = edge_a._replace(timestamp=ts_a)
+    atl._run_loop([])
+    atl._run_loop([edge_b])
+    atl._writer.stop()
+
+    signals = dh.fetch_abort_signals(first=False, include_no_abt_id=True)
+    assert sorted((s['pvname'], s['abt_id']) for s in signals) == [
+        ('A', None), ('B', 1)]
+    assert [(a['abt_id'], a['abt_time']) for a in dh.fetch_aborts()] == [
+        (1, ts_b)]
+
+
+def test_startup_report(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('startup.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'X1', 'ring': 'LER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'},
+                           {'pvname': 'X1', 'msg': 'Abort X1'}])
+
+    atl = Aborttl(uri, 'ET_dummyHost:RESETw', channel_class=FakeCh,
+                  connection_timeout=0.2)
+    assert not atl.is_ready
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    assert atl.wait_ready(5)
+
+    startup = atl.stats()['startup']
+    assert startup['channels'] == 3
+    assert startup['connected'] == 2
+    assert startup['unreachable'] == ['X1']
+    assert startup['elapsed'] >= 0.2
+    assert atl._ring_status.is_abort('HER')
+    assert not atl._ring_status.is_abort('LER')
+
+    atl.stop()
+    thread.join()
+    assert not atl.is_ready
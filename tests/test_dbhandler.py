@@ -1,7 +1,11 @@
+import itertools
+import threading
+from datetime import datetime
+
 import pytest
 import sqlalchemy as sa
 
-from aborttl.dbhandler import DbHandler
+from aborttl.dbhandler import DbHandler, ts_to_ns, fts_query
 
 
 @pytest.fixture
@@ -19,6 +23,8 @@ def dh(mock_data):
 
     conn.close()
 
+    dh.rebuild_abort_summary()
+
     return dh
 
 
@@ -48,11 +54,14 @@ def test_table_schema(dh):
                                  (5, 'reset_cnt', 'INTEGER', 0, None, 0),
                                  (6, 'trg_cnt', 'INTEGER', 0, None, 0),
                                  (7, 'int_cnt', 'INTEGER', 0, None, 0),
+                                 (8, 'pv_ts_ns', 'BIGINT', 0, None, 0),
+                                 (9, 'abt_ts_ns', 'BIGINT', 0, None, 0)
                                 ]
 
     schemas['aborts'] = [
                           (0, 'abt_id', 'INTEGER', 1, None, 1),
-                          (1, 'abt_time', 'TEXT', 0, None, 0)
+                          (1, 'abt_time', 'TEXT', 0, None, 0),
+                          (2, 'abt_time_ns', 'BIGINT', 0, None, 0)
                          ]
 
     schemas['abort_list'] = [
@@ -68,16 +77,22 @@ def test_table_schema(dh):
 
 
 def test_table_index(dh):
-    table_list = ['abort_signals', 'aborts']
+    table_list = ['abort_signals', 'aborts', 'abort_list']
 
     # index = seq, name, unique, origin, partial
     indices = {}
     indices['abort_signals'] = [
                                  (0, 'ix_abort_signals_abt_ts', 0, 'c', 0),
-                                 (1, 'ix_abort_signals_msg', 0, 'c', 0)
+                                 (1, 'ix_abort_signals_msg', 0, 'c', 0),
+                                 (2, 'ix_abort_signals_abt_ts_ns', 0, 'c', 0),
+                                 (3, 'ix_abort_signals_pvname', 0, 'c', 0)
                                ]
 
-    indices['aborts'] = [(0, 'ix_aborts_abt_time', 1, 'c', 0)]
+    indices['aborts'] = [(0, 'ix_aborts_abt_time', 1, 'c', 0),
+                         (1, 'ix_aborts_abt_time_ns', 0, 'c', 0)]
+
+    indices['abort_list'] = [(0, 'ix_abort_list_abt_signal_id', 0, 'c', 0),
+                             (1, 'sqlite_autoindex_abort_list_1', 1, 'pk', 0)]
 
     for table in table_list:
         index = dh.engine.execute("PRAGMA INDEX_LIST('{}')".format(table))
@@ -292,6 +307,455 @@ def test_update_abort(dh):
     aborts = dh.fetch_aborts()
     for abort in aborts:
         if abort['abt_id'] == 1 and abort['abt_time'] == abort_time:
+            assert abort['abt_time_ns'] == ts_to_ns(abort_time)
             break
     else:
         assert False, 'Failed to update abort'
+
+
+def test_fetch_last_abort_id(dh):
+    assert dh.fetch_last_abort_id() == 6
+
+
+def test_fetch_data_version(dh):
+    assert dh.fetch_data_version() == (6, 15)
+    assert DbHandler('sqlite://').fetch_data_version() == (0, 0)
+
+
+def test_insert_abort_burst(dh):
+    commits = []
+    sa.event.listen(dh.engine, 'commit', lambda conn: commits.append(conn))
+
+    aborts = [{'abt_id': 7, 'abt_time': '2019-01-01 00:00:01.000000000'}]
+    updates = [{'abt_id': 6, 'abt_time': '2018-01-06 00:00:00.000000000'}]
+    signals = [
+                 {'pvname': 'A',
+                     'msg': 'Abort A',
+                     'pv_ts': '2019-01-01 00:00:01.100000000',
+                     'abt_ts': '2019-01-01 00:00:01.000000000',
+                     'reset_cnt': 0,
+                     'trg_cnt': 1,
+                     'int_cnt': 2,
+                     'abt_id': 7},
+                 {'pvname': 'B',
+                     'msg': 'Abort B',
+                     'pv_ts': '2019-01-01 00:00:02.100000000',
+                     'abt_ts': '2019-01-01 00:00:02.000000000',
+                     'reset_cnt': 1,
+                     'trg_cnt': 2,
+                     'int_cnt': 3,
+                     'abt_id': 7},
+                 {'pvname': 'C',
+                     'msg': 'Abort C',
+                     'pv_ts': '2019-01-01 00:00:03.100000000',
+                     'abt_ts': '2019-01-01 00:00:03.000000000',
+                     'reset_cnt': 0,
+                     'trg_cnt': 1,
+                     'int_cnt': 1,
+                     'abt_id': None},
+                 ]
+
+    ids = dh.insert_abort_burst(aborts, signals, updates)
+
+    assert ids == [16, 17, 18]
+    assert len(commits) == 1
+
+    aborts = {a['abt_id']: a['abt_time'] for a in dh.fetch_aborts()}
+    assert aborts[6] == '2018-01-06 00:00:00.000000000'
+    assert aborts[7] == '2019-01-01 00:00:01.000000000'
+    ns = {a['abt_id']: a['abt_time_ns'] for a in dh.fetch_aborts()}
+    assert ns[6] == ts_to_ns('2018-01-06 00:00:00.000000000')
+    assert ns[7] == ts_to_ns('2019-01-01 00:00:01.000000000')
+
+    db_signals = dh.fetch_abort_signals(sstart='2019', first=False,
+                                        include_no_abt_id=True)
+    assert [(s['abt_id'], s['pvname']) for s in db_signals] == [
+            (None, 'C'), (7, 'A'), (7, 'B')]
+
+    with pytest.raises(sa.exc.IntegrityError):
+        dh.insert_abort_burst(signals=[dict(signals[0], abt_id=8)])
+    assert len(dh.fetch_abort_signals(sstart='2019', first=False,
+                                      include_no_abt_id=True)) == 3
+
+
+def test_insert_abort_burst_other_writer(tmpdir, mock_data):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('burst.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs(mock_data['pvs'])
+    other = DbHandler(uri)
+
+    signal = {'pvname': 'A', 'msg': 'Abort A',
+              'pv_ts': '2019-01-01 00:00:01.100000000',
+              'abt_ts': '2019-01-01 00:00:01.000000000',
+              'reset_cnt': 0, 'trg_cnt': 1, 'int_cnt': 2, 'abt_id': None}
+    threads = []
+
+    def write_other(conn, cursor, statement, *args):
+        if threads or 'max(abort_signals.abt_signal_id)' not in statement:
+            return
+
+        # another writer tries to commit between the read of the last
+        # signal id and the insert
+        thread = threading.Thread(target=other.insert_abort_burst,
+                                  kwargs={'signals': [signal]})
+        threads.append(thread)
+        thread.start()
+        thread.join(0.5)
+
+    sa.event.listen(dh.engine, 'after_cursor_execute', write_other)
+    ids = dh.insert_abort_burst(signals=[signal, signal])
+    threads[0].join()
+
+    assert ids == [1, 2]
+    rows = dh.engine.execute(sa.select([
+            dh.tables['abort_signals'].c.abt_signal_id])).fetchall()
+    assert sorted(row[0] for row in rows) == [1, 2, 3]
+
+
+def test_ts_to_ns():
+    ns = ts_to_ns('2018-01-01 00:00:00.123456789')
+    assert ns % 10 ** 9 == 123456789
+    assert ns // 10 ** 9 == int(datetime(2018, 1, 1).timestamp())
+
+    assert ts_to_ns('2018-01-01') == ts_to_ns('2018-01-01 00:00:00')
+    assert ts_to_ns('2018-01-01 00:00:00.5') == ns - 123456789 + 500000000
+    assert ts_to_ns(None) is None
+
+    assert ts_to_ns('2018-01-01T00:00:00.123456789Z') == ns
+    assert ts_to_ns('2018-1-1') == ts_to_ns('2018-01-01')
+    for ts in ['now-6h', '2018-01-01 00:00:00.', '2018-13-01',
+               '2018-01-01 00:00:00.1234567890', '']:
+        with pytest.raises(ValueError):
+            ts_to_ns(ts)
+
+
+def test_ns_columns(dh, mock_data):
+    conn = dh.engine.connect()
+    t_as = dh.tables['abort_signals']
+    rows = conn.execute(sa.select([t_as])).fetchall()
+    conn.close()
+
+    for row in rows:
+        assert row['abt_ts_ns'] == ts_to_ns(row['abt_ts'])
+        assert row['pv_ts_ns'] == ts_to_ns(row['pv_ts'])
+
+    for abort in dh.fetch_aborts():
+        assert abort['abt_time_ns'] == ts_to_ns(abort['abt_time'])
+
+    # a full timestamp is an open bound as the text comparison was
+    signals = dh.fetch_abort_signals(
+            astart='2018-01-01 00:00:00.123456789',
+            aend='2018-01-03 00:00:00.123456792')
+    assert {s['abt_id'] for s in signals} == {2, 3}
+
+
+def test_backfill_ns(tmpdir, mock_data):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('old.db')))
+    engine = sa.create_engine(uri)
+    engine.execute('CREATE TABLE aborts (abt_id INTEGER PRIMARY KEY, '
+                   'abt_time TEXT)')
+    engine.execute('CREATE TABLE abort_signals (abt_signal_id INTEGER '
+                   'PRIMARY KEY, pvname TEXT, msg TEXT, pv_ts TEXT, '
+                   'abt_ts TEXT, reset_cnt INTEGER, trg_cnt INTEGER, '
+                   'int_cnt INTEGER)')
+    engine.execute('INSERT INTO aborts (abt_time) VALUES (?)',
+                   [(a['abt_time'],) for a in mock_data['aborts']])
+    engine.execute('INSERT INTO abort_signals (pvname, msg, pv_ts, abt_ts, '
+                   'reset_cnt, trg_cnt, int_cnt) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   [(s['pvname'], s['msg'], s['pv_ts'], s['abt_ts'],
+                     s['reset_cnt'], s['trg_cnt'], s['int_cnt'])
+                    for s in mock_data['abort_signals']])
+    engine.dispose()
+
+    dh = DbHandler(uri)
+
+    for abort in dh.fetch_aborts():
+        assert abort['abt_time_ns'] == ts_to_ns(abort['abt_time'])
+
+    conn = dh.engine.connect()
+    rows = conn.execute(sa.select([dh.tables['abort_signals']])).fetchall()
+    indices = [r[1] for r in conn.execute(
+               "PRAGMA INDEX_LIST('abort_signals')")]
+    conn.close()
+
+    assert len(rows) == len(mock_data['abort_signals'])
+    for row in rows:
+        assert row['abt_ts_ns'] == ts_to_ns(row['abt_ts'])
+        assert row['pv_ts_ns'] == ts_to_ns(row['pv_ts'])
+    assert 'ix_abort_signals_abt_ts_ns' in indices
+
+    # a second start does not add the columns again
+    DbHandler(uri)
+
+
+def test_fetch_abort_summary(dh):
+    summary = dh.fetch_abort_summary()
+    assert [row['abt_id'] for row in summary] == [1, 2, 3, 4, 5, 6]
+
+    assert dict(summary[0]) == {
+            'abt_id': 1, 'abt_time': '2018-01-01 00:00:00.123456789',
+            'first_ts': '2018-01-01 00:00:00.123456789',
+            'first_pvname': 'B', 'first_msg': 'Abort B', 'n_signals': 4,
+            'rings': 'HER', 'last_ts': '2018-01-01 00:01:00.423456789'}
+
+    # the earlier signal is the first cause of a tie
+    assert (summary[1]['first_pvname'], summary[1]['n_signals'],
+            summary[1]['rings'], summary[1]['last_ts']) == (
+            'D', 3, 'HER,LER', '2018-01-01 00:10:01.123456790')
+
+    summary = dh.fetch_abort_summary(ring='LER', astart='2018-01-01',
+                                     aend='2018-01-04')
+    assert [row['abt_id'] for row in summary] == [2, 4]
+
+
+def test_abort_summary_on_insert(dh):
+    def signal(pvname, ts):
+        return {'pvname': pvname, 'msg': 'Abort ' + pvname,
+                'pv_ts': ts, 'abt_ts': ts, 'reset_cnt': 0, 'trg_cnt': 0,
+                'int_cnt': 0, 'abt_id': 7}
+
+    aborts = [{'abt_id': 7, 'abt_time': '2019-01-01 00:00:01.000000000'}]
+    dh.insert_abort_burst(aborts, [signal('A', '2019-01-01 00:00:01.0'),
+                                   signal('B', '2019-01-01 00:00:02.0')])
+    dh.insert_abort_burst(signals=[signal('D', '2019-01-01 00:00:00.5'),
+                                   dict(signal('C', '2019-01-01 00:00:03.0'),
+                                        abt_id=None)])
+    dh.insert_abort_signals([signal('E', '2019-01-01 00:00:04.0')], abt_id=7)
+
+    row = dh.fetch_abort_summary(astart='2019')[0]
+    assert (row['first_pvname'], row['first_ts'], row['n_signals'],
+            row['rings'], row['last_ts']) == (
+            'D', '2019-01-01 00:00:00.5', 4, 'HER,LER',
+            '2019-01-01 00:00:04.0')
+
+    summary = [dict(row) for row in dh.fetch_abort_summary()]
+    assert dh.rebuild_abort_summary() == 7
+    assert [dict(row) for row in dh.fetch_abort_summary()] == summary
+
+    signals = dh.fetch_abort_signals(astart='2019', first=False,
+                                     with_time_delta=True)
+    assert [(s['pvname'], s['delta']) for s in signals] == [
+            ('A', 0.5), ('B', 1.5), ('D', 0.0), ('E', 3.5)]
+
+
+def test_create_indexes(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('index.db')))
+    dh = DbHandler(uri)
+    dh.engine.execute('DROP INDEX ix_abort_list_abt_signal_id')
+    dh.engine.execute('DROP INDEX ix_abort_signals_pvname')
+    dh.engine.dispose()
+
+    dh = DbHandler(uri)
+    indices = {r[1] for table in ('abort_list', 'abort_signals')
+               for r in dh.engine.execute(
+                   "PRAGMA INDEX_LIST('{}')".format(table))}
+    assert {'ix_abort_list_abt_signal_id',
+            'ix_abort_signals_pvname'} <= indices
+
+
+def explain(dh, s):
+    compiled = s.compile(dh.engine)
+    params = [compiled.params[key] for key in compiled.positiontup]
+
+    conn = dh.engine.raw_connection()
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + str(compiled),
+                        params).fetchall()
+    conn.close()
+
+    # plan = id, parent, notused, detail
+    return [row[3] for row in plan]
+
+
+def test_query_plan(dh):
+    flags = itertools.product([True, False], [True, False], [True, False],
+                              [None, 'HER'], [None, 'C'],
+                              ['substring', 'token'],
+                              [None, 'abort', 'signal'])
+    for first, no_abt_id, delta, ring, msg, mode, window in flags:
+        kwargs = {'first': first, 'include_no_abt_id': no_abt_id,
+                  'with_time_delta': delta, 'ring': ring, 'msg': msg,
+                  'msg_mode': mode}
+        if window == 'abort':
+            kwargs['astart'], kwargs['aend'] = '2018-01-01', '2018-01-03'
+        elif window == 'signal':
+            kwargs['sstart'], kwargs['send'] = '2018-01-01', '2018-01-03'
+
+        plan = explain(dh, dh.abort_signals_query(**kwargs))
+        scans = [detail for detail in plan if detail.startswith('SCAN') and
+                 'VIRTUAL TABLE' not in detail]
+
+        assert not [detail for detail in plan if 'AUTOMATIC' in detail], \
+            '{}: {}'.format(kwargs, plan)
+        # a time window is searched by an index, only the table driving
+        # a query of all signals is scanned
+        if window:
+            assert not scans, '{}: {}'.format(kwargs, plan)
+        else:
+            assert len(scans) <= 1, '{}: {}'.format(kwargs, plan)
+
+
+def test_fts_query():
+    assert fts_query('RF abort') == '"RF" "abort"'
+    assert fts_query('RF ab', prefix=True) == '"RF"* "ab"*'
+    assert fts_query('a"b') == '"a""b"'
+
+
+def test_message_search(dh):
+    def search(msg, mode):
+        signals = dh.fetch_abort_signals(msg=msg, msg_mode=mode, first=False,
+                                         include_no_abt_id=True)
+        return len(signals)
+
+    assert dh.fts
+    assert [search('Abort', mode) for mode in
+            ('substring', 'token', 'prefix')] == [15, 15, 15]
+    assert [search('bort', mode) for mode in
+            ('substring', 'token', 'prefix')] == [15, 0, 0]
+    assert [search('abo', mode) for mode in
+            ('substring', 'token', 'prefix')] == [15, 0, 15]
+    assert search('abort c', 'token') == 2
+    # wildcards of LIKE are plain characters
+    assert search('%', 'substring') == 0
+    assert search('Abort_C', 'substring') == 0
+
+    with pytest.raises(ValueError):
+        search('Abort', 'regex')
+
+    # the index follows inserts, updates and deletes
+    dh.insert_abort_signals([{'pvname': 'A', 'msg': 'Vacuum burst',
+                              'pv_ts': '2019-01-01 00:00:00.1',
+                              'abt_ts': '2019-01-01 00:00:00.0',
+                              'reset_cnt': 0, 'trg_cnt': 0, 'int_cnt': 0}])
+    assert search('vacuum', 'token') == 1
+
+    dh.engine.execute("UPDATE abort_signals SET msg = 'Vacuum leak' "
+                      "WHERE msg = 'Vacuum burst'")
+    assert search('burst', 'token') == 0
+    assert search('leak', 'token') == 1
+
+    dh.engine.execute("DELETE FROM abort_signals WHERE msg = 'Vacuum leak'")
+    assert search('leak', 'token') == 0
+
+
+def test_fts_rebuild(tmpdir, mock_data):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('fts.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs(mock_data['pvs'])
+    dh.insert_abort_signals(mock_data['abort_signals'])
+    dh.engine.execute('DROP TABLE abort_signals_fts')
+    dh.engine.dispose()
+
+    dh = DbHandler(uri)
+    signals = dh.fetch_abort_signals(msg='abort', msg_mode='token',
+                                     first=False, include_no_abt_id=True)
+    assert len(signals) == 15
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'first': True},
+    {'first': False, 'include_no_abt_id': True},
+    {'first': False, 'with_time_delta': True, 'astart': '2018-01-01',
+     'aend': '2018-01-06'},
+    ])
+def test_fetch_abort_signals_page(dh, kwargs):
+    dh.insert_abort_signals([{'pvname': 'A', 'msg': 'Abort A',
+                              'pv_ts': '2019-01-01 00:00:00.1',
+                              'abt_ts': '2019-01-01 00:00:00.0',
+                              'reset_cnt': 0, 'trg_cnt': 0, 'int_cnt': 0}])
+    signals = dh.fetch_abort_signals(**kwargs)
+
+    for limit in (1, 4, len(signals)):
+        pages = []
+        cursor = None
+        while True:
+            rows, cursor = dh.fetch_abort_signals_page(limit, cursor, **kwargs)
+            assert 0 < len(rows) <= limit
+            pages += [tuple(row)[:-1] for row in rows]
+            if cursor is None:
+                break
+
+        # without the column abt_signal_id of the paged query
+        assert pages == [tuple(row) for row in signals]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'first': True},
+    {'first': False, 'include_no_abt_id': True},
+    {'first': False, 'with_time_delta': True, 'astart': '2018-01-01',
+     'aend': '2018-01-06'},
+    {'first': False, 'msg': 'no such message'},
+    ])
+def test_fetch_abort_signals_columns(dh, kwargs):
+    signals = dh.fetch_abort_signals(**kwargs)
+
+    columns, cursor = dh.fetch_abort_signals_columns(**kwargs)
+    assert cursor is None
+    assert list(zip(*columns.values())) == [tuple(row) for row in signals]
+
+    rows = []
+    while True:
+        columns, cursor = dh.fetch_abort_signals_columns(4, cursor, **kwargs)
+        assert len(columns['abt_signal_id']) <= 4
+        rows += list(zip(*columns.values()))
+        if cursor is None:
+            break
+
+    assert [row[:-1] for row in rows] == [tuple(row) for row in signals]
+
+
+def test_iter_abort_signals(dh):
+    kwargs = {'first': False, 'include_no_abt_id': True,
+              'with_time_delta': True}
+    signals = dh.fetch_abort_signals(**kwargs)
+
+    checkouts = []
+    sa.event.listen(dh.engine, 'checkout', lambda *args: checkouts.append(1))
+    sa.event.listen(dh.engine, 'checkin', lambda *args: checkouts.append(-1))
+
+    assert list(dh.iter_abort_signals(chunk_size=4, **kwargs)) == signals
+    assert list(dh.iter_aborts(chunk_size=4)) == dh.fetch_aborts()
+    assert sum(checkouts) == 0
+
+    # stopping early releases the connection
+    it = dh.iter_abort_signals(chunk_size=4, **kwargs)
+    assert next(it) == signals[0]
+    assert sum(checkouts) == 1
+    it.close()
+    assert sum(checkouts) == 0
+
+    for row in dh.iter_aborts(chunk_size=2):
+        break
+    assert sum(checkouts) == 0
+
+
+def test_storage_profile(tmpdir, mock_data):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('wal.db')))
+    with pytest.raises(ValueError):
+        DbHandler(uri, 'fast')
+
+    dh = DbHandler(uri, 'wal')
+    dh.insert_pvs(mock_data['pvs'])
+    dh.insert_abort_signals(mock_data['abort_signals'])
+
+    pragmas = {name: dh.engine.execute('PRAGMA {}'.format(name)).scalar()
+               for name in ('journal_mode', 'synchronous', 'busy_timeout',
+                            'foreign_keys')}
+    assert pragmas == {'journal_mode': 'wal', 'synchronous': 1,
+                       'busy_timeout': 10000, 'foreign_keys': 1}
+
+    connects = []
+    sa.event.listen(dh.engine, 'connect', lambda *args: connects.append(1))
+    for i in range(3):
+        dh.fetch_abort_signals()
+    assert not connects
+
+    # a writer does not wait for an open read transaction in WAL mode
+    reader = dh.iter_abort_signals(chunk_size=1, first=False,
+                                   include_no_abt_id=True)
+    next(reader)
+    writer = DbHandler(uri)
+    sa.event.listen(writer.engine, 'connect', lambda dbapi_connection, record:
+                    dbapi_connection.execute('PRAGMA busy_timeout=0'))
+    writer.insert_abort('2019-01-01 00:00:00.000000000')
+    assert len(list(reader)) == 14
+    assert writer.fetch_last_abort_id() == 1
@@ -0,0 +1,191 @@
+import threading
+import time
+
+import sqlalchemy as sa
+
+from aborttl.dbhandler import DbHandler
+from aborttl.dbwriter import DbWriter
+from aborttl.latency import LatencyStats
+
+
+class BlockingDbHandler(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.bursts = []
+
+    def insert_abort_burst(self, aborts=None, signals=None, updates=None,
+                           id_map=None):
+        self.release.wait()
+        self.bursts.append((aborts, signals, updates))
+
+
+class FailingDbHandler(BlockingDbHandler):
+    def __init__(self, error):
+        super(FailingDbHandler, self).__init__()
+        self.error = error
+        self.calls = 0
+
+    def insert_abort_burst(self, aborts=None, signals=None, updates=None,
+                           id_map=None):
+        self.release.wait()
+        self.calls += 1
+        if any(s['pvname'] == 'BAD' for s in signals):
+            raise self.error
+        self.bursts.append((aborts, signals, updates))
+
+
+def make_signal(pvname, abt_id):
+    return {'pvname': pvname, 'msg': 'Abort ' + pvname,
+            'pv_ts': '2019-01-01 00:00:00.100000000',
+            'abt_ts': '2019-01-01 00:00:00.000000000',
+            'reset_cnt': 0, 'trg_cnt': 1, 'int_cnt': 2, 'abt_id': abt_id}
+
+
+def test_writer_flush_on_stop():
+    dh = DbHandler('sqlite:///:memory:')
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'LER'}])
+
+    writer = DbWriter(dh)
+    writer.start()
+    writer.put([{'abt_id': 1, 'abt_time': '2019-01-01 00:00:00.000000000'}],
+               [make_signal('A', 1)])
+    writer.put(signals=[make_signal('B', 1)])
+    writer.stop()
+
+    signals = dh.fetch_abort_signals(first=False)
+    assert [(s['abt_id'], s['pvname']) for s in signals] == [(1, 'A'),
+                                                             (1, 'B')]
+    assert writer.stats()['depth'] == 0
+
+
+def test_writer_backpressure_and_stats():
+    dh = BlockingDbHandler()
+    writer = DbWriter(dh, maxsize=2)
+    writer.start()
+
+    writer.put(signals=[make_signal('A', 1)])
+    time.sleep(0.1)
+
+    # the first burst is being written, the next two fill the queue
+    writer.put(signals=[make_signal('B', 1)])
+    writer.put(signals=[make_signal('C', 1)])
+
+    blocked = threading.Thread(target=writer.put,
+                               kwargs={'signals': [make_signal('D', 1)]})
+    blocked.start()
+    time.sleep(0.1)
+    assert blocked.is_alive()
+    assert writer.stats()['depth'] == 2
+    assert writer.stats()['high_water'] == 2
+
+    dh.release.set()
+    blocked.join(1)
+    assert not blocked.is_alive()
+    writer.stop()
+
+    pvnames = [s['pvname'] for burst in dh.bursts for s in burst[1]]
+    assert pvnames == ['A', 'B', 'C', 'D']
+
+    stats = writer.stats()
+    assert stats['depth'] == 0
+    assert stats['writes'] == len(dh.bursts)
+    assert stats['max_latency'] >= 0.1
+
+
+def test_writer_latency():
+    dh = DbHandler('sqlite:///:memory:')
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'LER'}])
+
+    latency = LatencyStats()
+    writer = DbWriter(dh, latency=latency, persist_latency=True)
+    writer.start()
+
+    now = time.monotonic()
+    writer.put([{'abt_id': 1, 'abt_time': '2019-01-01 00:00:00.000000000'}],
+               [make_signal('A', 1), make_signal('B', 1)],
+               marks=[(1, now - 0.3, now - 0.2, now - 0.1),
+                      (1, now - 0.5, now - 0.45, now - 0.05)])
+    writer.stop()
+
+    summary = latency.summary()
+    assert summary['queue']['count'] == 2
+    assert summary['queue']['max'] > 0.09
+    assert summary['timestamp']['max'] > 0.39
+    assert summary['total']['max'] > 0.5
+
+    rows = dh.fetch_abort_latency()
+    assert len(rows) == 1
+    assert rows[0]['abt_id'] == 1
+    assert rows[0]['n_signals'] == 2
+    assert 0.09 < rows[0]['queue'] < 0.2
+    assert 0.39 < rows[0]['timestamp'] < 0.5
+    assert 0.1 <= rows[0]['write'] < 0.2
+    assert 0.5 <= rows[0]['total'] < 0.6
+
+
+def test_writer_drops_only_bad_burst():
+    dh = FailingDbHandler(ValueError('bad burst'))
+    writer = DbWriter(dh)
+    writer.start()
+
+    writer.put(signals=[make_signal('A', 1)])
+    time.sleep(0.1)
+
+    # B, BAD and C are coalesced into a transaction which fails
+    writer.put(signals=[make_signal('B', 1)])
+    writer.put(signals=[make_signal('BAD', 1)])
+    writer.put(signals=[make_signal('C', 1)])
+    dh.release.set()
+    writer.stop()
+
+    pvnames = [s['pvname'] for burst in dh.bursts for s in burst[1]]
+    assert pvnames == ['A', 'B', 'C']
+    assert writer.stats()['dropped'] == 1
+
+
+def test_writer_retry_limit():
+    error = sa.exc.OperationalError('INSERT', {}, 'database is locked')
+    dh = FailingDbHandler(error)
+    dh.release.set()
+    writer = DbWriter(dh, retry_interval=0, max_retries=2)
+    writer.start()
+
+    writer.put(signals=[make_signal('BAD', 1)])
+    writer.stop()
+
+    assert dh.calls == 3
+    assert writer.stats()['dropped'] == 1
+
+
+def test_writer_allocates_abort_ids():
+    dh = DbHandler('sqlite:///:memory:')
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'LER'}])
+
+    # another writer has taken the id 1 the producer uses as its key
+    dh.insert_abort_burst([{'abt_id': 1,
+                            'abt_time': '2018-12-31 00:00:00.000000000'}])
+
+    latency = LatencyStats()
+    writer = DbWriter(dh, latency=latency, persist_latency=True)
+    writer.start()
+
+    now = time.monotonic()
+    writer.put([{'abt_id': 1, 'abt_time': '2019-01-01 00:00:00.100000000'}],
+               [make_signal('A', 1)],
+               marks=[(1, now - 0.3, now - 0.2, now - 0.1)])
+    writer.put(signals=[make_signal('B', 1)],
+               updates=[{'abt_id': 1,
+                         'abt_time': '2019-01-01 00:00:00.000000000'}])
+    writer.stop()
+
+    assert writer.stats()['dropped'] == 0
+    signals = dh.fetch_abort_signals(first=False)
+    assert [(s['abt_id'], s['pvname']) for s in signals] == [(2, 'A'),
+                                                             (2, 'B')]
+    assert [(a['abt_id'], a['abt_time']) for a in dh.fetch_aborts()] == [
+            (1, '2018-12-31 00:00:00.000000000'),
+            (2, '2019-01-01 00:00:00.000000000')]
+    assert [r['abt_id'] for r in dh.fetch_abort_latency()] == [2]
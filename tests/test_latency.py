@@ -0,0 +1,41 @@
+import pytest
+
+from aborttl.latency import LatencyHistogram, LatencyStats
+
+
+def test_latency_histogram():
+    hist = LatencyHistogram()
+    assert hist.summary() == {'count': 0, 'p50': 0, 'p99': 0, 'max': 0}
+
+    for i in range(1, 101):
+        hist.add(i * 1e-3)
+
+    summary = hist.summary()
+    assert summary['count'] == 100
+    assert summary['max'] == 0.1
+    # within one bucket of the exact value
+    assert 0.05 <= summary['p50'] < 0.05 * 2 ** (1 / 8)
+    assert 0.099 <= summary['p99'] <= 0.1
+
+    hist.add(0)
+    assert hist.percentile(0) == 1e-6
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    stats.add(0, 0.001, 0.011, 0.111)
+
+    summary = stats.summary()
+    assert list(summary) == ['queue', 'timestamp', 'write', 'total']
+    assert summary['queue']['max'] == pytest.approx(0.001)
+    assert summary['timestamp']['max'] == pytest.approx(0.01)
+    assert summary['write']['max'] == pytest.approx(0.1)
+    assert summary['total']['max'] == pytest.approx(0.111)
+
+    lines = stats.dump().splitlines()
+    assert lines[0].split()[0] == 'stage'
+    assert lines[4].split() == ['total', '1', '111.000', '111.000',
+                                '111.000']
+
+    stats.clear()
+    assert stats.summary()['total']['count'] == 0
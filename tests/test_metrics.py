@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pvaccess as pva
+
+from aborttl.dbhandler import DbHandler
+from aborttl.aborttl import Aborttl
+from aborttl.metrics import MetricsServer
+
+
+class FakeCh(object):
+    def __init__(self, pvname, cb, logger=None, source=None):
+        self.connected = pvname != 'C'
+        self.abort = False
+
+
+def test_metrics_server(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('metrics.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'C', 'ring': 'LER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'},
+                           {'pvname': 'C', 'msg': 'Abort C'}])
+
+    atl = Aborttl(uri, 'ET_dummyHost:RESETw', channel_class=FakeCh,
+                  connection_timeout=0.1)
+
+    metrics = atl.metrics()
+    assert metrics['channels'] == 3
+    assert metrics['connected'] == 2
+    assert metrics['queue_depth'] == 0
+    assert metrics['reset_count'] == 0
+
+    server = MetricsServer(atl, 'TEST:ABORTTL', interval=0.1)
+    assert 'TEST:ABORTTL:CONNECTED' in server.pvnames
+    server.start()
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    assert atl.wait_ready(5)
+    time.sleep(0.5)
+
+    try:
+        ch = pva.Channel('TEST:ABORTTL:CONNECTED')
+        assert ch.get()['value'] == 2
+        ch = pva.Channel('TEST:ABORTTL:CHANNELS')
+        assert ch.get()['value'] == 3
+        ch = pva.Channel('TEST:ABORTTL:LOOP_TIME_MAX')
+        assert ch.get()['value'] >= 0
+    finally:
+        atl.stop()
+        thread.join()
+        server.stop()
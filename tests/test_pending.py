@@ -0,0 +1,113 @@
+import time
+
+from aborttl.abortch import AbortEvent, INVALID_TIMESTAMP
+from aborttl.pending import PendingScheduler, TimestampResolver
+
+
+def test_push_is_due_immediately():
+    ps = PendingScheduler()
+    ps.push('A', 'a', now=10)
+    ps.push('B', 'b', now=11)
+
+    assert len(ps) == 2
+    assert ps.next_deadline() == 10
+    assert ps.pop_due(now=10.5) == [('A', 'a', 10, 0)]
+    assert ps.pop_due(now=11) == [('B', 'b', 11, 0)]
+    assert len(ps) == 0
+    assert ps.next_deadline() is None
+
+
+def test_retry_backoff_and_timeout():
+    ps = PendingScheduler(retry_interval=0.1, backoff=2, max_interval=0.3,
+                          max_wait=1)
+    ps.push('A', 'a', now=0)
+
+    deadlines = []
+    now = 0
+    while True:
+        pvname, item, first_seen, n_retry = ps.pop_due(now=now)[0]
+        if not ps.retry(pvname, item, first_seen, n_retry, now=now):
+            break
+        now = ps.next_deadline()
+        deadlines.append(round(now, 6))
+
+    assert deadlines == [0.1, 0.3, 0.6, 0.9, 1.2]
+    assert ps.retries['A'] == 5
+    assert ps.timeouts['A'] == 1
+    assert ps.stats() == {'pending': 0, 'retries': 5, 'timeouts': 1}
+
+
+def test_new_edge_keeps_pending():
+    ps = PendingScheduler(retry_interval=0.1, max_wait=1)
+    ps.push('A', 'a1', now=0)
+    ps.push('B', 'b', now=0)
+    for pvname, item, first_seen, n_retry in ps.pop_due(now=0):
+        ps.retry(pvname, item, first_seen, n_retry, now=0)
+
+    ps.push('A', 'a2', now=0.05)
+
+    assert len(ps) == 3
+    assert ps.pop_due(now=0.05) == [('A', 'a2', 0.05, 0)]
+    assert ps.pop_due(now=0.2) == [('A', 'a1', 0, 1), ('B', 'b', 0, 1)]
+    assert ps.pop_due(now=1) == []
+
+
+def test_discard():
+    ps = PendingScheduler()
+    ps.push('A', 'a1', now=0)
+    ps.push('B', 'b', now=0)
+    ps.push('A', 'a2', now=0)
+
+    ps.discard('A')
+
+    assert len(ps) == 1
+    assert ps.pop_due(now=0) == [('B', 'b', 0, 0)]
+    assert ps.next_deadline() is None
+
+
+def test_timestamp_resolver():
+    valid = AbortEvent('A', True, 1, 2, 100, '2019-01-01 00:00:00.1',
+                       90, '2019-01-01 00:00:01.0')
+    invalid = valid._replace(timestamp=INVALID_TIMESTAMP)
+
+    class Channel(object):
+        event = invalid
+
+        def snapshot(self, event):
+            return self.event
+
+    ch = Channel()
+    resolver = TimestampResolver({'A': ch}, retry_interval=0, max_wait=0.1,
+                                 fallback='record')
+
+    assert resolver.resolve([invalid._replace(abort=False)]) == []
+    assert resolver.resolve([invalid]) == []
+    assert resolver.stats()['pending'] == 1
+
+    ch.event = valid
+    assert resolver.resolve([]) == [valid]
+
+    ch.event = invalid
+    resolver.resolve([invalid])
+    time.sleep(0.1)
+    assert resolver.resolve([]) == [invalid._replace(timestamp=valid.pv_ts,
+                                                     sec=valid.pv_sec)]
+    assert resolver.stats()['timeouts'] == 1
+
+    resolver = TimestampResolver({'A': ch}, retry_interval=0, max_wait=0,
+                                 fallback='unresolved')
+    assert resolver.resolve([invalid]) == []
+    assert resolver.resolve([]) == []
+    assert resolver.stats() == {'pending': 0, 'retries': 0, 'timeouts': 1}
+
+
+def test_timestamp_resolver_latency_marks():
+    event = AbortEvent('A', True, 1, 2, 100, '2019-01-01 00:00:00.1',
+                       90, '2019-01-01 00:00:01.0', t_cb=time.monotonic())
+
+    resolver = TimestampResolver({}, retry_interval=0, max_wait=0.1)
+    resolved = resolver.resolve([event])
+
+    assert len(resolved) == 1
+    assert resolved[0].t_cb == event.t_cb
+    assert event.t_cb <= resolved[0].t_dq <= time.monotonic()
@@ -0,0 +1,179 @@
+import pvaccess as pva
+import pytest
+
+from aborttl.pvarpc_server import AbortRPC
+from aborttl.dbhandler import ts_to_ns
+from aborttl.rpccache import ResultCache
+
+
+@pytest.fixture
+def rpc(tmpdir, mock_data):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('rpc.db')))
+    rpc = AbortRPC(uri)
+
+    dh = rpc._dh
+    dh.insert_pvs(mock_data['pvs'])
+    for abort in mock_data['aborts']:
+        dh.insert_abort(abort['abt_time'])
+
+    signals = mock_data['abort_signals']
+    for link in mock_data['abort_list']:
+        signal = signals[link['abt_signal_id'] - 1]
+        dh.insert_abort_signals([signal], abt_id=link['abt_id'])
+
+    return rpc
+
+
+def request(**fields):
+    x = pva.PvObject({key: pva.STRING for key in fields})
+    for key, value in fields.items():
+        x[key] = value
+    return x
+
+
+def rejected(result):
+    return isinstance(result, pva.PvBoolean) and not result.get()
+
+
+def test_signals_request(rpc):
+    table = rpc.get_signals(request(starttime='2018-01-01T00:00:00',
+                                    endtime='2018-01-10T00:00:00'))
+    assert len(table['value']['column0']) == 15
+    assert not table.hasField('cursor')
+
+    table = rpc.get_signals(request(starttime='2018-01-01T00:00:00',
+                                    endtime='2018-01-10T00:00:00',
+                                    message='abort c', match='token'))
+    assert table['value']['column3'] == ['C', 'C']
+
+    assert rejected(rpc.get_signals(request(starttime='2018-01-01',
+                                            endtime='2018-01-10',
+                                            message='C', match='regex')))
+
+
+@pytest.mark.parametrize('service', ['get_signals', 'get_grouped_signals',
+                                     'get_annotations'])
+def test_time_request(rpc, service):
+    table = getattr(rpc, service)(request(
+            starttime='2018-01-01T00:00:00.000Z',
+            endtime='2018-1-10'))
+    assert not rejected(table)
+
+    for starttime in ['now-6h', '2018-01-01T00:00:00.000+09:00', '2018/01/01']:
+        assert rejected(getattr(rpc, service)(request(
+                starttime=starttime, endtime='2018-01-10')))
+    assert rejected(getattr(rpc, service)(request(starttime='2018-01-01',
+                                                  endtime='now')))
+
+
+@pytest.mark.parametrize('service', ['get_signals', 'get_grouped_signals'])
+def test_paged_request(rpc, service):
+    fields = {'starttime': '2018-01-01T00:00:00',
+              'endtime': '2018-01-10T00:00:00'}
+    table = getattr(rpc, service)(request(**fields))
+    rows = list(zip(*[table['value']['column{}'.format(i)]
+                      for i in range(6)]))
+
+    paged = []
+    cursor = ''
+    while True:
+        table = getattr(rpc, service)(request(limit='4', cursor=cursor,
+                                              **fields))
+        columns = [table['value']['column{}'.format(i)] for i in range(6)]
+        assert len(columns[0]) <= 4
+        paged += list(zip(*columns))
+
+        cursor = table['cursor']
+        if not cursor:
+            break
+
+    assert paged == rows
+
+    assert rejected(getattr(rpc, service)(request(limit='4', cursor='1,2',
+                                                  **fields)))
+    assert rejected(getattr(rpc, service)(request(limit='-1', **fields)))
+
+
+def test_result_cache(rpc):
+    past = request(starttime='2018-01-01T00:00:00',
+                   endtime='2018-01-10T00:00:00')
+    live = request(starttime='2018-01-01T00:00:00',
+                   endtime='2100-01-01T00:00:00')
+
+    table = rpc.get_signals(past)
+    assert rpc.get_signals(past) is table
+    assert len(rpc.get_signals(live)['value']['column0']) == 15
+    assert len(rpc.get_signals(live)['value']['column0']) == 15
+    ann = rpc.get_annotations(live)
+    assert rpc.get_annotations(live) is ann
+    assert rpc.cache_stats()['hits'] == 3
+
+    # a new burst invalidates only the windows covering now
+    rpc._dh.insert_abort_burst(
+            aborts=[{'abt_id': 7, 'abt_time': '2018-01-07 00:00:00.0'}],
+            signals=[{'pvname': 'A', 'msg': 'Abort A',
+                      'pv_ts': '2018-01-07 00:00:00.0',
+                      'abt_ts': '2018-01-07 00:00:00.0', 'reset_cnt': 0,
+                      'trg_cnt': 0, 'int_cnt': 0, 'abt_id': 7}])
+    assert rpc.get_signals(past) is table
+    assert len(rpc.get_signals(live)['value']['column0']) == 16
+    assert rpc.get_annotations(live) is not ann
+
+    stats = rpc.cache_stats()
+    assert (stats['hits'], stats['misses'], stats['invalidations']) == \
+        (4, 5, 2)
+
+    pv = rpc.get_cache_stats(request())
+    assert pv['hits'] == 4 and pv['entries'] == 3
+
+    rpc._cache.max_bytes = 0
+    assert rpc.get_signals(past) is not table
+    assert rpc.cache_stats()['hits'] == 4
+
+
+def test_result_cache_eviction():
+    cache = ResultCache(100)
+    cache.put('a', 1, 40, None)
+    cache.put('b', 2, 40, None)
+    assert cache.get('a', None) == 1
+
+    cache.put('c', 3, 40, None)
+    assert cache.get('b', None) is None
+    assert cache.get('a', None) == 1
+    assert cache.get('c', None) == 3
+
+    cache.put('d', 4, 200, None)
+    assert cache.get('d', None) is None
+    assert cache.get('a', (1, 1)) is None
+
+    assert cache.stats() == {'hits': 3, 'misses': 3, 'invalidations': 1,
+                             'evictions': 1, 'entries': 1, 'bytes': 40}
+
+
+def test_data2annotation(rpc):
+    data = {'abt_id': [1, 1, 1, 2, 3],
+            'ts': ['2018-01-01 00:00:00.123456789',
+                   '2018-01-01 00:00:00.2', '2018-01-01 00:00:01.0',
+                   '2018-01-02 00:00:00.0', '2018-01-03 00:00:00.0'],
+            'ts_ns': [1514732400123456789, 1514732400200000000,
+                      1514732401000000000, 1514818800000000000,
+                      1514905200000000000],
+            'msg': ['Abort A', '', 'Abort B', 'Abort C', ''],
+            'ring': ['HER', 'LER', 'LER', 'HER', 'HER']}
+
+    assert rpc.data2annotation(data) == {
+            'time': [1514732400123, 1514818800000],
+            'title': ['Abort A', 'Abort C'],
+            'tags': ['HER', 'HER'],
+            'text': ['2018-01-01 00:00:00.123456789 Abort A</br>'
+                     '2018-01-01 00:00:01.0 Abort B',
+                     '2018-01-02 00:00:00.0 Abort C']}
+
+    table = rpc.get_annotations(request(starttime='2018-01-01T00:00:00',
+                                        endtime='2018-01-10T00:00:00'))
+    first = {}
+    for row in rpc._dh.fetch_abort_signals(astart='2018-01-01 00:00:00',
+                                           aend='2018-01-10 00:00:00'):
+        first.setdefault(row['abt_id'], row['ts'])
+    assert list(table['value']['column0']) == [
+            ts_to_ns(ts) // 1000000 for ts in first.values()]
@@ -0,0 +1,122 @@
+import threading
+import time
+from datetime import datetime
+
+from aborttl.dbhandler import DbHandler
+from aborttl.aborttl import Aborttl
+from aborttl.replay import (TraceEntry, ReplaySource, load_trace,
+                            dump_trace)
+
+
+TRACE = [
+    TraceEntry(0, 'A', 1, [0, 0], [1546268400, 100000000]),
+    TraceEntry(0.01, 'B', 1, [1, 0], [1546268400, 50000000]),
+    TraceEntry(0.02, 'C', 1, [0, 1], [1546268401, 0]),
+    TraceEntry(0.5, 'RESET', 1, None, None),
+    TraceEntry(0.6, 'RESET', 0, None, None),
+    TraceEntry(0.7, 'A', 1, [2, 0], [1546268402, 0]),
+]
+
+
+def local_ts(sec, nsec):
+    dt = datetime.fromtimestamp(sec)
+    return '{}.{:09d}'.format(dt.isoformat(' '), nsec)
+
+
+def test_replay_aborttl(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('replay.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'C', 'ring': 'LER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'ABC'])
+
+    path = str(tmpdir.join('trace.json'))
+    dump_trace(TRACE, path)
+    source = ReplaySource(load_trace(path), speed=1)
+
+    atl = Aborttl(uri, 'RESET', source=source)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    assert atl.wait_ready(5)
+
+    source.start()
+    source.join(5)
+    time.sleep(0.2)
+
+    atl.stop()
+    thread.join()
+
+    aborts = dh.fetch_aborts()
+    assert [(a['abt_id'], a['abt_time']) for a in aborts] == [
+        (1, local_ts(1546268400, 50000000))]
+
+    signals = dh.fetch_abort_signals(first=False)
+    assert [(s['abt_id'], s['pvname'], s['ts'], s['reset_cnt'],
+             s['trg_cnt'], s['int_cnt']) for s in signals] == [
+        (1, 'A', local_ts(1546268400, 100000000), 0, 0, 0),
+        (1, 'B', local_ts(1546268400, 50000000), 0, 0, 1),
+        (1, 'C', local_ts(1546268401, 0), 0, 1, 0),
+        (1, 'A', local_ts(1546268402, 0), 1, 0, 2)]
+
+
+def test_replay_speed():
+    trace = [TraceEntry(i * 0.1, 'A', i % 2, None, None) for i in range(11)]
+    values = []
+
+    def cb(pvname=None, value=None, **kw):
+        values.append(value)
+
+    source = ReplaySource(trace, speed=10)
+    pv = source('A', callback=cb)
+
+    start = time.monotonic()
+    source.play()
+    elapsed = time.monotonic() - start
+
+    assert 0.1 <= elapsed < 0.5
+    assert values == [0] + [i % 2 for i in range(11)]
+    assert pv.value == 0
+
+    pv.disconnect()
+    source.speed = 0
+    source.play()
+    assert len(values) == 12
+
+
+def test_replay_accelerated_bursts(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('replay.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    # without a clock the bursts reach the loop in the same batch
+    trace = []
+    for burst in range(3):
+        sec = 1546268400 + burst * 10
+        trace += [TraceEntry(burst, 'A', 1, [0, 0], [sec, 0]),
+                  TraceEntry(burst, 'B', 1, [1, 0], [sec, 1]),
+                  TraceEntry(burst + 0.5, 'A', 0, None, None),
+                  TraceEntry(burst + 0.5, 'B', 0, None, None)]
+    source = ReplaySource(trace, speed=0)
+
+    atl = Aborttl(uri, 'RESET', source=source, batch_delay=0.1)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    assert atl.wait_ready(5)
+
+    source.play()
+    time.sleep(0.3)
+
+    atl.stop()
+    thread.join()
+
+    aborts = dh.fetch_aborts()
+    assert [(a['abt_id'], a['abt_time']) for a in aborts] == [
+        (1, local_ts(1546268400, 0)),
+        (2, local_ts(1546268410, 0)),
+        (3, local_ts(1546268420, 0))]
+    assert atl.stats()['events'] == 12
@@ -0,0 +1,61 @@
+import time
+
+from aborttl.dbhandler import DbHandler
+from aborttl.pvarpc_server import AbortRPC
+from aborttl.replica import Replica
+
+
+def test_replica(tmpdir, mock_data):
+    primary = str(tmpdir.join('primary.db'))
+    dh = DbHandler('sqlite:///' + primary, 'wal')
+    dh.insert_pvs(mock_data['pvs'])
+    dh.insert_abort_signals(mock_data['abort_signals'][:10])
+
+    replica = Replica(primary, str(tmpdir.join('replica.db')), interval=0.1)
+    assert replica.stats()['staleness'] is None
+
+    replica.refresh()
+    rdh = DbHandler(replica.uri)
+    assert rdh.engine.execute('PRAGMA journal_mode').scalar() == 'delete'
+    assert rdh.fetch_data_version() == (0, 10)
+
+    # the replica keeps the old data until the next refresh
+    dh.insert_abort_signals(mock_data['abort_signals'][10:])
+    time.sleep(0.05)
+    assert rdh.fetch_data_version() == (0, 10)
+    assert replica.stats()['staleness'] >= 0.05
+
+    replica.start()
+    time.sleep(0.3)
+    replica.stop()
+    assert rdh.fetch_data_version() == (0, 15)
+
+    stats = replica.stats()
+    assert stats['refreshes'] >= 3
+    assert stats['failures'] == 0
+    assert stats['staleness'] < 0.3
+
+
+def test_replica_rpc(tmpdir, mock_data):
+    primary = str(tmpdir.join('primary.db'))
+    dh = DbHandler('sqlite:///' + primary, 'wal')
+    dh.insert_pvs(mock_data['pvs'])
+    for abort in mock_data['aborts']:
+        dh.insert_abort(abort['abt_time'])
+
+    replica = Replica(primary, str(tmpdir.join('replica.db')))
+    replica.refresh()
+    rpc = AbortRPC('sqlite:///' + primary, settle=0, replica=replica)
+
+    # a window ending after the copy is not settled yet
+    assert rpc._is_settled('2018-01-10 00:00:00')
+    assert not rpc._is_settled(time.strftime('%Y-%m-%d %H:%M:%S',
+                                             time.localtime(time.time() + 1)))
+
+    pv = rpc.get_replica_stats(None)
+    assert pv['refreshes'] == 1 and pv['staleness'] >= 0
+
+    dh.insert_abort('2019-01-01 00:00:00.000000000')
+    assert rpc._dh.fetch_last_abort_id() == 6
+    replica.refresh()
+    assert rpc._dh.fetch_last_abort_id() == 7
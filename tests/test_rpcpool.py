@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pvaccess as pva
+
+from aborttl.rpcpool import RpcPool
+
+
+def reply(x):
+    return pva.PvObject({'value': pva.DOUBLE}, {'value': time.monotonic()})
+
+
+def worker_reply(worker, x):
+    return reply(x)
+
+
+def test_rpc_pool_queue():
+    release = threading.Event()
+    workers = []
+
+    def factory():
+        worker = object()
+        workers.append(worker)
+        return worker
+
+    def blocked(worker, x):
+        release.wait(5)
+        return reply(x)
+
+    pool = RpcPool(factory, n_workers=1, max_queue=1)
+    pool.register('TEST:POOL:blocked', blocked)
+    pool.register('TEST:POOL:free', reply, limited=False)
+    pool.start()
+
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       pool.call('TEST:POOL:blocked', None)))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+
+        # one request runs and one waits, so the next one is rejected
+        rejected = pool.call('TEST:POOL:blocked', None)
+        assert isinstance(rejected, pva.PvBoolean) and not rejected.get()
+        assert isinstance(pool.call('TEST:POOL:free', None), pva.PvObject)
+
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 2
+    finally:
+        pool.stop()
+
+    assert len(workers) == 1
+
+    stats = pool.stats()
+    assert stats['TEST:POOL:blocked']['requests'] == 2
+    assert stats['TEST:POOL:blocked']['rejected'] == 1
+    assert stats['TEST:POOL:blocked']['wait']['max'] >= 0.05
+    assert stats['TEST:POOL:free']['requests'] == 1
+
+    metrics = pool.get_metrics(None)
+    assert metrics['TEST_POOL_blocked.rejected'] == 1
+
+
+def test_rpc_pool_workers():
+    threads = []
+
+    def factory():
+        return threading.current_thread()
+
+    def own(worker, x):
+        # each worker runs in its own thread
+        assert worker is threading.current_thread()
+        threads.append(worker)
+        time.sleep(0.2)
+        return reply(x)
+
+    pool = RpcPool(factory, n_workers=2)
+    pool.register('TEST:POOL:a', own)
+    pool.register('TEST:POOL:b', own)
+    pool.start()
+    assert pool.max_queue == 2
+
+    try:
+        callers = [threading.Thread(target=pool.call, args=(name, None))
+                   for name in ('TEST:POOL:a', 'TEST:POOL:b')]
+        start = time.monotonic()
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        assert time.monotonic() - start < 0.35
+    finally:
+        pool.stop()
+
+    assert len(set(threads)) == 2
+
+
+def test_rpc_pool_servers():
+    def slow(worker, x):
+        time.sleep(1)
+        return reply(x)
+
+    pool = RpcPool(lambda: None)
+    pool.register('TEST:POOL:slow', slow)
+    pool.register('TEST:POOL:fast', worker_reply)
+    pool.start()
+    time.sleep(2)
+
+    request = pva.PvObject({'value': pva.STRING}, {'value': ''})
+    try:
+        thread = threading.Thread(
+                target=lambda: pva.RpcClient('TEST:POOL:slow').invoke(
+                    request, 5))
+        thread.start()
+        time.sleep(0.2)
+
+        # the fast service does not wait for the slow one
+        start = time.monotonic()
+        pva.RpcClient('TEST:POOL:fast').invoke(request, 5)
+        assert time.monotonic() - start < 0.7
+        thread.join()
+    finally:
+        pool.stop()
+
+    stats = pool.stats()
+    assert stats['TEST:POOL:slow']['run']['max'] >= 1
+    assert stats['TEST:POOL:fast']['requests'] == 1
@@ -0,0 +1,320 @@
+import threading
+import time
+
+from aborttl.abortch import AbortEvent, INVALID_TIMESTAMP
+from aborttl.dbhandler import DbHandler
+from aborttl.shard import ShardedAborttl
+
+
+TIMESTAMPS = {'A': '2019-01-01 00:00:00.300000000',
+              'B': '2019-01-01 00:00:00.100000000',
+              'C': '2019-01-01 00:00:00.200000000',
+              'D': '2019-01-01 00:00:01.000000000',
+              'E': '2019-01-01 00:00:02.000000000'}
+
+
+class FakeCh(object):
+    def __init__(self, pvname, cb, logger=None):
+        self.connected = True
+        self.abort = False
+
+        ts = TIMESTAMPS[pvname]
+        self._event = AbortEvent(pvname, True, 1, 2, 1546268400, ts,
+                                 1546268400, ts)
+
+        # channels abort in the order of their timestamps, as the abort
+        # time depends on the order of the channels of both rings
+        delay = 1 + 0.1 * sorted(TIMESTAMPS, key=TIMESTAMPS.get).index(pvname)
+        timer = threading.Timer(delay, cb, args=(self._event,))
+        timer.daemon = True
+        timer.start()
+
+    def snapshot(self, event=None):
+        return self._event
+
+    def disconnect(self):
+        pass
+
+
+class ClearCh(FakeCh):
+    '''
+    A aborts and clears, then B aborts within a pass of the worker.
+    '''
+
+    def __init__(self, pvname, cb, logger=None):
+        self.connected = True
+        self.abort = False
+
+        ts = TIMESTAMPS[pvname]
+        self._event = AbortEvent(pvname, True, 1, 2, 1546268400, ts,
+                                 1546268400, ts)
+        events = [self._event]
+        if pvname == 'A':
+            events.append(self._event._replace(abort=False))
+
+        def fire():
+            for event in events:
+                cb(event)
+
+        timer = threading.Timer(1 if pvname == 'A' else 1.05, fire)
+        timer.daemon = True
+        timer.start()
+
+
+class SilentCh(object):
+    '''
+    E is in abort from the start and no channel changes.
+    '''
+
+    def __init__(self, pvname, cb, logger=None):
+        self.connected = True
+        self.abort = pvname == 'E'
+
+    def disconnect(self):
+        pass
+
+
+def wait_events(atl, n_events):
+    start = time.monotonic()
+    while atl.stats()['events'] < n_events:
+        assert time.monotonic() - start < 30
+        time.sleep(0.1)
+
+
+def test_sharded_aborttl(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'C', 'ring': 'LER'},
+                   {'pvname': 'D', 'ring': 'LER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'ABCD'])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=2,
+                         channel_class=FakeCh)
+    assert atl.stats()['workers'] == 2
+
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+
+    wait_events(atl, 4)
+    assert atl.stats()['startup']['connected'] == 4
+    assert atl.metrics()['connected'] == 4
+
+    atl.stop()
+    thread.join()
+
+    signals = dh.fetch_abort_signals(first=False)
+    assert sorted((s['abt_id'], s['pvname'], s['ts']) for s in signals) == [
+        (1, pvname, TIMESTAMPS[pvname]) for pvname in 'ABCD']
+
+    aborts = dh.fetch_aborts()
+    assert [(a['abt_id'], a['abt_time']) for a in aborts] == [
+        (1, TIMESTAMPS['B'])]
+    assert atl.stats()['workers'] == 0
+
+
+def test_sharded_aborttl_reload(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'},
+                   {'pvname': 'E', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'B', 'msg': 'Abort B'}])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=2,
+                         channel_class=FakeCh)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    wait_events(atl, 2)
+
+    dh.update_current_pvs([{'pvname': 'B', 'msg': 'Abort B'},
+                           {'pvname': 'E', 'msg': 'Abort E'}])
+    atl.request_reload()
+    wait_events(atl, 3)
+
+    atl.stop()
+    thread.join()
+
+    assert atl._shard_of == {'B': 1, 'E': 0}
+
+    signals = dh.fetch_abort_signals(first=False)
+    assert sorted(s['pvname'] for s in signals) == ['A', 'B', 'E']
+
+
+def test_sharded_aborttl_reload_in_abort(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'E', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'}])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=2,
+                         channel_class=SilentCh)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    assert atl.wait_ready(30)
+
+    # E is in abort when it is added
+    dh.update_current_pvs([{'pvname': 'A', 'msg': 'Abort A'},
+                           {'pvname': 'E', 'msg': 'Abort E'}])
+    atl.request_reload()
+
+    start = time.monotonic()
+    while not atl._ring_status.is_abort('HER'):
+        assert time.monotonic() - start < 30
+        time.sleep(0.1)
+
+    atl.stop()
+    thread.join()
+
+
+def test_sharded_aborttl_stop_timeout(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=2,
+                         channel_class=FakeCh)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    wait_events(atl, 2)
+
+    # the workers still running are terminated
+    start = time.monotonic()
+    atl.stop(timeout=0)
+    thread.join()
+    assert time.monotonic() - start < 5
+    assert atl.stats()['workers'] == 0
+
+
+def test_sharded_aborttl_worker_exit(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=2,
+                         channel_class=FakeCh)
+    errors = []
+
+    def run():
+        try:
+            atl.run()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_events(atl, 2)
+
+    # the loop stops when a worker exits before stop
+    atl._workers[0].terminate()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+
+    atl.stop()
+    assert atl.stats()['workers'] == 0
+
+
+def test_sharded_aborttl_clear_in_pass(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=1,
+                         channel_class=ClearCh, batch_delay=0.2)
+    thread = threading.Thread(target=atl.run)
+    thread.start()
+    wait_events(atl, 3)
+
+    atl.stop()
+    thread.join()
+
+    # B aborts after the ring is cleared, so it is a new abort
+    signals = dh.fetch_abort_signals(first=False)
+    assert sorted((s['abt_id'], s['pvname']) for s in signals) == [
+        (1, 'A'), (2, 'B')]
+    aborts = dh.fetch_aborts()
+    assert [(a['abt_id'], a['abt_time']) for a in aborts] == [
+        (1, TIMESTAMPS['A']), (2, TIMESTAMPS['B'])]
+
+
+def test_sharded_aborttl_late_edge(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    # the coordinator is fed with the messages of a worker directly
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=0)
+    atl._initial_abort_check()
+    atl._writer.start()
+
+    ts_a = '2019-01-01 00:00:00.000000000'
+    ts_b = '2019-01-01 01:00:00.000000000'
+    edge_a = AbortEvent('A', True, 1, 2, 1546268400, INVALID_TIMESTAMP,
+                        1546268400, ts_a, seq=1)
+    edge_b = AbortEvent('B', True, 1, 2, 1546272000, ts_b,
+                        1546272000, ts_b, seq=1)
+    stats = {'pending': 0, 'retries': 0, 'timeouts': 0, 'connected': 2}
+
+    # A aborts and clears before its timestamp is updated
+    atl._run_loop([('events', 0, [edge_a, edge_a._replace(abort=False)],
+                    [], stats)])
+    atl._run_loop([('events', 0, [],
+                    [(0, edge_a._replace(timestamp=ts_a))], stats)])
+    atl._run_loop([('events', 0, [edge_b], [(1, edge_b)], stats)])
+    atl._writer.stop()
+
+    signals = dh.fetch_abort_signals(first=False, include_no_abt_id=True)
+    assert sorted((s['pvname'], s['abt_id']) for s in signals) == [
+        ('A', None), ('B', 1)]
+    assert [(a['abt_id'], a['abt_time']) for a in dh.fetch_aborts()] == [
+        (1, ts_b)]
+
+
+def test_sharded_aborttl_merge_by_callback_time(tmpdir):
+    uri = 'sqlite:///{}'.format(str(tmpdir.join('database.db')))
+    dh = DbHandler(uri)
+    dh.insert_pvs([{'pvname': 'A', 'ring': 'HER'},
+                   {'pvname': 'B', 'ring': 'HER'}])
+    dh.update_current_pvs([{'pvname': pvname, 'msg': 'Abort ' + pvname}
+                           for pvname in 'AB'])
+
+    atl = ShardedAborttl(uri, 'ET_dummyHost:RESETw', n_workers=0)
+    atl._initial_abort_check()
+    atl._writer.start()
+
+    edge_a = AbortEvent('A', True, 1, 2, 1546268400, TIMESTAMPS['A'],
+                        1546268400, TIMESTAMPS['A'], t_cb=2, t_dq=2, seq=1)
+    edge_b = AbortEvent('B', True, 1, 2, 1546268400, TIMESTAMPS['B'],
+                        1546268400, TIMESTAMPS['B'], t_cb=1, t_dq=1, seq=1)
+    clear_b = edge_b._replace(abort=False, t_cb=3, seq=2)
+    stats = {'pending': 0, 'retries': 0, 'timeouts': 0, 'connected': 1}
+
+    atl._run_loop([('events', 1, [edge_b], [(1, edge_b)], stats)])
+
+    # the clear of B arrives first, but A aborts before it
+    atl._run_loop([('events', 1, [clear_b], [], stats),
+                   ('events', 0, [edge_a], [(1, edge_a)], stats)])
+    atl._writer.stop()
+
+    assert atl._ring_status.is_abort('HER')
+    signals = dh.fetch_abort_signals(first=False)
+    assert sorted((s['pvname'], s['abt_id']) for s in signals) == [
+        ('A', 1), ('B', 1)]
+    assert len(dh.fetch_aborts()) == 1
@@ -49,7 +49,7 @@ def test_first_update_pvs_list(uri, dh, testdata, tmpdir):
     for i in ler_list:
         pler.write('{}, {}\n'.format(i['pvname'], i['msg']), mode='a')
 
-    update_pvs_list(uri, str(pher), str(pler))
+    update_pvs_list(dh, str(pher), str(pler))
 
     current_pvs = dh.fetch_current_pvs()
 
@@ -73,7 +73,7 @@ def test_second_update_pvs_list(uri, dh, testdata, tmpdir, tmpdir_factory):
     for i in ler_list:
         pler.write('{}, {}\n'.format(i['pvname'], i['msg']), mode='a')
 
-    update_pvs_list(uri, str(pher), str(pler))
+    update_pvs_list(dh, str(pher), str(pler))
     pvs = dh.fetch_all_pvs()
 
     td = (